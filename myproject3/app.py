@@ -1,5 +1,7 @@
 import os
+import hmac
 import logging
+import time
 import uuid
 import sqlite3
 import traceback
@@ -7,14 +9,14 @@ import random
 from io import BytesIO
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify, send_file, stream_with_context
 import string
 from flask_login import login_required, LoginManager, login_user, logout_user, current_user
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import inspect, text
 from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import base64
@@ -23,22 +25,50 @@ from dotenv import load_dotenv
 
 # Support both package and script execution contexts
 try:
-    from .models import db, User, PetProfile, HealthHistory, Reminder, Consultation, VETERINARY_CLINICS
+    from .models import db, User, PetProfile, HealthHistory, HealthHistoryDiagnosis, Reminder, Consultation, AIResponseCache, DiagnosisExplanation, ImageAnalysisCache, VETERINARY_CLINICS, normalize_name
 except ImportError:  # when run as a script (python app.py)
-    from models import db, User, PetProfile, HealthHistory, Reminder, Consultation, VETERINARY_CLINICS
+    from models import db, User, PetProfile, HealthHistory, HealthHistoryDiagnosis, Reminder, Consultation, AIResponseCache, DiagnosisExplanation, ImageAnalysisCache, VETERINARY_CLINICS, normalize_name
 
 try:
     from .gemini import (
-        analyze_pet_symptoms,
+        analyze_pet_symptoms_batch,
+        analyze_pet_symptoms_stream,
         analyze_pet_image,
-        get_diagnosis_explanation_from_gemini,
+        attach_response_store,
+        call_metrics,
+        generate_diagnosis_explanation,
+        get_fallback_explanation,
+        image_cache_context,
+        model_scoreboard,
+        response_cache_stats,
     )
+    from . import deadlines
+    from .explanation_catalog import ExplanationCatalog, is_known_diagnosis
+    from .knowledge_base import KNOWLEDGE_BASE
+    from .migrations import pending as schema_migrations_pending, stamp as stamp_schema_migrations
+    from .response_cache import ImageAnalysisStore, SqlResponseStore
+    from .symptom_rf_model import SIDECAR as RF_SIDECAR, load_model as load_symptom_rf_model
+    from .triage_router import GEMINI, LOCAL, LOCAL_FALLBACK, TRIAGE_ROUTER, fallback_analysis
 except ImportError:  # when run as a script
     from gemini import (
-        analyze_pet_symptoms,
+        analyze_pet_symptoms_batch,
+        analyze_pet_symptoms_stream,
         analyze_pet_image,
-        get_diagnosis_explanation_from_gemini,
+        attach_response_store,
+        call_metrics,
+        generate_diagnosis_explanation,
+        get_fallback_explanation,
+        image_cache_context,
+        model_scoreboard,
+        response_cache_stats,
     )
+    import deadlines
+    from explanation_catalog import ExplanationCatalog, is_known_diagnosis
+    from knowledge_base import KNOWLEDGE_BASE
+    from migrations import pending as schema_migrations_pending, stamp as stamp_schema_migrations
+    from response_cache import ImageAnalysisStore, SqlResponseStore
+    from symptom_rf_model import SIDECAR as RF_SIDECAR, load_model as load_symptom_rf_model
+    from triage_router import GEMINI, LOCAL, LOCAL_FALLBACK, TRIAGE_ROUTER, fallback_analysis
 
 app = Flask(__name__)
 # Setup logging
@@ -92,17 +122,84 @@ print("=======================")
 # Initialize SQLAlchemy
 db.init_app(app)
 
-# Ensure tables exist without deleting existing data
+# Ensure tables exist without deleting existing data; changes to existing
+# tables are migrations, applied with `python migrations.py upgrade`
 with app.app_context():
+    fresh_database = not inspect(db.engine).get_table_names()
     db.create_all()
-    inspector = inspect(db.engine)
-    if inspector.has_table("pet_profile"):
-        pet_columns = {col["name"] for col in inspector.get_columns("pet_profile")}
-        with db.engine.begin() as conn:
-            if "weight_kg" not in pet_columns:
-                conn.execute(text("ALTER TABLE pet_profile ADD COLUMN weight_kg FLOAT"))
-            if "gender" not in pet_columns:
-                conn.execute(text("ALTER TABLE pet_profile ADD COLUMN gender VARCHAR(20)"))
+    try:
+        if fresh_database:
+            # create_all() just built the current schema; there is nothing to migrate
+            stamp_schema_migrations(db.engine)
+        pending_migrations = schema_migrations_pending(db.engine)
+        if pending_migrations:
+            logging.warning(
+                f"Database schema is behind: {len(pending_migrations)} pending migration(s) "
+                f"{[m[0] for m in pending_migrations]}; run `python migrations.py upgrade`"
+            )
+    except Exception as e:
+        logging.warning(f"Could not check schema migrations: {e}")
+
+    # Shared tier of the Gemini symptom-analysis cache
+    attach_response_store(SqlResponseStore(
+        db.engine,
+        AIResponseCache.__table__,
+        max_rows=int(os.environ.get("GEMINI_RESPONSE_CACHE_MAX_ROWS", 10000)),
+    ))
+
+    # Image analyses by content hash (see check_image_analysis_cache)
+    IMAGE_ANALYSIS_CACHE = ImageAnalysisStore(
+        db.engine,
+        ImageAnalysisCache.__table__,
+        ttl=float(os.environ.get("IMAGE_ANALYSIS_CACHE_TTL", 30 * 24 * 3600)),
+        max_rows=int(os.environ.get("IMAGE_ANALYSIS_CACHE_MAX_ROWS", 20000)),
+    )
+
+    # Precomputed diagnosis explanations (build with `python explanation_catalog.py build`)
+    EXPLANATION_CATALOG = ExplanationCatalog(
+        db.engine,
+        DiagnosisExplanation.__table__,
+        is_known=lambda key: is_known_diagnosis(db.engine, HealthHistoryDiagnosis.__table__, key),
+    )
+
+# RandomForest triage model from its prebuilt artifact (`python symptom_rf_model.py build`),
+# unless inference is delegated to the sidecar (`python rf_inference.py serve`)
+if RF_SIDECAR is None:
+    load_symptom_rf_model()
+
+
+# Every request gets a time budget that Gemini calls respect; keep it below the
+# worker timeout so slow upstream models degrade to local answers instead of
+# pinning workers. A caller (or proxy) may ask for less via X-Request-Timeout-Ms.
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", 25))
+
+
+@app.before_request
+def start_request_deadline():
+    budget = REQUEST_DEADLINE_SECONDS
+    requested = request.headers.get("X-Request-Timeout-Ms")
+    if requested:
+        try:
+            budget = min(budget, max(0.0, float(requested) / 1000.0))
+        except ValueError:
+            pass
+    request.environ["deadline.token"] = deadlines.start(budget)
+
+
+@app.before_request
+def pin_knowledge_base():
+    # A knowledge-base reload mid-request must not mix versions within one answer.
+    request.environ["knowledge_base.token"] = KNOWLEDGE_BASE.pin()
+
+
+@app.teardown_request
+def clear_request_deadline(exc=None):
+    token = request.environ.pop("deadline.token", None)
+    if token is not None:
+        deadlines.reset(token)
+    token = request.environ.pop("knowledge_base.token", None)
+    if token is not None:
+        KNOWLEDGE_BASE.unpin(token)
 
 
 # =====================
@@ -156,33 +253,10 @@ def dashboard():
     data = []
     for h in health_history:
         pet = next((p for p in pets if p.id == h.pet_id), None)
-
-        # ✅ Ensure possible_causes is always a list
-        causes = h.possible_causes
-        if isinstance(causes, str):
-            try:
-                causes = json.loads(causes)  # If stored as JSON string
-            except json.JSONDecodeError:
-                causes = [c.strip() for c in causes.split(",") if c.strip()]
-
-        # ✅ Ensure diagnosis is always a list
-        diagnosis = h.diagnosis
-        if isinstance(diagnosis, str):
-            try:
-                diagnosis = json.loads(diagnosis)  # If stored as JSON string
-            except json.JSONDecodeError:
-                diagnosis = [d.strip() for d in diagnosis.split(",") if d.strip()]
-
         data.append({
-            'id': h.id,
-            'pet_id': h.pet_id,
+            **h.to_dict(),
             'pet_name': pet.name if pet else "Unknown",
             'date': h.date,
-            'symptoms': h.symptoms,
-            'diagnosis': diagnosis,            # ✅ Fixed
-            'recommendation': h.recommendation,
-            'urgency_level': h.urgency_level,
-            'possible_causes': causes          # ✅ Already fixed
         })
 
     return render_template('dashboard.html',
@@ -216,7 +290,7 @@ def export_summary(consultation_id):
             lines.append(f"Date: {record.date.strftime('%m/%d/%Y')}")
             lines.append(f"Symptoms: {record.symptoms}")
             if record.diagnosis:
-                lines.append(f"Diagnosis: {record.diagnosis}")
+                lines.append(f"Diagnosis: {', '.join(record.diagnosis)}")
             if record.recommendation:
                 lines.append(f"Recommendation: {record.recommendation}")
             lines.append("")  # space between records
@@ -367,7 +441,7 @@ def clinics():
 
 @app.route('/api/get_diagnosis_explanation', methods=['POST'])
 def get_diagnosis_explanation():
-    """Get detailed explanation for a specific diagnosis using Gemini AI"""
+    """Get detailed explanation for a specific diagnosis from the catalog, using Gemini AI for unseen names"""
     try:
         data = request.get_json()
         diagnosis = data.get('diagnosis', '').strip()
@@ -381,14 +455,17 @@ def get_diagnosis_explanation():
         if diagnosis.lower().startswith('warning') or '⚠' in diagnosis:
             return jsonify({'success': False, 'error': 'Cannot explain warning messages'})
 
-        explanation = get_diagnosis_explanation_from_gemini(diagnosis)
+        try:
+            explanation = EXPLANATION_CATALOG.get_or_generate(diagnosis, generate_diagnosis_explanation)
+        except Exception as e:
+            logging.error(f"AI Integration error: {e}")
+            explanation = None
 
         logging.info(f"Generated explanation: {explanation}")
 
         # Ensure we always have valid content
         if not explanation or not explanation.get('description'):
             logging.warning("Empty explanation from Gemini, using fallback")
-            from gemini import get_fallback_explanation
             explanation = get_fallback_explanation(diagnosis)
 
         return jsonify({
@@ -402,7 +479,6 @@ def get_diagnosis_explanation():
 
         # Return fallback explanation instead of just error
         try:
-            from gemini import get_fallback_explanation
             diagnosis_name = data.get('diagnosis', 'Unknown condition') if 'data' in locals() else 'Unknown condition'
             fallback_explanation = get_fallback_explanation(diagnosis_name)
             return jsonify({
@@ -440,15 +516,7 @@ def get_recent_history(pet_id):
                    .limit(limit)
                    .all())
 
-        data = [{
-         'id': e.id,
-         'date': e.date.isoformat(),
-         'symptoms': e.symptoms,
-         'diagnosis': e.diagnosis,
-         'recommendation': e.recommendation,
-         'urgency_level': e.urgency_level,
-          'possible_causes': e.possible_causes.split(", ") if e.possible_causes else []
-         } for e in entries]
+        data = [e.to_dict() for e in entries]
 
 
         return jsonify({'success': True, 'health_history': data})
@@ -482,6 +550,28 @@ def test_gemini():
         return f"Error: {str(e)}", 500
 
 
+def internal_request_allowed():
+    """Internal endpoints need X-Internal-Token when INTERNAL_API_TOKEN is set, else a loopback caller."""
+    token = os.environ.get("INTERNAL_API_TOKEN")
+    if token:
+        return hmac.compare_digest(request.headers.get("X-Internal-Token", ""), token)
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+@app.route('/internal/gemini/scoreboard')
+def gemini_scoreboard():
+    if not internal_request_allowed():
+        return jsonify({'success': False, 'error': 'Not authorized'}), 403
+    return jsonify({
+        'success': True,
+        'scoreboard': model_scoreboard(),
+        'response_cache': response_cache_stats(),
+        'image_analysis_cache': IMAGE_ANALYSIS_CACHE.snapshot(),
+        'calls': call_metrics(),
+        'triage': TRIAGE_ROUTER.snapshot(),
+    })
+
+
 @app.route('/api/get_history')
 def get_history():
     pet_id = request.args.get('pet_id', type=int)
@@ -494,18 +584,7 @@ def get_history():
         return jsonify({"success": True, "history": []})  # return empty list if no history
 
     # Serialize history records
-    history_list = []
-    for h in history:
-      history_list.append({
-     "id": h.id,
-     "date": h.date.isoformat(),
-     "symptoms": h.symptoms,
-     "diagnosis": h.diagnosis,
-     "recommendation": h.recommendation,
-     "urgency_level": h.urgency_level,
-     "possible_causes": h.possible_causes.split(", ") if h.possible_causes else []
-
-    })
+    history_list = [h.to_dict() for h in history]
 
 
     return jsonify({"success": True, "history": history_list})
@@ -663,6 +742,41 @@ def save_consultation_notes():
         db.session.rollback()
         return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
 
+def build_symptom_history_entry(pet_id, symptoms, analysis):
+    """
+    Clean an AI symptom analysis and build its (unsaved) HealthHistory row.
+    Returns (entry, diagnosis, possible_causes), or None if the analysis is unusable.
+    """
+    if not analysis or not isinstance(analysis, dict) or not analysis.get("diagnosis"):
+        return None
+
+    # Ensure diagnosis is a list
+    diagnosis = analysis.get("diagnosis")
+    if isinstance(diagnosis, str):
+        diagnosis = [diagnosis]
+    elif not isinstance(diagnosis, list):
+        diagnosis = []
+
+    # Filter out empty or meaningless entries
+    diagnosis = [
+        str(d).strip() for d in diagnosis
+        if str(d).strip().lower() not in ["unable to analyze symptoms", "unknown", ""]
+    ]
+
+    # Put cleaned diagnosis back into analysis
+    analysis["diagnosis"] = diagnosis
+
+    history_entry = HealthHistory(
+        pet_id=pet_id,
+        date=datetime.utcnow(),
+        symptoms=symptoms,
+        recommendation=analysis.get('recommendation', "Please consult with a veterinarian"),
+        urgency_level=analysis.get('urgency_level', "Unknown"),
+    )
+    history_entry.set_findings(diagnosis, analysis.get("possible_causes"))
+    return history_entry, diagnosis, history_entry.possible_causes
+
+
 @app.route('/api/check_symptoms', methods=['POST'])
 def check_symptoms():
     try:
@@ -674,45 +788,17 @@ def check_symptoms():
         if not pet:
             return jsonify({'success': False, 'error': 'Pet not found'}), 404
 
-        # Call AI analysis
-        analysis = analyze_pet_symptoms(pet, symptoms)
-
-        # Ensure diagnosis is a list
-        diagnosis = analysis.get("diagnosis")
-        if isinstance(diagnosis, str):
-            diagnosis = [diagnosis]
-        elif not isinstance(diagnosis, list):
-            diagnosis = []
+        # Local models answer confident cases; the rest go to Gemini, which
+        # falls back to the local model if it fails or the deadline runs out
+        analysis, decision = TRIAGE_ROUTER.route(pet, symptoms)
 
-        # Filter out empty or meaningless entries
-        diagnosis = [
-            str(d).strip() for d in diagnosis
-            if str(d).strip().lower() not in ["unable to analyze symptoms", "unknown", ""]
-        ]
-
-        if not analysis or not isinstance(analysis, dict) or not analysis.get("diagnosis"):
+        built = build_symptom_history_entry(pet_id, symptoms, analysis)
+        if built is None:
             logging.warning("Empty or invalid AI analysis result — not saving to DB.")
             return jsonify({'success': False, 'error': 'Empty or invalid AI analysis result'}), 400
-
-        # Put cleaned diagnosis back into analysis
-        analysis["diagnosis"] = diagnosis
-
-        # Ensure possible_causes is a list
-        possible_causes = analysis.get("possible_causes", [])
-        if isinstance(possible_causes, str):
-            possible_causes = [possible_causes]
+        history_entry, diagnosis, possible_causes = built
 
         # Save to DB
-        history_entry = HealthHistory(
-            pet_id=pet_id,
-            date=datetime.utcnow(),
-            symptoms=symptoms,
-            diagnosis=json.dumps(diagnosis),  # store list as JSON string
-            recommendation=analysis.get('recommendation', "Please consult with a veterinarian"),
-            urgency_level=analysis.get('urgency_level', "Unknown"),
-            possible_causes=json.dumps(possible_causes) if possible_causes else None
-        )
-
         db.session.add(history_entry)
         db.session.commit()
 
@@ -724,7 +810,8 @@ def check_symptoms():
                 'urgency_level': history_entry.urgency_level,
                 'recommendation': history_entry.recommendation,
                 'possible_causes': possible_causes
-            }
+            },
+            'tier': decision['tier']
         })
 
     except Exception as e:
@@ -732,6 +819,187 @@ def check_symptoms():
         return jsonify({'success': False, 'error': str(e)}), 400
 
 
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/check_symptoms/stream', methods=['POST'])
+def check_symptoms_stream():
+    """
+    Server-Sent Events variant of /api/check_symptoms:
+    triage (local model, immediate) -> delta* (raw Gemini text) -> analysis -> record.
+    When the local tier is confident there are no deltas: Gemini is not called.
+    """
+    data = request.get_json(silent=True) or {}
+    pet_id = data.get('pet_id')
+    symptoms = data.get('symptoms')
+    if not pet_id or not symptoms:
+        return jsonify({'success': False, 'error': 'Pet ID and symptoms required'}), 400
+
+    pet = PetProfile.query.get(pet_id)
+    if not pet:
+        return jsonify({'success': False, 'error': 'Pet not found'}), 404
+
+    def generate():
+        started = time.monotonic()
+        local, reason = None, 'local_error'
+        try:
+            local, reason = TRIAGE_ROUTER.try_local(pet, symptoms)
+            yield sse_event('triage', local)
+        except Exception as e:
+            logging.warning(f"Local triage failed: {e}")
+
+        try:
+            if reason is None:
+                analysis, tier = local, LOCAL
+            else:
+                failed = []
+
+                def local_fallback(pet, symptoms):
+                    failed.append(True)
+                    return fallback_analysis(pet, symptoms, reason)
+
+                analysis = None
+                for kind, payload in analyze_pet_symptoms_stream(pet, symptoms, fallback=local_fallback):
+                    if kind == 'delta':
+                        yield sse_event('delta', {'text': payload})
+                    else:
+                        analysis = payload
+                tier = LOCAL_FALLBACK if failed else GEMINI
+            TRIAGE_ROUTER.record({'tier': tier, 'reason': reason}, time.monotonic() - started)
+
+            built = build_symptom_history_entry(pet.id, symptoms, analysis)
+            if built is None:
+                logging.warning("Empty or invalid AI analysis result — not saving to DB.")
+                yield sse_event('error', {'error': 'Empty or invalid AI analysis result'})
+                return
+            history_entry, diagnosis, possible_causes = built
+            result = {
+                'diagnosis': diagnosis,
+                'urgency_level': history_entry.urgency_level,
+                'recommendation': history_entry.recommendation,
+                'possible_causes': possible_causes
+            }
+            yield sse_event('analysis', result)
+
+            db.session.add(history_entry)
+            db.session.commit()
+            yield sse_event('record', {'success': True, 'history_id': history_entry.id, 'analysis': result})
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error streaming symptom check: {e}")
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+BATCH_MAX_ITEMS = int(os.environ.get("CHECK_SYMPTOMS_BATCH_MAX_ITEMS", 100))
+
+
+@app.route('/api/check_symptoms/batch', methods=['POST'])
+def check_symptoms_batch():
+    """Triage many intake notes at once: {"items": [{"pet_id": 1, "symptoms": "..."}, ...]}"""
+    try:
+        if 'user_id' not in session:
+            return jsonify({'success': False, 'error': 'User not logged in'}), 401
+
+        data = request.get_json(silent=True) or {}
+        items = data.get('items')
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'error': 'items must be a non-empty list'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'success': False, 'error': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+
+        pet_ids = {item.get('pet_id') for item in items if isinstance(item, dict)}
+        pets = {
+            pet.id: pet for pet in PetProfile.query.filter(
+                PetProfile.id.in_(pet_ids), PetProfile.user_id == session['user_id']
+            ).all()
+        }
+
+        results = [None] * len(items)
+        to_analyze = []
+        for index, item in enumerate(items):
+            item = item if isinstance(item, dict) else {}
+            symptoms = (item.get('symptoms') or '').strip()
+            pet = pets.get(item.get('pet_id'))
+            if not pet:
+                results[index] = {'index': index, 'success': False, 'error': 'Pet not found'}
+            elif not symptoms:
+                results[index] = {'index': index, 'success': False, 'error': 'Symptoms required'}
+            else:
+                to_analyze.append((index, pet, symptoms))
+
+        # Confident cases are answered locally; only the rest go to Gemini as one batch
+        answered = {}
+        escalate = []
+        for index, pet, symptoms in to_analyze:
+            started = time.monotonic()
+            local, reason = TRIAGE_ROUTER.try_local(pet, symptoms)
+            if reason is None:
+                answered[index] = local
+                TRIAGE_ROUTER.record({'tier': LOCAL, 'reason': None}, time.monotonic() - started)
+            else:
+                escalate.append((index, pet, symptoms, reason))
+
+        if escalate:
+            failed = set()
+            reasons = {(pet.id, symptoms): reason for _, pet, symptoms, reason in escalate}
+
+            def local_fallback(pet, symptoms):
+                failed.add((pet.id, symptoms))
+                return fallback_analysis(pet, symptoms, reasons[(pet.id, symptoms)])
+
+            started = time.monotonic()
+            analyses = analyze_pet_symptoms_batch(
+                [(pet, symptoms) for _, pet, symptoms, _ in escalate],
+                fallback=local_fallback,
+            )
+            per_item = (time.monotonic() - started) / len(escalate)
+            for (index, pet, symptoms, reason), analysis in zip(escalate, analyses):
+                answered[index] = analysis
+                tier = LOCAL_FALLBACK if (pet.id, symptoms) in failed else GEMINI
+                TRIAGE_ROUTER.record({'tier': tier, 'reason': reason}, per_item)
+
+        saved = []
+        for index, pet, symptoms in to_analyze:
+            analysis = answered[index]
+            built = build_symptom_history_entry(pet.id, symptoms, analysis)
+            if built is None:
+                results[index] = {'index': index, 'success': False, 'error': 'Empty or invalid AI analysis result'}
+                continue
+            history_entry, diagnosis, possible_causes = built
+            saved.append((index, history_entry, diagnosis, possible_causes))
+
+        # All rows of the batch are written in one transaction
+        db.session.add_all([entry for _, entry, _, _ in saved])
+        db.session.commit()
+
+        for index, history_entry, diagnosis, possible_causes in saved:
+            results[index] = {
+                'index': index,
+                'success': True,
+                'history_id': history_entry.id,
+                'analysis': {
+                    'diagnosis': diagnosis,
+                    'urgency_level': history_entry.urgency_level,
+                    'recommendation': history_entry.recommendation,
+                    'possible_causes': possible_causes
+                }
+            }
+
+        return jsonify({'success': True, 'results': results})
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error checking symptoms batch: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+
 @app.route('/api/save_assessment', methods=['POST'])
 def save_assessment():
     try:
@@ -750,27 +1018,14 @@ def save_assessment():
         if not pet:
             return jsonify({'success': False, 'error': 'Pet not found'}), 404
 
-        diagnosis = analysis.get('diagnosis', [])
-        if isinstance(diagnosis, str):
-            diagnosis = [diagnosis]
-        elif not isinstance(diagnosis, list):
-            diagnosis = []
-
-        possible_causes = analysis.get('possible_causes', [])
-        if isinstance(possible_causes, str):
-            possible_causes = [possible_causes]
-        elif not isinstance(possible_causes, list):
-            possible_causes = []
-
         history_entry = HealthHistory(
             pet_id=pet.id,
             date=datetime.utcnow(),
             symptoms=symptoms or "Saved final assessment summary",
-            diagnosis=json.dumps(diagnosis),
             recommendation=analysis.get('recommendation', "Please consult with a veterinarian"),
             urgency_level=analysis.get('urgency_level', "Unknown"),
-            possible_causes=json.dumps(possible_causes) if possible_causes else None
         )
+        history_entry.set_findings(analysis.get('diagnosis'), analysis.get('possible_causes'))
         db.session.add(history_entry)
         db.session.commit()
 
@@ -906,17 +1161,7 @@ def get_full_history(pet_id):
     # Health (last 30 days or urgent)
     for h in pet.health_history:
         if (h.date >= today - timedelta(days=30)) or (h.urgency_level and h.urgency_level.lower() == "high"):
-            timeline.append({
-                "type": "health",
-                "id": h.id,
-                "date": h.date.isoformat(),
-                "symptoms": h.symptoms,
-                "diagnosis": h.diagnosis,
-                "recommendation": h.recommendation,
-                "urgency_level": h.urgency_level,
-                "possible_causes": h.possible_causes.split(", ") if h.possible_causes else [],
-                "summary": None,
-            })
+            timeline.append({"type": "health", **h.to_dict(), "summary": None})
 
     # Consultations (last 60 days)
     if hasattr(pet, "consultations"):
@@ -966,21 +1211,34 @@ def get_health_history():
     user_id = session['user_id']
     histories = HealthHistory.query.join(PetProfile).filter(PetProfile.user_id == user_id).order_by(HealthHistory.date.desc()).all()
 
-    data = [{
-    'id': h.id,
-    'pet_id': h.pet_id,
-    'date': h.date.isoformat(),
-    'symptoms': h.symptoms,
-    'diagnosis': h.diagnosis,
-    'recommendation': h.recommendation,
-    'urgency_level': h.urgency_level,
-    'possible_causes': h.possible_causes.split(", ") if h.possible_causes else []
-    } for h in histories]
+    data = [h.to_dict() for h in histories]
 
 
     return jsonify({'success': True, 'health_history': data})
 
 
+@app.route('/api/pets_with_diagnosis')
+def pets_with_diagnosis():
+    """The user's pets with at least one health record carrying this diagnosis (any word order or case)."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'User not logged in'}), 401
+
+    diagnosis = request.args.get('diagnosis', '').strip()
+    if not diagnosis:
+        return jsonify({'success': False, 'error': 'diagnosis is required'}), 400
+
+    pets = (PetProfile.query
+            .join(HealthHistoryDiagnosis, HealthHistoryDiagnosis.pet_id == PetProfile.id)
+            .filter(HealthHistoryDiagnosis.name_key == normalize_name(diagnosis)[:200],
+                    PetProfile.user_id == session['user_id'])
+            .distinct()
+            .all())
+
+    return jsonify({'success': True, 'pets': [
+        {'id': p.id, 'name': p.name, 'species': p.species, 'breed': p.breed} for p in pets
+    ]})
+
+
 @app.route('/api/get_reminders', methods=['GET'])
 def get_reminders():
     if 'user_id' not in session:
@@ -1082,15 +1340,13 @@ def upload_image():
         
         # Generate hash of the image content
         import hashlib
-        image_hash = hashlib.md5(file_content).hexdigest()
+        image_hash = hashlib.sha256(file_content).hexdigest()
         
         # Check if we've analyzed this exact image before
-        existing_analysis = check_image_analysis_cache(image_hash, pet_id, description)
+        existing_analysis = check_image_analysis_cache(image_hash, pet, description)
         if existing_analysis:
             # Check if the cached analysis was an error
-            is_error = any("Error analyzing image" in str(d) for d in existing_analysis.get("diagnosis", []))
-            
-            if not is_error:
+            if not is_degraded_image_analysis(existing_analysis):
                 # Save the image with a new filename but return cached analysis
                 filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -1123,8 +1379,9 @@ def upload_image():
             logging.warning("Empty or invalid AI analysis result — not saving to DB.")
             return jsonify({'success': False, 'error': 'Empty or invalid AI analysis result'}), 400
 
-        # Cache the analysis result
-        cache_image_analysis(image_hash, pet_id, description, analysis)
+        # Cache the analysis result, unless it is the fallback (e.g. the deadline ran out)
+        if not is_degraded_image_analysis(analysis):
+            cache_image_analysis(image_hash, pet, description, analysis)
         
         # Create health history entry
         create_health_history_entry(pet_id, description, analysis, filename)
@@ -1242,75 +1499,37 @@ def start_consultation():
 
 
 # Helper functions for image analysis caching
-def check_image_analysis_cache(image_hash, pet_id, description):
-    """
-    Check if we have a cached analysis for this exact image.
-    Returns the cached analysis if found, None otherwise.
-    """
-    try:
-        # Look for existing health history entries with the same image hash
-        # We'll store the hash in the symptoms field for now (could be improved with a separate table)
-        cache_key = f"ImageHash:{image_hash}"
-        
-        # Check if we have any recent analysis with this hash
-        existing_entry = HealthHistory.query.filter(
-            HealthHistory.symptoms.like(f"%{cache_key}%"),
-            HealthHistory.pet_id == pet_id
-        ).order_by(HealthHistory.date.desc()).first()
-        
-        if existing_entry:
-            # Extract the cached analysis from the existing entry
-            diagnosis = json.loads(existing_entry.diagnosis) if existing_entry.diagnosis else []
-            possible_causes = json.loads(existing_entry.possible_causes) if existing_entry.possible_causes else []
-            
-            return {
-                "diagnosis": diagnosis,
-                "urgency_level": existing_entry.urgency_level,
-                "severity": existing_entry.urgency_level,
-                "recommendation": existing_entry.recommendation,
-                "possible_causes": possible_causes,
-                "condition_likelihood": "Cached Analysis"
-            }
-        
-        return None
-    except Exception as e:
-        logging.error(f"Error checking image cache: {e}")
-        return None
+DEGRADED_IMAGE_DIAGNOSES = ("Error analyzing image", "Image analysis unavailable")
 
 
-def cache_image_analysis(image_hash, pet_id, description, analysis):
+def is_degraded_image_analysis(analysis):
+    """True for error or fallback analyses, which must not be served from the cache."""
+    return any(
+        marker in str(d)
+        for d in (analysis or {}).get("diagnosis", [])
+        for marker in DEGRADED_IMAGE_DIAGNOSES
+    )
+
+
+def check_image_analysis_cache(image_hash, pet, description):
     """
-    Cache the analysis result for future use.
+    Cached analysis of these exact image bytes for a pet of the same species,
+    breed and age bracket with the same description, or None.
     """
-    try:
-        # Store the hash in the symptoms field for caching
-        cache_key = f"ImageHash:{image_hash}"
-        symptoms = f"Image analysis: {description} {cache_key}" if description else f"Image analysis {cache_key}"
-        
-        # Normalize diagnosis as a list
-        diagnosis = analysis["diagnosis"]
-        if isinstance(diagnosis, str):
-            diagnosis = [diagnosis]
+    return IMAGE_ANALYSIS_CACHE.get(image_hash, image_cache_context(pet, description))
 
-        possible_causes = analysis.get("possible_causes", [])
-        
-        # Save analysis to health history with cache key
-        history_entry = HealthHistory(
-            pet_id=pet_id,
-            date=datetime.utcnow(),
-            symptoms=symptoms,
-            diagnosis=json.dumps(diagnosis),
-            recommendation=analysis.get("recommendation", ""),
-            urgency_level=analysis.get("urgency_level", "Not Assessed"),
-            possible_causes=json.dumps(possible_causes)
-        )
 
-        db.session.add(history_entry)
-        db.session.commit()
-        
-        logging.info(f"Cached image analysis for hash: {image_hash}")
-    except Exception as e:
-        logging.error(f"Error caching image analysis: {e}")
+def cache_image_analysis(image_hash, pet, description, analysis):
+    """
+    Cache the analysis result for future use. Only the cache table is written;
+    the upload's own HealthHistory entry is created by create_health_history_entry.
+    """
+    IMAGE_ANALYSIS_CACHE.put(
+        image_hash,
+        image_cache_context(pet, description),
+        analysis,
+        model_version=model_scoreboard()["resolved"]["model"],
+    )
 
 
 def create_health_history_entry(pet_id, description, analysis, filename):
@@ -1318,23 +1537,15 @@ def create_health_history_entry(pet_id, description, analysis, filename):
     Create a health history entry from analysis results.
     """
     try:
-        # Normalize diagnosis as a list
-        diagnosis = analysis["diagnosis"]
-        if isinstance(diagnosis, str):
-            diagnosis = [diagnosis]
-
-        possible_causes = analysis.get("possible_causes", [])
-        
         # Save analysis to health history
         history_entry = HealthHistory(
             pet_id=pet_id,
             date=datetime.utcnow(),
             symptoms=f"Image analysis: {description}" if description else "Image analysis",
-            diagnosis=json.dumps(diagnosis),
             recommendation=analysis.get("recommendation", ""),
             urgency_level=analysis.get("urgency_level", "Not Assessed"),
-            possible_causes=json.dumps(possible_causes)
         )
+        history_entry.set_findings(analysis["diagnosis"], analysis.get("possible_causes"))
 
         db.session.add(history_entry)
         db.session.commit()
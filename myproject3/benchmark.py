@@ -0,0 +1,409 @@
+"""
+Latency and accuracy benchmark for the three symptom triage engines:
+
+    ml      symptom_model.analyze_pet_symptoms_ml (keyword scorer)
+    rf      symptom_rf_model.analyze_pet_symptoms_rf (needs a built artifact)
+    gemini  gemini.analyze_pet_symptoms against fake_gemini.py, never the real API
+
+Each engine runs in a fresh subprocess. That gives an honest cold start
+(import, model load and first answer) and a peak RSS that belongs to that
+engine alone. The warm phase then answers the whole corpus sequentially.
+Results are written as JSON, so two commits can be compared:
+
+    python benchmark.py run [--engines ml,rf,gemini] [--corpus synthetic|FILE.jsonl] [--size N]
+        [--repeat N] [--replay DIR | --record DIR] [--gemini-latency-ms MS] [--out FILE]
+    python benchmark.py compare OLD.json NEW.json [--threshold 0.15]
+    python benchmark.py breaker-check
+
+breaker-check is a regression check for the Gemini circuit breaker: an
+upstream that is only slower than a caller's short request deadline must
+not trip it, while the same upstream timing out on the model's own timeout
+must.
+
+A corpus file has one JSON object per line: {"species", "age", "symptoms",
+"diagnosis", "urgency"}. The labels are optional. The default corpus is
+drawn from the knowledge base's condition profiles with a seed the
+RandomForest model was not trained on. By default the gemini engine gets
+fake_gemini's synthetic answers. Use --replay DIR to serve responses
+recorded earlier with --record DIR, which proxies to the real API once and
+needs GEMINI_API_KEY.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from itertools import combinations
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+try:
+    from .models import normalize_name
+except ImportError:  # when run as a script
+    from models import normalize_name
+
+
+ENGINES = ("ml", "rf", "gemini")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+CORPUS_SEED = 20240  # differs from the RandomForest training seed
+_SYNTHETIC_ROW_RE = re.compile(r"^(\w+) age (\d+) has (.*)$")
+
+# Metrics `compare` checks: latencies may not grow past the threshold, accuracies may not drop.
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms", "cold_start_ms")
+ACCURACY_METRICS = ("diagnosis_accuracy", "urgency_accuracy")
+
+
+class _Pet:
+    def __init__(self, species="", age=""):
+        self.species = species
+        self.age = age
+        self.name = "Benchmark"
+        self.breed = "Mixed"
+        self.medical_notes = ""
+
+
+def load_corpus(spec, size):
+    if spec != "synthetic":
+        with open(spec, "r", encoding="utf-8") as f:
+            cases = [json.loads(line) for line in f if line.strip()]
+        return cases[:size] if size else cases
+
+    try:
+        from .knowledge_base import KNOWLEDGE_BASE
+        from .symptom_rf_model import iter_synthetic_rows
+    except ImportError:  # when run as a script
+        from knowledge_base import KNOWLEDGE_BASE
+        from symptom_rf_model import iter_synthetic_rows
+
+    cases = []
+    rows = iter_synthetic_rows(KNOWLEDGE_BASE.current().profiles, size or 300, random.Random(CORPUS_SEED))
+    for text, diagnosis, urgency in rows:
+        species, age, symptoms = _SYNTHETIC_ROW_RE.match(text).groups()
+        cases.append({"species": species, "age": int(age), "symptoms": symptoms,
+                      "diagnosis": diagnosis, "urgency": urgency})
+    return cases
+
+
+def _percentile(values, p):
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KiB on Linux
+
+
+def _engine(name, options):
+    """Import and return the engine's analyze(pet, symptoms) callable; called inside the child."""
+    if name == "ml":
+        from symptom_model import analyze_pet_symptoms_ml
+        return analyze_pet_symptoms_ml
+
+    if name == "rf":
+        os.environ.setdefault("SYMPTOM_RF_TRAIN_FALLBACK", "off")
+        from symptom_rf_model import analyze_pet_symptoms_rf, load_model
+        if load_model() is None:
+            raise RuntimeError("no usable RandomForest artifact (python symptom_rf_model.py build)")
+        return analyze_pet_symptoms_rf
+
+    # gemini: a local fake, started before the clock so only the client side is measured
+    from fake_gemini import FakeGemini, serve
+    fake = FakeGemini(
+        latency_ms=options.get("gemini_latency_ms", 0.0),
+        replay_dir=options.get("replay"),
+        record_dir=options.get("record"),
+        api_key=os.environ.get("GEMINI_API_KEY"),
+        seed=CORPUS_SEED,
+    )
+    server = serve(fake, port=0)
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.pop("GEMINI_API_KEY", None)  # the SDK only talks to the fake
+    os.environ["GEMINI_RESPONSE_CACHE_SIZE"] = "0"  # every case is a real call
+    os.environ["GEMINI_MODEL_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "model_cache.json")
+    import gemini
+
+    fallbacks = options["_fallbacks"]
+
+    def analyze(pet, symptoms):
+        def fallback(pet, symptoms):
+            fallbacks.append(symptoms)
+            return gemini.get_fallback_symptom_analysis(pet, symptoms)
+        return gemini.analyze_pet_symptoms(pet, symptoms, fallback=fallback)
+    return analyze
+
+
+def breaker_check(calls=6, latency_ms=1500, deadline=1.2):
+    """Return a list of failures (empty when the breaker behaves); runs against a slow fake."""
+    from fake_gemini import FakeGemini, serve
+    server = serve(FakeGemini(latency_ms=latency_ms), port=0)
+    server.handle_error = lambda request, client_address: None  # clients hanging up is the point here
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ["GEMINI_API_KEY"] = "fake"
+    os.environ["GEMINI_RESPONSE_CACHE_SIZE"] = "0"
+    os.environ["GEMINI_MODEL_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "model_cache.json")
+    os.environ["GEMINI_BREAKER_MIN_CALLS"] = "1"  # failed models rotate, so each sees few calls
+    import deadlines
+    import gemini
+
+    def attempts():
+        for _ in range(calls):
+            with deadlines.budget(deadline):
+                try:
+                    gemini._generate_content_with_fallback("ping", operation="breaker-check")
+                except Exception:
+                    pass
+        return {model: gemini._HEALTH.state(model) for model in gemini._candidate_models()}
+
+    failures = []
+    try:
+        # deadline-clamped: every attempt is cut short by the caller's budget
+        states = attempts()
+        tripped = [model for model, state in states.items() if state != "closed"]
+        if tripped:
+            failures.append(f"deadline-induced timeouts tripped the breaker: {', '.join(tripped)}")
+
+        # not clamped: the model's own timeout is shorter than the budget, so it counts
+        gemini._ATTEMPT_TIMEOUT = deadline - 0.2
+        states = attempts()
+        if all(state == "closed" for state in states.values()):
+            failures.append("model timeouts no longer trip the breaker")
+    finally:
+        server.shutdown()
+    return failures
+
+
+def _first(value):
+    if isinstance(value, list):
+        return str(value[0]) if value else ""
+    return str(value or "")
+
+
+def run_engine(name, cases, repeat=1, options=None):
+    """Benchmark one engine in this process; returns metrics plus per-case predictions."""
+    options = dict(options or {}, _fallbacks=[])
+    started = time.perf_counter()
+    analyze = _engine(name, options)
+    loaded = time.perf_counter()
+    pets = [_Pet(case.get("species", ""), case.get("age", "")) for case in cases]
+    analyze(pets[0], cases[0]["symptoms"])
+    cold_ms = (time.perf_counter() - started) * 1000
+    load_ms = (loaded - started) * 1000
+
+    latencies, predictions, errors = [], [], 0
+    warm_started = time.perf_counter()
+    for round_no in range(repeat):
+        for pet, case in zip(pets, cases):
+            t = time.perf_counter()
+            try:
+                result = analyze(pet, case["symptoms"])
+            except Exception as e:
+                errors += 1
+                logging.debug(f"{name}: {e}")
+                result = {}
+            latencies.append((time.perf_counter() - t) * 1000)
+            if round_no == 0:
+                predictions.append((_first(result.get("diagnosis")), _first(result.get("urgency_level"))))
+    warm_seconds = time.perf_counter() - warm_started
+
+    latencies.sort()
+    labeled = [(p, c) for p, c in zip(predictions, cases) if c.get("diagnosis")]
+    urgency_labeled = [(p, c) for p, c in zip(predictions, cases) if c.get("urgency")]
+    metrics = {
+        "cases": len(cases),
+        "calls": len(latencies),
+        "errors": errors,
+        "fallbacks": len(options["_fallbacks"]),
+        "cold_start_ms": round(cold_ms, 2),
+        "load_ms": round(load_ms, 2),
+        "p50_ms": round(_percentile(latencies, 50), 3),
+        "p95_ms": round(_percentile(latencies, 95), 3),
+        "p99_ms": round(_percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "throughput_per_s": round(len(latencies) / warm_seconds, 1) if warm_seconds else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "diagnosis_accuracy": round(sum(
+            normalize_name(p[0]) == normalize_name(c["diagnosis"]) for p, c in labeled
+        ) / len(labeled), 4) if labeled else None,
+        "urgency_accuracy": round(sum(
+            p[1].lower() == str(c["urgency"]).lower() for p, c in urgency_labeled
+        ) / len(urgency_labeled), 4) if urgency_labeled else None,
+    }
+    return metrics, predictions
+
+
+def _agreement(predictions):
+    """Pairwise share of cases where two engines give the same diagnosis / urgency."""
+    out = {}
+    for a, b in combinations(sorted(predictions), 2):
+        pairs = list(zip(predictions[a], predictions[b]))
+        if not pairs:
+            continue
+        out[f"{a}~{b}"] = {
+            "diagnosis": round(sum(normalize_name(x[0]) == normalize_name(y[0]) for x, y in pairs) / len(pairs), 4),
+            "urgency": round(sum(x[1].lower() == y[1].lower() for x, y in pairs) / len(pairs), 4),
+        }
+    return out
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(engines, corpus_spec, size, repeat, options):
+    cases = load_corpus(corpus_spec, size)
+    if not cases:
+        raise ValueError("empty corpus")
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"cases": cases, "repeat": repeat, "options": options}, f)
+        job_path = f.name
+
+    results, predictions = {}, {}
+    try:
+        for name in engines:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_engine", name, job_path],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            )
+            lines = proc.stdout.strip().splitlines()
+            try:
+                payload = json.loads(lines[-1])
+            except (IndexError, ValueError):
+                payload = {"error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+            if "error" in payload:
+                print(f"✗ {name}: {payload['error']}")
+                results[name] = {"error": payload["error"]}
+                continue
+            results[name] = payload["metrics"]
+            predictions[name] = payload["predictions"]
+            m = payload["metrics"]
+            print(f"✓ {name}: p50 {m['p50_ms']} ms, p95 {m['p95_ms']} ms, p99 {m['p99_ms']} ms, "
+                  f"cold {m['cold_start_ms']} ms, {m['throughput_per_s']}/s, {m['peak_rss_mb']} MB, "
+                  f"diagnosis {m['diagnosis_accuracy']}, urgency {m['urgency_accuracy']}")
+    finally:
+        os.unlink(job_path)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": {"source": corpus_spec, "cases": len(cases), "repeat": repeat},
+        "options": {k: v for k, v in options.items() if v},
+        "engines": results,
+        "agreement": _agreement(predictions),
+    }
+
+
+def compare(old, new, threshold=0.15, accuracy_drop=0.02, min_delta_ms=0.1):
+    """
+    Regressions of `new` against `old`, as printable strings. A latency must
+    grow by more than `threshold` (relative) and `min_delta_ms`, so timer
+    noise on sub-millisecond engines is not reported.
+    """
+    regressions = []
+    for name, metrics in new["engines"].items():
+        before = old["engines"].get(name)
+        if not before or "error" in before or "error" in metrics:
+            continue
+        for key in LATENCY_METRICS:
+            if (before.get(key) and metrics.get(key) and metrics[key] > before[key] * (1 + threshold)
+                    and metrics[key] - before[key] > min_delta_ms):
+                regressions.append(f"{name} {key}: {before[key]} -> {metrics[key]}")
+        for key in ACCURACY_METRICS:
+            if before.get(key) is not None and metrics.get(key) is not None and metrics[key] < before[key] - accuracy_drop:
+                regressions.append(f"{name} {key}: {before[key]} -> {metrics[key]}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the symptom triage engines.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="benchmark engines and write a JSON result")
+    run_cmd.add_argument("--engines", default=",".join(ENGINES))
+    run_cmd.add_argument("--corpus", default="synthetic", help="'synthetic' or a JSONL file")
+    run_cmd.add_argument("--size", type=int, default=None, help="cases to use (synthetic default: 300)")
+    run_cmd.add_argument("--repeat", type=int, default=1, help="warm passes over the corpus")
+    replay = run_cmd.add_mutually_exclusive_group()
+    replay.add_argument("--replay", metavar="DIR", help="serve recorded Gemini responses from DIR")
+    replay.add_argument("--record", metavar="DIR", help="call the real Gemini API once and record into DIR")
+    run_cmd.add_argument("--gemini-latency-ms", type=float, default=0.0, help="simulated upstream latency")
+    run_cmd.add_argument("--out", default=None, help="result file (default: benchmark_results/<commit>.json)")
+    compare_cmd = sub.add_parser("compare", help="exit 1 if NEW regressed against OLD")
+    compare_cmd.add_argument("old")
+    compare_cmd.add_argument("new")
+    compare_cmd.add_argument("--threshold", type=float, default=0.15, help="allowed relative latency increase")
+    sub.add_parser("breaker-check", help="exit 1 if deadline-induced timeouts trip the Gemini breaker")
+    engine_cmd = sub.add_parser("_engine")  # internal: one engine in a fresh process
+    engine_cmd.add_argument("name", choices=ENGINES)
+    engine_cmd.add_argument("job")
+    args = parser.parse_args(argv)
+
+    if args.command == "_engine":
+        logging.disable(logging.WARNING)
+        with open(args.job, "r", encoding="utf-8") as f:
+            job = json.load(f)
+        try:
+            metrics, predictions = run_engine(args.name, job["cases"], job["repeat"], job["options"])
+            print(json.dumps({"metrics": metrics, "predictions": predictions}))
+        except Exception as e:
+            print(json.dumps({"error": f"{type(e).__name__}: {e}"}))
+        return
+
+    if args.command == "breaker-check":
+        logging.disable(logging.WARNING)
+        failures = breaker_check()
+        for line in failures:
+            print(f"✗ {line}")
+        if failures:
+            raise SystemExit(1)
+        print("✓ deadline-induced timeouts leave the breaker closed")
+        return
+
+    if args.command == "compare":
+        with open(args.old, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, "r", encoding="utf-8") as f:
+            new = json.load(f)
+        if old.get("corpus") != new.get("corpus"):
+            print(f"! different corpora: {old.get('corpus')} vs {new.get('corpus')}")
+        regressions = compare(old, new, args.threshold)
+        for line in regressions:
+            print(f"✗ {line}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"✓ no regressions ({old.get('git_commit')} -> {new.get('git_commit')})")
+        return
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    unknown = set(engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+    options = {"replay": args.replay, "record": args.record, "gemini_latency_ms": args.gemini_latency_ms}
+    result = run(engines, args.corpus, args.size, args.repeat, options)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{result['git_commit'] or int(time.time())}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"✓ results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request budget ran out before the work could be started or finished."""
+
+
+class Deadline:
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+
+_CURRENT = contextvars.ContextVar("request_deadline", default=None)
+
+
+def start(seconds):
+    """Give the current context a fresh deadline; returns a token for reset()."""
+    return _CURRENT.set(Deadline(seconds))
+
+
+def reset(token):
+    try:
+        _CURRENT.reset(token)
+    except ValueError:  # token from another context, e.g. a streamed response
+        _CURRENT.set(None)
+
+
+def current():
+    return _CURRENT.get()
+
+
+def remaining():
+    """Seconds left in the current budget, or None when no deadline is set."""
+    deadline = _CURRENT.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def expired():
+    deadline = _CURRENT.get()
+    return deadline is not None and deadline.expired()
+
+
+@contextmanager
+def budget(seconds):
+    """Run a block under a deadline, never extending one that is already tighter."""
+    outer = remaining()
+    token = start(seconds if outer is None else min(seconds, outer))
+    try:
+        yield _CURRENT.get()
+    finally:
+        reset(token)
@@ -0,0 +1,287 @@
+"""
+Precomputed diagnosis explanations.
+
+The catalog lives in the `diagnosis_explanation` table, one row per
+normalized diagnosis name and catalog version, and is held in memory by each
+worker so lookups need no LLM call and no query. Names the catalog has never
+seen are generated through Gemini; the result is written back only when the
+name is a knowledge-base condition or a diagnosis already in HealthHistory,
+so arbitrary request text does not grow the catalog.
+
+Build or extend it with:
+
+    python explanation_catalog.py build [--force] [--limit N]
+    python explanation_catalog.py list
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+try:
+    from .models import as_text_list, normalize_name
+except ImportError:  # when run as a script
+    from models import as_text_list, normalize_name
+
+
+CATALOG_VERSION = "explanations-v1"
+# Typo matching never touches the start of a word: hypo/hyper, brady/tachy
+# and the like differ there and name opposite conditions.
+_PROTECTED_PREFIX = 5
+_MAX_MATCH_CACHE = 2048
+
+
+def _one_edit_apart(a, b):
+    """True if a and b differ by exactly one insertion, deletion or substitution."""
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+def is_typo_of(key, candidate):
+    """
+    True if normalized name `key` is a one-letter typo of `candidate`: every
+    word equal except one, which is one edit away past its first five letters.
+    """
+    a, b = key.split(), candidate.split()
+    if len(a) != len(b):
+        return False
+    differing = [(x, y) for x, y in zip(a, b) if x != y]
+    if len(differing) != 1:
+        return False
+    x, y = differing[0]
+    return (
+        min(len(x), len(y)) > _PROTECTED_PREFIX
+        and x[:_PROTECTED_PREFIX] == y[:_PROTECTED_PREFIX]
+        and _one_edit_apart(x, y)
+    )
+
+
+class ExplanationCatalog:
+    def __init__(self, engine, table, version=CATALOG_VERSION, reload_seconds=300, is_known=None):
+        self.engine = engine
+        self.table = table
+        self.version = version
+        self.reload_seconds = reload_seconds
+        # is_known(name_key) -> bool decides which runtime-generated names are stored;
+        # without it nothing generated at runtime is stored.
+        self.is_known = is_known
+
+        self._entries = {}  # name_key -> explanation JSON text
+        self._matches = {}  # name_key -> matched catalog key or None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "typo_hits": 0, "misses": 0, "generated": 0, "not_stored": 0}
+
+    def load(self):
+        t = self.table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(t.c.name_key, t.c.explanation).where(t.c.catalog_version == self.version)
+            ).all()
+        with self._lock:
+            self._entries = {row.name_key: row.explanation for row in rows}
+            self._matches = {}
+            self._loaded_at = time.monotonic()
+        return len(rows)
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_seconds:
+            try:
+                self.load()
+            except Exception as e:
+                logging.warning(f"Explanation catalog load failed: {e}")
+                self._loaded_at = time.monotonic()
+
+    def _match(self, key):
+        if key in self._entries:
+            return key, False
+        if key in self._matches:
+            return self._matches[key], True
+        close = [candidate for candidate in list(self._entries) if is_typo_of(key, candidate)]
+        match = close[0] if len(close) == 1 else None  # ambiguous typos match nothing
+        with self._lock:
+            if len(self._matches) >= _MAX_MATCH_CACHE:
+                self._matches = {}
+            self._matches[key] = match
+        return match, True
+
+    def lookup(self, name):
+        """Return a fresh copy of the explanation for `name` (exact or one-letter typo), or None."""
+        self._ensure_loaded()
+        key = normalize_name(name)
+        if not key:
+            return None
+        match, fuzzy = self._match(key)
+        if match is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["typo_hits" if fuzzy else "hits"] += 1
+        return json.loads(self._entries[match])
+
+    def _fetch(self, key):
+        """Exact DB read, for rows another worker wrote since our last load."""
+        t = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(t.c.explanation).where(t.c.name_key == key, t.c.catalog_version == self.version)
+            ).first()
+        if row is None:
+            return None
+        with self._lock:
+            self._entries[key] = row.explanation
+            self._matches = {}
+        return json.loads(row.explanation)
+
+    def add(self, name, explanation, source="runtime"):
+        key = normalize_name(name)
+        payload = json.dumps(explanation)
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(
+                    self.table.insert().values(
+                        name_key=key,
+                        catalog_version=self.version,
+                        display_name=name[:200],
+                        explanation=payload,
+                        source=source,
+                    )
+                )
+        except IntegrityError:
+            pass  # another worker stored it first
+        with self._lock:
+            self._entries[key] = payload
+            self._matches = {}
+
+    def get_or_generate(self, name, generator):
+        """Catalog lookup; on a miss call `generator(name)` and write the result back if the name is known."""
+        explanation = self.lookup(name)
+        if explanation is not None:
+            return explanation
+        key = normalize_name(name)
+        explanation = self._fetch(key) if key else None
+        if explanation is not None:
+            return explanation
+        explanation = generator(name)
+        self.stats["generated"] += 1
+        if not key:
+            return explanation
+        try:
+            if self.is_known is not None and self.is_known(key):
+                self.add(name, explanation)
+            else:
+                self.stats["not_stored"] += 1
+        except Exception as e:
+            logging.warning(f"Explanation catalog write-back failed for '{name}': {e}")
+        return explanation
+
+    def names(self):
+        self._ensure_loaded()
+        return sorted(self._entries)
+
+
+def known_diagnosis_names(engine, history_table):
+    """Diagnosis names from the condition knowledge base plus everything stored in HealthHistory."""
+    try:
+        from .knowledge_base import KNOWLEDGE_BASE
+    except ImportError:  # when run as a script
+        from knowledge_base import KNOWLEDGE_BASE
+
+    names = KNOWLEDGE_BASE.current().condition_names()
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(history_table.c.diagnosis).where(history_table.c.diagnosis.isnot(None)).distinct()
+        ).all()
+    for (raw,) in rows:
+        for value in as_text_list(raw):
+            if not value.lower().startswith("warning") and "⚠" not in value:
+                names.append(value)
+
+    unique = {}
+    for name in names:
+        unique.setdefault(normalize_name(name), name)
+    return [name for key, name in unique.items() if key]
+
+
+def is_known_diagnosis(engine, diagnosis_index_table, key):
+    """True if normalized name `key` is a knowledge-base condition or a diagnosis stored in HealthHistory."""
+    try:
+        from .knowledge_base import KNOWLEDGE_BASE
+    except ImportError:  # when run as a script
+        from knowledge_base import KNOWLEDGE_BASE
+
+    if any(normalize_name(name) == key for name in KNOWLEDGE_BASE.current().condition_names()):
+        return True
+    t = diagnosis_index_table
+    with engine.connect() as conn:
+        return conn.execute(select(t.c.history_id).where(t.c.name_key == key[:200]).limit(1)).first() is not None
+
+
+def build(catalog, names, generator, force=False, limit=None):
+    """Precompute explanations for `names`; returns counts of built, skipped and failed names."""
+    catalog.load()
+    existing = set(catalog.names())
+    counts = {"built": 0, "skipped": 0, "failed": 0}
+    for name in names:
+        if limit is not None and counts["built"] >= limit:
+            break
+        key = normalize_name(name)
+        if key in existing and not force:
+            counts["skipped"] += 1
+            continue
+        try:
+            explanation = generator(name)
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"✗ {name}: {e}")
+            continue
+        if force and key in existing:
+            t = catalog.table
+            with catalog.engine.begin() as conn:
+                conn.execute(t.delete().where(t.c.name_key == key, t.c.catalog_version == catalog.version))
+        catalog.add(name, explanation, source="build")
+        existing.add(key)
+        counts["built"] += 1
+        print(f"✓ {name}")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the diagnosis explanation catalog.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="precompute explanations for every known diagnosis")
+    build_cmd.add_argument("--force", action="store_true", help="regenerate names already in the catalog")
+    build_cmd.add_argument("--limit", type=int, default=None, help="stop after N new explanations")
+    sub.add_parser("list", help="print catalog keys for the current version")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("SYMPTOM_RF_TRAIN_FALLBACK", "off")  # importing app must not start RF training here
+    from app import app, EXPLANATION_CATALOG
+    from gemini import generate_diagnosis_explanation
+    from models import HealthHistory, db
+
+    with app.app_context():
+        if args.command == "list":
+            for key in EXPLANATION_CATALOG.names():
+                print(key)
+            return
+        names = known_diagnosis_names(db.engine, HealthHistory.__table__)
+        print(f"Building {CATALOG_VERSION} for {len(names)} diagnosis names...")
+        counts = build(EXPLANATION_CATALOG, names, generate_diagnosis_explanation, args.force, args.limit)
+        print(f"Done: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Local stand-in for the Gemini REST API, for load and regression testing
+without network access or quota.
+
+Serves GET /v1beta/models, POST .../models/<model>:generateContent and
+POST .../models/<model>:streamGenerateContent. Point the app at it with
+
+    GEMINI_BASE_URL=http://127.0.0.1:8089 python app.py
+
+Modes:
+  synthetic (default)  answers every prompt with plausible JSON built locally
+                       (symptom prompts are answered by symptom_model)
+  --record DIR         proxies to the real API (GEMINI_API_KEY) and saves each
+                       response under DIR, keyed by a hash of the request body
+  --replay DIR         serves saved responses deterministically; unknown
+                       requests fall back to synthetic unless --strict
+
+Fault injection applies in every mode:
+  --latency-dist fixed|uniform|lognormal  --latency-ms  --latency-jitter-ms
+  --slow-model NAME=MS   --error-rate  --error-status  --malformed-rate  --seed
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+UPSTREAM_URL = "https://generativelanguage.googleapis.com"
+DEFAULT_MODELS = ["gemini-2.0-flash", "gemini-1.5-flash", "gemini-2.5-flash", "gemini-2.5-pro"]
+_PATH_RE = re.compile(r"^/(?P<version>v1\w*)/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)")
+
+
+def request_key(body):
+    """Recording key: the request body without the model, so replays survive model fallback."""
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _prompt_text(body):
+    texts = []
+    for content in body.get("contents") or []:
+        for part in content.get("parts") or []:
+            if "text" in part:
+                texts.append(part["text"])
+    return "\n".join(texts)
+
+
+def _has_image(body):
+    return any(
+        "inlineData" in part or "inline_data" in part
+        for content in body.get("contents") or []
+        for part in content.get("parts") or []
+    )
+
+
+class _Pet:
+    def __init__(self, species="", age=""):
+        self.species = species
+        self.age = age
+
+
+def _field(text, label):
+    match = re.search(rf"{label}:\s*(.+)", text)
+    return match.group(1).strip() if match else ""
+
+
+def synthesize_answer(body):
+    """Deterministic, schema-correct JSON text for the app's prompt shapes."""
+    try:
+        from symptom_model import analyze_pet_symptoms_ml
+    except ImportError:
+        analyze_pet_symptoms_ml = None
+
+    text = _prompt_text(body)
+
+    if "Cases (JSON):" in text:
+        raw = text.split("Cases (JSON):", 1)[1].split("Respond ONLY", 1)[0]
+        try:
+            cases = json.loads(raw)
+        except ValueError:
+            cases = []
+        answers = []
+        for case in cases:
+            result = {"diagnosis": ["General non-specific symptoms"], "urgency_level": "Medium",
+                      "recommendation": "Consult a veterinarian.", "possible_causes": ["Unknown"]}
+            if analyze_pet_symptoms_ml is not None:
+                result = analyze_pet_symptoms_ml(_Pet(case.get("species", "")), case.get("symptoms", ""))
+                result.pop("model_used", None)
+            answers.append({"index": case.get("index"), **result})
+        return json.dumps(answers)
+
+    if "Current Symptoms:" in text:
+        if analyze_pet_symptoms_ml is None:
+            return json.dumps({"diagnosis": ["General non-specific symptoms"], "urgency_level": "Medium",
+                               "recommendation": "Consult a veterinarian.", "possible_causes": ["Unknown"]})
+        result = analyze_pet_symptoms_ml(_Pet(_field(text, "- Species")), _field(text, "Current Symptoms"))
+        result.pop("model_used", None)
+        return json.dumps(result)
+
+    if "educational explanation" in text:
+        name = re.search(r'diagnosis: "(.*?)"', text)
+        name = name.group(1) if name else "this condition"
+        return json.dumps({
+            "description": f"{name} is a condition seen in companion animals (synthetic answer).",
+            "causes": ["Infection", "Inflammation", "Environmental factors"],
+            "symptoms": ["Lethargy", "Reduced appetite"],
+        })
+
+    if _has_image(body) or "image_match" in text:
+        return json.dumps({
+            "image_match": True, "mismatch_reason": "", "diagnosis": ["Mild skin irritation"],
+            "condition_likelihood": "Moderate", "recommendation": "Monitor and consult a vet if it spreads.",
+            "urgency_level": "Low", "possible_causes": ["Allergy", "Insect bite"],
+        })
+
+    return "OK"
+
+
+def _response_body(text, prompt_text="", model=""):
+    prompt_tokens = max(1, len(prompt_text) // 4)
+    output_tokens = max(1, len(text) // 4)
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+        "modelVersion": model,
+    }
+
+
+class FakeGemini:
+    def __init__(
+        self,
+        models=None,
+        latency_dist="fixed",
+        latency_ms=0.0,
+        latency_jitter_ms=0.0,
+        slow_models=None,
+        error_rate=0.0,
+        error_status=503,
+        malformed_rate=0.0,
+        record_dir=None,
+        replay_dir=None,
+        strict=False,
+        upstream=UPSTREAM_URL,
+        api_key=None,
+        seed=None,
+    ):
+        self.models = models or list(DEFAULT_MODELS)
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.slow_models = slow_models or {}
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.malformed_rate = malformed_rate
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.strict = strict
+        self.upstream = upstream.rstrip("/")
+        self.api_key = api_key
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "malformed": 0, "replayed": 0, "recorded": 0, "synthetic": 0}
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random()
+
+    def delay_seconds(self, model):
+        base = float(self.slow_models.get(model, self.latency_ms))
+        with self._lock:
+            if self.latency_dist == "uniform":
+                ms = base + self._random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+            elif self.latency_dist == "lognormal" and base > 0:
+                sigma = self.latency_jitter_ms / base if self.latency_jitter_ms else 0.5
+                ms = base * math.exp(self._random.gauss(0.0, sigma))
+            else:
+                ms = base
+        return max(0.0, ms) / 1000.0
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def list_models(self):
+        return {
+            "models": [
+                {"name": f"models/{name}", "displayName": name,
+                 "supportedGenerationMethods": ["generateContent", "countTokens"]}
+                for name in self.models
+            ]
+        }
+
+    def generate(self, model, body, path):
+        """Return (status, response JSON, answer text) for one generate request."""
+        key = request_key(body)
+
+        if self.replay_dir:
+            recorded = self._load(key)
+            if recorded is not None:
+                self._count("replayed")
+                return recorded["status"], recorded["response"], None
+            if self.strict:
+                return 404, {"error": {"code": 404, "message": f"No recording for {key}", "status": "NOT_FOUND"}}, None
+
+        if self.record_dir:
+            status, response = self._proxy(path, body)
+            self._save(key, body, status, response)
+            self._count("recorded")
+            return status, response, None
+
+        self._count("synthetic")
+        text = synthesize_answer(body)
+        return 200, _response_body(text, _prompt_text(body), model), text
+
+    def _proxy(self, path, body):
+        if not self.api_key:
+            return 500, {"error": {"code": 500, "message": "GEMINI_API_KEY required for --record", "status": "INTERNAL"}}
+        req = urllib.request.Request(
+            f"{self.upstream}{path}",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json", "x-goog-api-key": self.api_key},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=120) as resp:
+                return resp.status, json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            try:
+                return e.code, json.loads(e.read().decode("utf-8"))
+            except ValueError:
+                return e.code, {"error": {"code": e.code, "message": str(e)}}
+
+    def _load(self, key):
+        try:
+            with open(os.path.join(self.replay_dir, f"{key}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key, body, status, response):
+        os.makedirs(self.record_dir, exist_ok=True)
+        with open(os.path.join(self.record_dir, f"{key}.json"), "w", encoding="utf-8") as f:
+            json.dump({"request": body, "status": status, "response": response}, f, indent=1)
+
+    def inject_fault(self, response):
+        """Apply error / malformed-JSON injection. Returns (status, response)."""
+        if self.error_rate and self._roll() < self.error_rate:
+            self._count("errors")
+            status = self.error_status
+            return status, {"error": {"code": status, "message": "Injected fault", "status": "UNAVAILABLE"}}
+        if self.malformed_rate and self._roll() < self.malformed_rate:
+            self._count("malformed")
+            try:
+                part = response["candidates"][0]["content"]["parts"][0]
+                part["text"] = part["text"][: max(1, len(part["text"]) // 2)]
+            except (KeyError, IndexError, TypeError):
+                pass
+        return None, response
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if re.match(r"^/v1\w*/models/?$", path):
+                self._send_json(200, fake.list_models())
+            elif path == "/_stats":
+                self._send_json(200, fake.stats)
+            else:
+                self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+        def do_POST(self):
+            match = _PATH_RE.match(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON body"}})
+                return
+            if not match:
+                self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+                return
+
+            model = match.group("model")
+            fake._count("requests")
+            delay = fake.delay_seconds(model)
+            upstream_path = self.path.replace(":streamGenerateContent", ":generateContent").split("?", 1)[0]
+            status, response, _ = fake.generate(model, body, upstream_path)
+            if status == 200:
+                fault_status, response = fake.inject_fault(response)
+                status = fault_status or status
+
+            if match.group("method") == "streamGenerateContent" and status == 200:
+                self._stream(response, delay)
+            else:
+                time.sleep(delay)
+                self._send_json(status, response)
+
+        def _stream(self, response, delay, pieces=4):
+            try:
+                text = response["candidates"][0]["content"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError):
+                text = ""
+            size = max(1, math.ceil(len(text) / pieces))
+            chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, chunk in enumerate(chunks):
+                time.sleep(delay / len(chunks))
+                event = _response_body(chunk)
+                if i < len(chunks) - 1:
+                    event["candidates"][0].pop("finishReason")
+                else:
+                    event["usageMetadata"] = response.get("usageMetadata", event["usageMetadata"])
+                self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+            self.close_connection = True
+
+        def log_message(self, fmt, *args):
+            logging.debug("fake-gemini: " + fmt % args)
+
+    return Handler
+
+
+def serve(fake, host="127.0.0.1", port=8089):
+    """Start the server on a daemon thread; returns the server (use .server_port / .shutdown())."""
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True).start()
+    return server
+
+
+def _parse_slow_models(values):
+    slow = {}
+    for value in values or []:
+        name, _, ms = value.partition("=")
+        slow[name] = float(ms)
+    return slow
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Gemini API server for load and regression tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="comma-separated model list")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="median/base latency per call")
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--slow-model", action="append", metavar="NAME=MS", help="per-model base latency")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--record", metavar="DIR", help="proxy to the real API and save responses")
+    parser.add_argument("--replay", metavar="DIR", help="serve saved responses")
+    parser.add_argument("--strict", action="store_true", help="404 for requests with no recording")
+    parser.add_argument("--upstream", default=UPSTREAM_URL)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    fake = FakeGemini(
+        models=[m.strip() for m in args.models.split(",") if m.strip()],
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        slow_models=_parse_slow_models(args.slow_model),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        malformed_rate=args.malformed_rate,
+        record_dir=args.record,
+        replay_dir=args.replay,
+        strict=args.strict,
+        upstream=args.upstream,
+        api_key=os.environ.get("GEMINI_API_KEY"),
+        seed=args.seed,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Gemini listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stats: {fake.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,27 @@
 import json
 import logging
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from . import deadlines
+    from .deadlines import DeadlineExceeded
+    from .gemini_metrics import CallTrace, MetricsRecorder, load_pricing
+    from .image_preprocess import prepare_for_model
+    from .model_cache import ModelCache
+    from .model_health import HealthBoard, LatencyStats
+    from .response_cache import TieredCache, fingerprint, normalize_text
+    from .singleflight import SingleFlight
+except ImportError:  # when run as a script
+    import deadlines
+    from deadlines import DeadlineExceeded
+    from gemini_metrics import CallTrace, MetricsRecorder, load_pricing
+    from image_preprocess import prepare_for_model
+    from model_cache import ModelCache
+    from model_health import HealthBoard, LatencyStats
+    from response_cache import TieredCache, fingerprint, normalize_text
+    from singleflight import SingleFlight
 
 try:
     from google import genai
@@ -9,16 +30,26 @@ except Exception:
     genai = None
     types = None
 
+try:
+    import httpx  # the google-genai transport
+    _TIMEOUT_ERRORS = (TimeoutError, httpx.TimeoutException)
+except ImportError:
+    _TIMEOUT_ERRORS = (TimeoutError,)
+
 
 def _build_client():
     if genai is None:
         logging.warning("Gemini SDK is not installed; using fallback analysis.")
         return None
-    api_key = os.environ.get("GEMINI_API_KEY")
+    # GEMINI_BASE_URL points the SDK at another endpoint, e.g. fake_gemini.py for load tests.
+    base_url = os.environ.get("GEMINI_BASE_URL")
+    api_key = os.environ.get("GEMINI_API_KEY") or ("local-fake" if base_url else None)
     if not api_key:
         logging.warning("GEMINI_API_KEY is missing; using fallback analysis.")
         return None
     try:
+        if base_url:
+            return genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=base_url))
         return genai.Client(api_key=api_key)
     except Exception as e:
         logging.warning(f"Gemini client init failed: {e}")
@@ -26,7 +57,78 @@ def _build_client():
 
 
 client = _build_client()
-_MODEL_CACHE = None
+_MODEL_CACHE = ModelCache(
+    path=os.environ.get("GEMINI_MODEL_CACHE_PATH"),
+    ttl=float(os.environ.get("GEMINI_MODEL_CACHE_TTL", 6 * 3600)),
+    failure_ttl=float(os.environ.get("GEMINI_MODEL_FAILURE_TTL", 300)),
+)
+_SYMPTOM_CACHE = TieredCache(
+    "symptoms",
+    maxsize=int(os.environ.get("GEMINI_RESPONSE_CACHE_SIZE", 512)),
+    ttl=float(os.environ.get("GEMINI_RESPONSE_CACHE_TTL", 24 * 3600)),
+)
+# Bump when the prompt changes. Answers are shared between pets with the same
+# _symptom_cache_key, so the prompt must not name the pet.
+_SYMPTOM_PROMPT_VERSION = "symptoms-v2"
+_IMAGE_PROMPT_VERSION = "image-v2"  # same rule, see image_cache_context
+
+_LATENCY = LatencyStats(window=int(os.environ.get("GEMINI_LATENCY_WINDOW", 200)))
+_HEALTH = HealthBoard(
+    window=int(os.environ.get("GEMINI_BREAKER_WINDOW", 20)),
+    min_calls=int(os.environ.get("GEMINI_BREAKER_MIN_CALLS", 5)),
+    error_rate=float(os.environ.get("GEMINI_BREAKER_ERROR_RATE", 0.5)),
+    slow_call_seconds=float(os.environ.get("GEMINI_BREAKER_SLOW_CALL_SECONDS", 20)),
+    slow_rate=float(os.environ.get("GEMINI_BREAKER_SLOW_RATE", 0.8)),
+    open_seconds=float(os.environ.get("GEMINI_BREAKER_OPEN_SECONDS", 30)),
+)
+_METRICS = MetricsRecorder(
+    log_path=os.environ.get("GEMINI_CALL_LOG"),
+    window_seconds=float(os.environ.get("GEMINI_METRICS_WINDOW", 900)),
+    pricing=load_pricing(),
+)
+_HEDGE_ENABLED = os.environ.get("GEMINI_HEDGE", "").lower() in ("1", "true", "yes")
+_HEDGE_PERCENTILE = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", 95))
+_HEDGE_DEFAULT_DELAY = float(os.environ.get("GEMINI_HEDGE_DEFAULT_DELAY", 2.0))
+_HEDGE_MIN_DELAY = float(os.environ.get("GEMINI_HEDGE_MIN_DELAY", 0.25))
+_HEDGE_MAX_DELAY = float(os.environ.get("GEMINI_HEDGE_MAX_DELAY", 10.0))
+_HEDGE_POOL = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("GEMINI_HEDGE_WORKERS", 8)),
+    thread_name_prefix="gemini-hedge",
+)
+_SINGLE_FLIGHT = SingleFlight(
+    lock_dir=os.environ.get("GEMINI_SINGLEFLIGHT_LOCK_DIR"),
+    lock_timeout=float(os.environ.get("GEMINI_SINGLEFLIGHT_LOCK_TIMEOUT", 30)),
+)
+# Per-attempt HTTP timeout; inside a request it is further capped by the remaining deadline.
+_ATTEMPT_TIMEOUT = float(os.environ.get("GEMINI_ATTEMPT_TIMEOUT", 30))
+_MIN_ATTEMPT_SECONDS = float(os.environ.get("GEMINI_MIN_ATTEMPT_SECONDS", 1.0))
+_IMAGE_MAX_EDGE = int(os.environ.get("GEMINI_IMAGE_MAX_EDGE", 1536))
+_IMAGE_FORMAT = os.environ.get("GEMINI_IMAGE_FORMAT", "jpeg")
+_IMAGE_QUALITY = int(os.environ.get("GEMINI_IMAGE_QUALITY", 85))
+_BATCH_MAX_ITEMS = int(os.environ.get("GEMINI_BATCH_MAX_ITEMS", 20))
+_BATCH_MAX_CHARS = int(os.environ.get("GEMINI_BATCH_MAX_CHARS", 12000))
+
+
+def attach_response_store(store):
+    """Put a shared store (e.g. SqlResponseStore) behind the in-process response cache."""
+    _SYMPTOM_CACHE.store = store
+
+
+def response_cache_stats():
+    return _SYMPTOM_CACHE.stats()
+
+
+def call_metrics():
+    return _METRICS.snapshot()
+
+
+def model_scoreboard():
+    """Per-model breaker state and latency, plus the resolved model, for /internal endpoints."""
+    return {
+        "resolved": _MODEL_CACHE.snapshot(),
+        "breakers": _HEALTH.snapshot(),
+        "latency": _LATENCY.summary(),
+    }
 
 
 def _preferred_models():
@@ -70,31 +172,67 @@ def _discover_available_generate_models():
     return names
 
 
-def _resolve_model():
-    global _MODEL_CACHE
-    if _MODEL_CACHE:
-        return _MODEL_CACHE
-
-    preferred = _preferred_models()
-    available = _discover_available_generate_models()
-
+def _pick_model(preferred, available):
     if available:
         for name in preferred:
             if name in available:
-                _MODEL_CACHE = name
-                return _MODEL_CACHE
-        _MODEL_CACHE = available[0]
-        return _MODEL_CACHE
+                return name
+        return available[0]
+    return preferred[0]
 
-    _MODEL_CACHE = preferred[0]
-    return _MODEL_CACHE
+
+def _refresh_model_cache():
+    preferred = _preferred_models()
+    # Another worker may already have refreshed the shared file.
+    if _MODEL_CACHE.load(preferred) and not _MODEL_CACHE.is_stale():
+        return
+    available = _discover_available_generate_models()
+    if not available:
+        return
+    _MODEL_CACHE.update(
+        _pick_model(preferred, available),
+        available=available,
+        preferred=preferred,
+        source="discovery",
+    )
 
 
-def _generate_content_with_fallback(contents, config=None):
-    global _MODEL_CACHE
-    if client is None:
-        raise RuntimeError("Gemini client unavailable")
+def _resolve_model():
+    preferred = _preferred_models()
+    if _MODEL_CACHE.model is None:
+        _MODEL_CACHE.load(preferred)
+    if _MODEL_CACHE.model is None:
+        # Serve the first preferred model now and discover in the background.
+        _MODEL_CACHE.update(preferred[0], preferred=preferred, source="default", persist=False)
+    if client is not None and (_MODEL_CACHE.source == "default" or _MODEL_CACHE.is_stale()):
+        _MODEL_CACHE.refresh_async(_refresh_model_cache)
+
+    model = _MODEL_CACHE.model
+    if _HEALTH.is_open(model):
+        for name in preferred + _MODEL_CACHE.available:
+            if not _HEALTH.is_open(name):
+                return name
+    return model
+
+
+def warm_up():
+    """Resolve the model now, at boot, instead of on the first request; returns it."""
+    if client is not None:
+        _refresh_model_cache()
+    return _resolve_model()
+
+
+def reset_after_fork():
+    """Give a forked worker its own HTTP client and hedge pool instead of the parent's."""
+    global client, _HEDGE_POOL
+    client = _build_client()
+    _HEDGE_POOL = ThreadPoolExecutor(
+        max_workers=int(os.environ.get("GEMINI_HEDGE_WORKERS", 8)),
+        thread_name_prefix="gemini-hedge",
+    )
 
+
+def _candidate_models():
     candidates = []
     primary = _resolve_model()
     if primary:
@@ -102,29 +240,317 @@ def _generate_content_with_fallback(contents, config=None):
     for m in _preferred_models():
         if m not in candidates:
             candidates.append(m)
+    # Open circuits go last (and are skipped at call time); recently failed
+    # models are still tried, but only after healthy ones.
+    return sorted(candidates, key=lambda m: (_HEALTH.is_open(m), _MODEL_CACHE.recently_failed(m)))
+
+
+def _attempt_timeout(model_name):
+    """
+    Seconds an attempt on `model_name` may take, or None if the remaining
+    request budget cannot cover the minimum attempt or the model's median
+    latency, in which case the attempt should not be started at all.
+    """
+    left = deadlines.remaining()
+    if left is None:
+        return _ATTEMPT_TIMEOUT
+    expected = _LATENCY.percentile(model_name, 50) or 0.0
+    if left < max(_MIN_ATTEMPT_SECONDS, expected):
+        return None
+    return min(_ATTEMPT_TIMEOUT, left)
+
+
+def _with_timeout(config, seconds):
+    if types is None:
+        return config
+    http_options = types.HttpOptions(timeout=max(1, int(seconds * 1000)))
+    if config is None:
+        return types.GenerateContentConfig(http_options=http_options)
+    return config.model_copy(update={"http_options": http_options})
+
+
+def _no_model_error(trace):
+    if trace.out_of_budget:
+        return DeadlineExceeded(f"Request deadline too close to try: {', '.join(trace.out_of_budget)}")
+    return RuntimeError("No Gemini model available")
+
+
+def _record_attempt_failure(model_name, error, attempt_timeout):
+    """
+    Count a failed attempt against the model's breaker, unless it only ran
+    out of time the request deadline had cut short: a caller's short
+    X-Request-Timeout-Ms says nothing about the model's health.
+    """
+    if isinstance(error, DeadlineExceeded) or (attempt_timeout < _ATTEMPT_TIMEOUT and isinstance(error, _TIMEOUT_ERRORS)):
+        _HEALTH.release(model_name)
+    else:
+        _HEALTH.record_failure(model_name)
 
+
+def _check_response(response, config):
+    if getattr(config, "response_mime_type", None) == "application/json":
+        json.loads(response.text)
+
+
+def _call_model(model_name, contents, config, attempt_timeout):
+    """
+    Call one model; the caller must already hold a _HEALTH.acquire() slot.
+    A JSON answer that doesn't parse counts as a failure of that model.
+    """
+    started = time.monotonic()
+    try:
+        response = client.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=_with_timeout(config, attempt_timeout),
+        )
+        _check_response(response, config)
+    except Exception as e:
+        _record_attempt_failure(model_name, e, attempt_timeout)
+        raise
+    elapsed = time.monotonic() - started
+    _LATENCY.record(model_name, elapsed)
+    _HEALTH.record_success(model_name, elapsed)
+    return response
+
+
+def _hedge_delay(model_name):
+    observed = _LATENCY.percentile(model_name, _HEDGE_PERCENTILE)
+    if observed is None:
+        return _HEDGE_DEFAULT_DELAY
+    return min(_HEDGE_MAX_DELAY, max(_HEDGE_MIN_DELAY, observed))
+
+
+def _generate_hedged(candidates, contents, config, trace):
+    """
+    Start the first candidate; whenever the newest attempt outlives its
+    model's latency percentile, start the next one alongside it. The first
+    valid response wins and the remaining attempts are cancelled (attempts
+    already running finish in the background and are discarded).
+    """
+    queue = list(candidates)
+    pending = {}
+    newest = None
+    last_error = None
+
+    def launch():
+        nonlocal newest
+        while queue:
+            model_name = queue.pop(0)
+            attempt_timeout = _attempt_timeout(model_name)
+            if attempt_timeout is None:
+                trace.skipped_budget(model_name)
+                continue
+            if _HEALTH.acquire(model_name):
+                newest = model_name
+                pending[_HEDGE_POOL.submit(_call_model, model_name, contents, config, attempt_timeout)] = model_name
+                return
+            trace.skipped_open(model_name)
+            logging.debug(f"Gemini model '{model_name}' circuit open; skipping")
+
+    launch()
+    try:
+        while pending:
+            timeout = _hedge_delay(newest) if queue else None
+            left = deadlines.remaining()
+            if left is not None:
+                timeout = left if timeout is None else min(timeout, left)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if deadlines.expired():
+                    raise DeadlineExceeded(f"Request deadline reached waiting on {', '.join(pending.values())}")
+                logging.info(f"Gemini model '{newest}' slower than {timeout:.2f}s; hedging")
+                launch()
+                continue
+            for future in done:
+                model_name = pending.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    trace.failed(model_name, e)
+                    _MODEL_CACHE.mark_failed(model_name)
+                    logging.warning(f"Gemini model '{model_name}' failed: {e}")
+                    continue
+                trace.succeeded(model_name)
+                _MODEL_CACHE.promote(model_name)
+                return response
+            if not pending and queue:
+                launch()
+    finally:
+        for future, model_name in pending.items():
+            if future.cancel():
+                _HEALTH.release(model_name)
+
+    raise last_error if last_error else _no_model_error(trace)
+
+
+def _generate_sequential(candidates, contents, config, trace):
     last_error = None
     for model_name in candidates:
+        attempt_timeout = _attempt_timeout(model_name)
+        if attempt_timeout is None:
+            trace.skipped_budget(model_name)
+            continue
+        if not _HEALTH.acquire(model_name):
+            trace.skipped_open(model_name)
+            logging.debug(f"Gemini model '{model_name}' circuit open; skipping")
+            continue
         try:
-            response = client.models.generate_content(
+            response = _call_model(model_name, contents, config, attempt_timeout)
+            trace.succeeded(model_name)
+            _MODEL_CACHE.promote(model_name)
+            return response
+        except Exception as e:
+            last_error = e
+            trace.failed(model_name, e)
+            _MODEL_CACHE.mark_failed(model_name)
+            logging.warning(f"Gemini model '{model_name}' failed: {e}")
+
+    raise last_error if last_error else _no_model_error(trace)
+
+
+def _generate_content_with_fallback(contents, config=None, operation="generate"):
+    if client is None:
+        raise RuntimeError("Gemini client unavailable")
+
+    trace = CallTrace(operation, hedged=_HEDGE_ENABLED)
+    generate = _generate_hedged if _HEDGE_ENABLED else _generate_sequential
+    try:
+        response = generate(_candidate_models(), contents, config, trace)
+    except Exception as e:
+        _METRICS.record(trace.to_record(error=e))
+        raise
+    _METRICS.record(trace.to_record(usage=getattr(response, "usage_metadata", None)))
+    return response
+
+
+def _generate_content_stream_with_fallback(contents, config=None, operation="generate"):
+    """
+    Stream text chunks from the first candidate model that starts answering.
+    Models are only switched before the first chunk arrives; a failure after
+    that is raised to the caller.
+    """
+    if client is None:
+        raise RuntimeError("Gemini client unavailable")
+
+    trace = CallTrace(operation, streamed=True)
+    last_error = None
+    for model_name in _candidate_models():
+        attempt_timeout = _attempt_timeout(model_name)
+        if attempt_timeout is None:
+            trace.skipped_budget(model_name)
+            continue
+        if not _HEALTH.acquire(model_name):
+            trace.skipped_open(model_name)
+            logging.debug(f"Gemini model '{model_name}' circuit open; skipping")
+            continue
+        started = time.monotonic()
+        try:
+            stream = iter(client.models.generate_content_stream(
                 model=model_name,
                 contents=contents,
-                config=config,
-            )
-            _MODEL_CACHE = model_name
-            return response
+                config=_with_timeout(config, attempt_timeout),
+            ))
+            first = next(stream, None)
         except Exception as e:
             last_error = e
+            trace.failed(model_name, e)
+            _record_attempt_failure(model_name, e, attempt_timeout)
+            _MODEL_CACHE.mark_failed(model_name)
             logging.warning(f"Gemini model '{model_name}' failed: {e}")
+            continue
 
-    raise last_error if last_error else RuntimeError("No Gemini model available")
+        _MODEL_CACHE.promote(model_name)
+        usage = getattr(first, "usage_metadata", None)
+        try:
+            if first is not None and first.text:
+                yield first.text
+            for chunk in stream:
+                if deadlines.expired():
+                    raise DeadlineExceeded(f"Request deadline reached while streaming from '{model_name}'")
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            trace.failed(model_name, e)
+            _record_attempt_failure(model_name, e, attempt_timeout)
+            _METRICS.record(trace.to_record(error=e))
+            raise
+        elapsed = time.monotonic() - started
+        trace.succeeded(model_name)
+        _LATENCY.record(model_name, elapsed)
+        _HEALTH.record_success(model_name, elapsed)
+        _METRICS.record(trace.to_record(usage=usage))
+        return
+
+    error = last_error if last_error else _no_model_error(trace)
+    _METRICS.record(trace.to_record(error=error))
+    raise error
+
+
+def _generate_json_text(prompt, key, operation="generate"):
+    """
+    Run a JSON prompt through the single-flight layer: concurrent callers with
+    the same key share one upstream call. Each caller parses its own copy.
+    """
+    def call():
+        response = _generate_content_with_fallback(
+            contents=prompt,
+            config=(types.GenerateContentConfig(response_mime_type="application/json") if types else None),
+            operation=operation,
+        )
+        return response.text
 
+    # Followers wait for the leader only as long as their own deadline allows.
+    return _SINGLE_FLIGHT.do(key, call, timeout=deadlines.remaining())
 
-def analyze_pet_symptoms(pet, symptoms):
-    prompt = f"""
+
+def _age_bracket(age):
+    try:
+        age = float(age)
+    except (TypeError, ValueError):
+        return "unknown"
+    if age < 1:
+        return "juvenile"
+    if age < 3:
+        return "young"
+    if age < 8:
+        return "adult"
+    return "senior"
+
+
+def _symptom_cache_key(pet, symptoms):
+    return fingerprint(
+        prompt=_SYMPTOM_PROMPT_VERSION,
+        species=normalize_text(pet.species),
+        breed=normalize_text(pet.breed),
+        age=_age_bracket(pet.age),
+        notes=normalize_text(pet.medical_notes),
+        symptoms=normalize_text(symptoms),
+    )
+
+
+def image_cache_context(pet, description=""):
+    """
+    Everything besides the image that can change an image analysis. The
+    image_match check depends on species and breed, so those are part of it;
+    pet name and exact age are not, so pets of the same kind share entries
+    (and the image prompt must not name the pet).
+    """
+    return fingerprint(
+        prompt=_IMAGE_PROMPT_VERSION,
+        species=normalize_text(pet.species),
+        breed=normalize_text(pet.breed),
+        age=_age_bracket(pet.age),
+        description=normalize_text(description),
+    )
+
+
+def _symptom_prompt(pet, symptoms):
+    return f"""
     You are a veterinary AI assistant. Analyze the provided pet symptoms.
     Pet Information:
-    - Name: {pet.name}
     - Species: {pet.species}
     - Breed: {pet.breed}
     - Age: {pet.age} years
@@ -135,28 +561,169 @@ def analyze_pet_symptoms(pet, symptoms):
     Respond ONLY with JSON in this format:
     {{"diagnosis": ["string1", "string2"], "urgency_level": "string", "recommendation": "string", "possible_causes": ["string1", "string2"]}}
     """
+
+
+def analyze_pet_symptoms(pet, symptoms, fallback=None):
+    """
+    Gemini symptom analysis. When the model cannot answer (including when
+    the request deadline is spent) `fallback(pet, symptoms)` is returned,
+    by default get_fallback_symptom_analysis.
+    """
+    cache_key = _symptom_cache_key(pet, symptoms)
+    cached = _SYMPTOM_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    prompt = _symptom_prompt(pet, symptoms)
+    try:
+        analysis = json.loads(_generate_json_text(prompt, cache_key, operation="symptoms"))
+    except Exception as e:
+        logging.error(f"AI Integration error: {e}")
+        _METRICS.record_local_fallback("symptoms", e)
+        return (fallback or get_fallback_symptom_analysis)(pet, symptoms)
+    # Only real model answers are cached, never the fallback.
+    _SYMPTOM_CACHE.put(cache_key, analysis)
+    return analysis
+
+
+def analyze_pet_symptoms_stream(pet, symptoms, fallback=None):
+    """
+    Streaming variant of analyze_pet_symptoms. Yields ("delta", text) for each
+    chunk of the raw Gemini response, then exactly one ("analysis", dict) with
+    the parsed result (or the fallback analysis if streaming or parsing failed).
+    """
+    cache_key = _symptom_cache_key(pet, symptoms)
+    cached = _SYMPTOM_CACHE.get(cache_key)
+    if cached is not None:
+        yield "delta", json.dumps(cached)
+        yield "analysis", cached
+        return
+
+    parts = []
+    try:
+        for text in _generate_content_stream_with_fallback(
+            contents=_symptom_prompt(pet, symptoms),
+            config=(types.GenerateContentConfig(response_mime_type="application/json") if types else None),
+            operation="symptoms_stream",
+        ):
+            parts.append(text)
+            yield "delta", text
+        analysis = json.loads("".join(parts))
+    except Exception as e:
+        logging.error(f"AI Integration error: {e}")
+        _METRICS.record_local_fallback("symptoms_stream", e)
+        yield "analysis", (fallback or get_fallback_symptom_analysis)(pet, symptoms)
+        return
+    _SYMPTOM_CACHE.put(cache_key, analysis)
+    yield "analysis", analysis
+
+
+def _batch_chunks(items, max_items, max_chars):
+    """Split (index, pet, symptoms) items into prompts bounded by item count and text size."""
+    chunk, size = [], 0
+    for item in items:
+        item_size = len(item[2] or "") + len(item[1].medical_notes or "") + 200
+        if chunk and (len(chunk) >= max_items or size + item_size > max_chars):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        yield chunk
+
+
+def _analyze_symptom_chunk(chunk):
+    """One Gemini call for a chunk; returns {index: analysis} for the items it answered validly."""
+    cases = [
+        {
+            "index": index,
+            "species": pet.species,
+            "breed": pet.breed,
+            "age_years": pet.age,
+            "medical_notes": pet.medical_notes or "None",
+            "symptoms": symptoms,
+        }
+        for index, pet, symptoms in chunk
+    ]
+    prompt = f"""
+    You are a veterinary AI assistant. Analyze each pet case below independently.
+    Cases (JSON):
+    {json.dumps(cases)}
+
+    Respond ONLY with a JSON array containing exactly one object per case, in this format:
+    [{{"index": 0, "diagnosis": ["string1", "string2"], "urgency_level": "string", "recommendation": "string", "possible_causes": ["string1", "string2"]}}]
+    """
     try:
         response = _generate_content_with_fallback(
             contents=prompt,
             config=(types.GenerateContentConfig(response_mime_type="application/json") if types else None),
+            operation="symptoms_batch",
         )
-        return json.loads(response.text)
+        parsed = json.loads(response.text)
     except Exception as e:
-        logging.error(f"AI Integration error: {e}")
-        return get_fallback_symptom_analysis(pet, symptoms)
+        logging.error(f"AI Integration error (batch of {len(chunk)}): {e}")
+        return {}
+
+    expected = {index for index, _, _ in chunk}
+    answered = {}
+    for entry in parsed if isinstance(parsed, list) else []:
+        if not isinstance(entry, dict) or entry.get("index") not in expected or not entry.get("diagnosis"):
+            continue
+        index = entry.pop("index")
+        answered.setdefault(index, entry)
+    return answered
+
+
+def analyze_pet_symptoms_batch(items, fallback=None):
+    """
+    Analyze many (pet, symptoms) pairs with as few Gemini calls as possible.
+
+    Cached answers are served directly. The rest are packed into multi-case
+    prompts of at most GEMINI_BATCH_MAX_ITEMS cases / GEMINI_BATCH_MAX_CHARS
+    characters. Any case missing from, or malformed in, a batch answer goes
+    through analyze_pet_symptoms on its own (with `fallback`). Results follow
+    input order.
+    """
+    results = [None] * len(items)
+    keys = [None] * len(items)
+    pending = []
+    for index, (pet, symptoms) in enumerate(items):
+        keys[index] = _symptom_cache_key(pet, symptoms)
+        cached = _SYMPTOM_CACHE.get(keys[index])
+        if cached is not None:
+            results[index] = cached
+        else:
+            pending.append((index, pet, symptoms))
+
+    for chunk in _batch_chunks(pending, _BATCH_MAX_ITEMS, _BATCH_MAX_CHARS):
+        answered = _analyze_symptom_chunk(chunk) if client is not None and not deadlines.expired() else {}
+        for index, pet, symptoms in chunk:
+            analysis = answered.get(index)
+            if analysis is None:
+                results[index] = analyze_pet_symptoms(pet, symptoms, fallback)
+            else:
+                _SYMPTOM_CACHE.put(keys[index], analysis)
+                results[index] = analysis
+    return results
 
 
 def analyze_pet_image(pet, image_path, description=""):
     try:
         with open(image_path, "rb") as f:
             image_data = f.read()
+        # The original stays on disk; Gemini gets a bounded, metadata-free copy.
+        image_data, mime_type = prepare_for_model(
+            image_data,
+            max_edge=_IMAGE_MAX_EDGE,
+            output_format=_IMAGE_FORMAT,
+            quality=_IMAGE_QUALITY,
+        )
 
         prompt = f"""
         You are a veterinary AI assistant specializing in visual pet health assessment.
         First task: verify whether the uploaded image matches the selected pet profile.
 
         Selected Pet Profile:
-        - Name: {pet.name}
         - Species: {pet.species}
         - Breed: {pet.breed}
         - Age: {pet.age} years
@@ -185,29 +752,36 @@ def analyze_pet_image(pet, image_path, description=""):
         response = _generate_content_with_fallback(
             contents=[
                 prompt,
-                (types.Part.from_bytes(data=image_data, mime_type="image/jpeg") if types else image_data),
+                (types.Part.from_bytes(data=image_data, mime_type=mime_type) if types else image_data),
             ],
             config=(types.GenerateContentConfig(response_mime_type="application/json") if types else None),
+            operation="image",
         )
         return json.loads(response.text)
     except Exception as e:
         logging.error(f"AI Integration error: {e}")
+        _METRICS.record_local_fallback("image", e)
         return get_fallback_image_analysis(pet, description)
 
 
-def get_diagnosis_explanation_from_gemini(diagnosis_name):
+def generate_diagnosis_explanation(diagnosis_name):
+    """Ask Gemini for an explanation; raises instead of falling back."""
     prompt = (
         f'Provide a detailed educational explanation for the pet health diagnosis: "{diagnosis_name}". '
         'Respond ONLY with JSON: {"description": "string", "causes": ["string"], "symptoms": ["string"]}'
     )
+    explanation = json.loads(_generate_json_text(prompt, fingerprint(prompt=prompt), operation="explanation"))
+    if not isinstance(explanation, dict) or not explanation.get("description"):
+        raise ValueError("Gemini returned an empty explanation")
+    return explanation
+
+
+def get_diagnosis_explanation_from_gemini(diagnosis_name):
     try:
-        response = _generate_content_with_fallback(
-            contents=prompt,
-            config=(types.GenerateContentConfig(response_mime_type="application/json") if types else None),
-        )
-        return json.loads(response.text)
+        return generate_diagnosis_explanation(diagnosis_name)
     except Exception as e:
         logging.error(f"AI Integration error: {e}")
+        _METRICS.record_local_fallback("explanation", e)
         return get_fallback_explanation(diagnosis_name)
 
 
@@ -0,0 +1,207 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+
+# Public list prices in USD per 1M tokens (input, output); override with GEMINI_PRICING_JSON.
+DEFAULT_PRICING = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
+LATENCY_BUCKETS_MS = [100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000]
+
+
+def error_reason(error):
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    name = type(error).__name__
+    return f"{name} {code}" if code else name
+
+
+class CallTrace:
+    """Attempts made for one logical Gemini call, filled in by the fallback loop."""
+
+    def __init__(self, operation, hedged=False, streamed=False):
+        self.operation = operation
+        self.hedged = hedged
+        self.streamed = streamed
+        self.started = time.monotonic()
+        self.attempts = []  # (model, failure reason or None)
+        self.skipped = []
+        self.out_of_budget = []
+        self.model = None
+
+    def failed(self, model, error):
+        self.attempts.append((model, error_reason(error)))
+
+    def skipped_open(self, model):
+        self.skipped.append(model)
+
+    def skipped_budget(self, model):
+        self.out_of_budget.append(model)
+
+    def succeeded(self, model):
+        self.model = model
+        self.attempts.append((model, None))
+
+    def to_record(self, usage=None, error=None):
+        failures = [f"{model}: {reason}" for model, reason in self.attempts if reason]
+        if error is not None:
+            fallback_reason = "all models failed: " + "; ".join(failures) if failures else error_reason(error)
+        elif failures:
+            fallback_reason = failures[0]
+        elif self.skipped:
+            fallback_reason = "circuit open: " + ", ".join(self.skipped)
+        elif self.out_of_budget:
+            fallback_reason = "over deadline: " + ", ".join(self.out_of_budget)
+        else:
+            fallback_reason = None
+        return {
+            "ts": time.time(),
+            "operation": self.operation,
+            "model": self.model,
+            "outcome": "error" if error is not None else "ok",
+            "duration_ms": round((time.monotonic() - self.started) * 1000, 1),
+            "attempts": len(self.attempts),
+            "retries": max(0, len(self.attempts) - 1),
+            "skipped_models": list(self.skipped),
+            "budget_skipped_models": list(self.out_of_budget),
+            "fallback_reason": fallback_reason,
+            "hedged": self.hedged,
+            "streamed": self.streamed,
+            "prompt_tokens": getattr(usage, "prompt_token_count", None) if usage else None,
+            "response_tokens": getattr(usage, "candidates_token_count", None) if usage else None,
+            "total_tokens": getattr(usage, "total_token_count", None) if usage else None,
+        }
+
+
+class RollingHistogram:
+    """Observations from the last `window_seconds` (at most `maxlen`), summarised on demand."""
+
+    def __init__(self, window_seconds=900, maxlen=5000, buckets=None):
+        self.window_seconds = window_seconds
+        self.buckets = buckets or LATENCY_BUCKETS_MS
+        self._values = deque(maxlen=maxlen)
+
+    def add(self, value, now=None):
+        self._values.append((now or time.time(), value))
+
+    def _current(self):
+        cutoff = time.time() - self.window_seconds
+        while self._values and self._values[0][0] < cutoff:
+            self._values.popleft()
+        return sorted(v for _, v in self._values)
+
+    def summary(self):
+        values = self._current()
+        if not values:
+            return {"count": 0}
+
+        def pct(p):
+            return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+        counts = [0] * (len(self.buckets) + 1)
+        for v in values:
+            i = 0
+            while i < len(self.buckets) and v > self.buckets[i]:
+                i += 1
+            counts[i] += 1
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": len(values),
+            "p50": pct(50),
+            "p95": pct(95),
+            "p99": pct(99),
+            "max": values[-1],
+            "buckets": dict(zip(labels, counts)),
+        }
+
+
+class MetricsRecorder:
+    """
+    Rolling per-(operation, model) latency and token histograms, lifetime
+    counters and estimated spend, plus an optional append-only JSONL log.
+    """
+
+    def __init__(self, log_path=None, window_seconds=900, pricing=None):
+        self.log_path = log_path
+        self.window_seconds = window_seconds
+        self.pricing = dict(DEFAULT_PRICING if pricing is None else pricing)
+        self._lock = threading.Lock()
+        self._latency = defaultdict(lambda: RollingHistogram(window_seconds))
+        self._tokens = defaultdict(lambda: RollingHistogram(window_seconds, buckets=[250, 500, 1000, 2000, 4000, 8000]))
+        self.totals = defaultdict(lambda: defaultdict(int))
+
+    def cost_usd(self, model, prompt_tokens, response_tokens):
+        price = self.pricing.get(model)
+        if price is None or prompt_tokens is None:
+            return None
+        return (prompt_tokens * price[0] + (response_tokens or 0) * price[1]) / 1_000_000
+
+    def record(self, record):
+        record["cost_usd"] = self.cost_usd(record["model"], record["prompt_tokens"], record["response_tokens"])
+        key = f"{record['operation']}:{record['model'] or 'none'}"
+        with self._lock:
+            self._latency[key].add(record["duration_ms"], record["ts"])
+            if record["total_tokens"] is not None:
+                self._tokens[key].add(record["total_tokens"], record["ts"])
+            totals = self.totals[key]
+            totals["calls"] += 1
+            totals["errors"] += record["outcome"] == "error"
+            totals["retries"] += record["retries"]
+            totals["with_fallback"] += record["fallback_reason"] is not None
+            totals["prompt_tokens"] += record["prompt_tokens"] or 0
+            totals["response_tokens"] += record["response_tokens"] or 0
+            totals["cost_usd"] += record["cost_usd"] or 0.0
+        self._append(record)
+
+    def record_local_fallback(self, operation, error):
+        """Count a get_fallback_* answer served instead of a model response."""
+        with self._lock:
+            self.totals[f"{operation}:local_fallback"]["calls"] += 1
+        self._append({"ts": time.time(), "operation": operation, "outcome": "local_fallback",
+                      "fallback_reason": error_reason(error)})
+
+    def _append(self, record):
+        if not self.log_path:
+            return
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        # One write() on an O_APPEND fd lands as a whole line even with other
+        # threads and workers appending, so no lock is held for the disk write.
+        try:
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logging.warning(f"Could not append Gemini call log {self.log_path}: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            keys = sorted(set(self._latency) | set(self.totals))
+            return {
+                key: {
+                    "totals": {k: round(v, 6) for k, v in self.totals[key].items()},
+                    "latency_ms": self._latency[key].summary() if key in self._latency else {"count": 0},
+                    "tokens": self._tokens[key].summary() if key in self._tokens else {"count": 0},
+                }
+                for key in keys
+            }
+
+
+def load_pricing():
+    raw = os.environ.get("GEMINI_PRICING_JSON")
+    if not raw:
+        return None
+    try:
+        return {model: tuple(prices) for model, prices in json.loads(raw).items()}
+    except (ValueError, TypeError) as e:
+        logging.warning(f"Ignoring invalid GEMINI_PRICING_JSON: {e}")
+        return None
@@ -0,0 +1,34 @@
+"""
+gunicorn settings:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The master imports the app once (preload_app) and runs warmup.warmup()
+before forking. Workers then start with the knowledge base, symptom models,
+explanation catalog and resolved Gemini model already in memory, shared
+copy-on-write. Set GUNICORN_PRELOAD=false to load the app in each worker
+instead, e.g. for --reload during development.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# Keep above REQUEST_DEADLINE_SECONDS (25) so slow Gemini calls degrade instead of being killed.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() not in ("0", "false", "no")
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported and before any worker exists.
+    if preload_app:
+        from warmup import warmup
+        server.log.info(f"Warm-up: {warmup()}")
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from warmup import after_fork
+        after_fork()
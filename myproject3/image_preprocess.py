@@ -0,0 +1,85 @@
+import logging
+from io import BytesIO
+
+try:
+    from PIL import Image, ImageOps
+except Exception:  # pragma: no cover
+    Image = None
+    ImageOps = None
+
+
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+_OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+def sniff_mime(data):
+    """Detect the image type from its magic bytes; None if unrecognised."""
+    head = data[:16]
+    for signature, mime in _SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "image/heic"
+    return None
+
+
+def prepare_for_model(data, max_edge=1536, output_format="jpeg", quality=85):
+    """
+    Shrink an uploaded image before it is sent to a vision model.
+
+    Applies the EXIF orientation, bounds the longest edge to `max_edge`,
+    flattens transparency onto white and re-encodes as JPEG or WebP without
+    any metadata. Returns (bytes, mime_type). If Pillow is missing or the
+    image cannot be decoded, the original bytes are returned with their
+    sniffed type.
+    """
+    original_mime = sniff_mime(data) or "image/jpeg"
+    if Image is None:
+        return data, original_mime
+
+    pil_format, mime = _OUTPUT_FORMATS.get(output_format.lower(), _OUTPUT_FORMATS["jpeg"])
+    try:
+        img = Image.open(BytesIO(data))
+        has_metadata = any(k in img.info for k in ("exif", "icc_profile", "xmp", "comment"))
+        original_size = img.size
+        # JPEG can decode straight to a reduced scale, which skips most of the work for large photos.
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        out = BytesIO()
+        # No exif=/icc_profile= arguments, so no metadata is written.
+        img.save(out, format=pil_format, quality=quality, optimize=True)
+        encoded = out.getvalue()
+        if (
+            original_mime == mime
+            and not has_metadata
+            and img.size == original_size
+            and len(data) <= len(encoded)
+        ):
+            # Already small, clean and in the target format: re-encoding only adds loss.
+            return data, original_mime
+        return encoded, mime
+    except Exception as e:
+        logging.warning(f"Image preprocessing failed, sending original bytes: {e}")
+        return data, original_mime
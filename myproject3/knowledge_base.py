@@ -0,0 +1,338 @@
+"""
+Condition knowledge base for the local symptom models.
+
+Conditions, keyword weights, red-flag phrases and the RandomForest training
+profiles live in a versioned JSON file (knowledge_base.json next to this
+module, or KNOWLEDGE_BASE_PATH). It is compiled once into an immutable
+KnowledgeIndex: phrase automaton, sparse weight matrix, species boosts.
+When the file changes the new index is compiled off to the side and swapped
+in with a single reference assignment; a bad edit is logged and the previous
+version stays live.
+
+Check an edited file before shipping it with:
+
+    python knowledge_base.py check [path]
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+try:
+    import numpy as np
+    from scipy import sparse
+except Exception:  # pragma: no cover
+    np = None
+    sparse = None
+
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base.json")
+
+SPECIES_MATCH_BOOST = 1.1
+SPECIES_MISMATCH_BOOST = 0.95
+
+
+class KnowledgeBaseError(ValueError):
+    pass
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over normalized text: one left-to-right pass
+    reports every pattern occurrence, however many patterns there are.
+
+    A `whole_word` pattern only counts when it is bounded by whitespace or
+    the ends of the text (single-word keywords are whole tokens); the others
+    match anywhere, like a substring test.
+    """
+
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._delta = None
+        self.entries = []  # (length, whole_word, payload)
+
+    def add(self, phrase, payload, whole_word=False):
+        state = 0
+        for ch in phrase:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(len(self.entries))
+        self.entries.append((len(phrase), whole_word, payload))
+
+    def build(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        # Fold the failure links into a full transition table so matching is one dict lookup per character.
+        self._delta = [None] * len(self._goto)
+        self._delta[0] = dict(self._goto[0])
+        for state in queue:
+            self._delta[state] = {**self._delta[self._fail[state]], **self._goto[state]}
+        return self
+
+    def find(self, text):
+        """Indexes into `entries` of every pattern present in `text` (each reported once)."""
+        found = set()
+        delta, out = self._delta, self._out
+        state = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            state = delta[state].get(ch, 0)
+            if not out[state]:
+                continue
+            for entry_id in out[state]:
+                length, whole_word, _ = self.entries[entry_id]
+                if whole_word:
+                    start = i - length + 1
+                    if (start > 0 and not text[start - 1].isspace()) or (i < last and not text[i + 1].isspace()):
+                        continue
+                found.add(entry_id)
+        return found
+
+
+class Condition:
+    __slots__ = ("name", "species", "keywords", "causes", "recommendation")
+
+    def __init__(self, name, species, keywords, causes, recommendation):
+        self.name = name
+        self.species = frozenset(species)
+        self.keywords = tuple(keywords)  # ((phrase, weight), ...) in file order
+        self.causes = tuple(causes)
+        self.recommendation = recommendation
+
+
+class KnowledgeIndex:
+    """One compiled, read-only version of the knowledge base."""
+
+    __slots__ = (
+        "version", "source", "conditions", "red_flags", "profiles",
+        "matcher", "weight_matrix", "red_flag_vector", "_species_boosts", "_default_boost",
+    )
+
+    def __init__(self, version, source, conditions, red_flags, profiles):
+        self.version = version
+        self.source = source
+        self.conditions = tuple(conditions)
+        self.red_flags = tuple(red_flags)
+        self.profiles = MappingProxyType(profiles)
+
+        matcher = PhraseMatcher()
+        for cond_index, condition in enumerate(self.conditions):
+            for order, (phrase, weight) in enumerate(condition.keywords):
+                matcher.add(phrase, ("keyword", cond_index, order, weight), whole_word=" " not in phrase)
+        for phrase in self.red_flags:
+            matcher.add(phrase, ("red_flag", phrase, 0, 0.0))
+        self.matcher = matcher.build()
+
+        self.weight_matrix = self.red_flag_vector = None
+        self._species_boosts = {}
+        self._default_boost = None
+        if np is not None:
+            self._compile_matrices()
+
+    def _compile_matrices(self):
+        rows, cols, weights, red_flag_rows = [], [], [], []
+        for entry_id, (_, _, (kind, ref, _, weight)) in enumerate(self.matcher.entries):
+            if kind == "red_flag":
+                red_flag_rows.append(entry_id)
+            else:
+                rows.append(entry_id)
+                cols.append(ref)
+                weights.append(weight)
+        shape = (len(self.matcher.entries), len(self.conditions))
+        self.weight_matrix = sparse.csr_matrix((weights, (rows, cols)), shape=shape, dtype=np.float64)
+        self.red_flag_vector = np.zeros(len(self.matcher.entries), dtype=np.float64)
+        self.red_flag_vector[red_flag_rows] = 1.0
+
+        self._default_boost = np.full(len(self.conditions), SPECIES_MISMATCH_BOOST)
+        self._default_boost.setflags(write=False)
+        for name in {s for c in self.conditions for s in c.species}:
+            boost = np.array([
+                SPECIES_MATCH_BOOST if name in c.species else SPECIES_MISMATCH_BOOST for c in self.conditions
+            ])
+            boost.setflags(write=False)
+            self._species_boosts[name] = boost
+
+    def species_boost(self, species):
+        """Per-condition species prior as a vector (NumPy required)."""
+        return self._species_boosts.get(species, self._default_boost)
+
+    def condition_names(self):
+        return [c.name for c in self.conditions] + list(self.profiles)
+
+
+def _require(data, key, kind):
+    value = data.get(key)
+    if not isinstance(value, kind):
+        raise KnowledgeBaseError(f"'{key}' must be a {kind.__name__}")
+    return value
+
+
+def compile_index(data, source=None):
+    """Validate parsed knowledge-base data and compile it; raises KnowledgeBaseError."""
+    if not isinstance(data, dict):
+        raise KnowledgeBaseError("knowledge base must be a JSON object")
+    version = data.get("version")
+    if version in (None, ""):
+        raise KnowledgeBaseError("'version' is required")
+
+    conditions = []
+    for i, raw in enumerate(_require(data, "conditions", list)):
+        try:
+            keywords = [(str(phrase).lower(), float(weight)) for phrase, weight in raw["keywords"].items()]
+            if not raw["name"] or any(w <= 0 for _, w in keywords):
+                raise ValueError("needs a name and positive keyword weights")
+            conditions.append(Condition(
+                raw["name"],
+                [str(s).lower() for s in raw["species"]],
+                keywords,
+                [str(c) for c in raw["causes"]],
+                str(raw["recommendation"]),
+            ))
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            raise KnowledgeBaseError(f"condition #{i} ({raw.get('name') if isinstance(raw, dict) else raw!r}): {e}")
+
+    red_flags = [str(p).lower() for p in _require(data, "red_flag_phrases", list)]
+
+    profiles = {}
+    for name, raw in _require(data, "condition_profiles", dict).items():
+        try:
+            symptoms = [str(s) for s in raw["symptoms"]]
+            if not symptoms:
+                raise ValueError("needs at least one symptom")
+            profiles[name] = MappingProxyType({
+                "symptoms": tuple(symptoms),
+                "urgency": str(raw["urgency"]),
+                "causes": tuple(str(c) for c in raw["causes"]),
+                "recommendation": str(raw["recommendation"]),
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            raise KnowledgeBaseError(f"profile '{name}': {e}")
+    if len(profiles) < 2:
+        raise KnowledgeBaseError("'condition_profiles' needs at least two conditions")
+
+    return KnowledgeIndex(str(version), source, conditions, red_flags, profiles)
+
+
+def load_index(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise KnowledgeBaseError(f"cannot read {path}: {e}")
+    return compile_index(data, source=path)
+
+
+_PINNED = contextvars.ContextVar("knowledge_index", default=None)
+
+
+class KnowledgeBase:
+    """
+    Holds the live KnowledgeIndex and swaps in a new one when the source
+    file changes (checked at most every `check_interval` seconds, on access).
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._signature = self._stat()
+        self._index = load_index(path)
+        self._checked_at = time.monotonic()
+        self._reload_lock = threading.Lock()
+        self.stats = {"reloads": 0, "failed_reloads": 0}
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def current(self):
+        """The index pinned to this request, or else the live one."""
+        pinned = _PINNED.get()
+        if pinned is not None:
+            return pinned
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload_if_changed()
+        return self._index
+
+    def reload_if_changed(self):
+        # One thread compiles; the others keep serving the current index meanwhile.
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._checked_at = time.monotonic()
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                return False
+            self._signature = signature
+            try:
+                index = load_index(self.path)
+            except KnowledgeBaseError as e:
+                self.stats["failed_reloads"] += 1
+                logging.warning(f"Knowledge base reload failed, keeping version {self._index.version}: {e}")
+                return False
+            self._index = index
+            self.stats["reloads"] += 1
+            logging.info(f"Knowledge base version {index.version} loaded from {self.path}")
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def pin(self):
+        """Pin the current index for the rest of this context (e.g. a request); returns a reset token."""
+        return _PINNED.set(self.current())
+
+    def unpin(self, token):
+        try:
+            _PINNED.reset(token)
+        except ValueError:  # token from another context, e.g. a streamed response
+            _PINNED.set(None)
+
+
+KNOWLEDGE_BASE = KnowledgeBase(
+    os.environ.get("KNOWLEDGE_BASE_PATH") or DEFAULT_PATH,
+    check_interval=float(os.environ.get("KNOWLEDGE_BASE_CHECK_INTERVAL", 5)),
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate a condition knowledge base file.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    check_cmd = sub.add_parser("check", help="compile the file and print a summary")
+    check_cmd.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    try:
+        index = load_index(args.path)
+    except KnowledgeBaseError as e:
+        print(f"✗ {e}")
+        raise SystemExit(1)
+    print(
+        f"✓ version {index.version}: {len(index.conditions)} conditions, "
+        f"{len(index.matcher.entries) - len(index.red_flags)} keywords, "
+        f"{len(index.red_flags)} red flags, {len(index.profiles)} training profiles"
+    )
+
+
+if __name__ == "__main__":
+    main()
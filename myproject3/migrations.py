@@ -0,0 +1,275 @@
+"""
+Versioned schema migrations.
+
+db.create_all() only creates missing tables. Changes to tables that already
+exist (new columns, new indexes, backfills) are numbered migrations here.
+Each one runs in its own transaction together with its row in
+`schema_migrations`, DDL included (SQLite gets an explicit BEGIN), so a
+failure leaves the database at the previous version. Run them from a deploy step, not from the web workers:
+
+    python migrations.py status
+    python migrations.py upgrade [--to VERSION]
+
+Each migration spells out the tables, columns and indexes it touches as of
+its own version; never build them from the models, which keep changing.
+When create_all() builds the whole schema on an empty database, the app
+stamps every migration as applied (see stamp()). Migrations should still be
+safe to run on such a database: use the checkfirst / IF NOT EXISTS patterns
+below.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import (
+    JSON, Column, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text, bindparam, inspect, select, text,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import IntegrityError
+
+try:
+    from .models import as_text_list, normalize_name
+except ImportError:  # when run as a script
+    from models import as_text_list, normalize_name
+
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(200), nullable=False),
+    Column("applied_at", Float, nullable=False),  # unix timestamp
+)
+
+
+def _add_pet_profile_columns(conn):
+    """weight_kg and gender, previously added by ALTER TABLE at app import."""
+    columns = {col["name"] for col in inspect(conn).get_columns("pet_profile")}
+    if "weight_kg" not in columns:
+        conn.execute(text("ALTER TABLE pet_profile ADD COLUMN weight_kg FLOAT"))
+    if "gender" not in columns:
+        conn.execute(text("ALTER TABLE pet_profile ADD COLUMN gender VARCHAR(20)"))
+
+
+def _create_indexes(*statements):
+    def apply(conn):
+        for statement in statements:
+            conn.execute(text(statement))
+    return apply
+
+
+# image_analysis_cache as of migration 3
+_v3 = MetaData()
+_v3_image_analysis_cache = Table(
+    "image_analysis_cache",
+    _v3,
+    Column("id", Integer, primary_key=True),
+    Column("content_hash", String(64), nullable=False),
+    Column("context_key", String(64), nullable=False),
+    Column("analysis", Text, nullable=False),
+    Column("model_version", String(100)),
+    Column("created_at", Float, nullable=False),
+    Column("expires_at", Float, nullable=False),
+    Column("last_accessed_at", Float, nullable=False),
+    Column("hit_count", Integer, nullable=False),
+    Index("ix_image_analysis_cache_expires_at", "expires_at"),
+    Index("ix_image_analysis_cache_last_accessed_at", "last_accessed_at"),
+    Index("ux_image_analysis_cache_content", "content_hash", "context_key", unique=True),
+)
+
+
+def _move_image_cache_out_of_history(conn):
+    """
+    Image analyses used to be cached as extra HealthHistory rows tagged
+    "ImageHash:<md5>". Each one duplicated the upload's real history entry,
+    so they are deleted. New cache entries are keyed by sha256 and cannot
+    reuse the old rows.
+    """
+    _v3_image_analysis_cache.create(conn, checkfirst=True)
+    removed = conn.execute(text("DELETE FROM health_history WHERE symptoms LIKE '%ImageHash:%'")).rowcount
+    logging.info(f"Removed {removed} image-cache rows from health_history")
+
+
+# health_history findings and health_history_diagnosis as of migration 4
+_v4 = MetaData()
+_v4_history_text = Table(
+    "health_history",
+    _v4,
+    Column("id", Integer, primary_key=True),
+    Column("pet_id", Integer),
+    Column("diagnosis", Text),
+    Column("possible_causes", Text),
+)
+_v4_history_json = Table(
+    "health_history",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("diagnosis", JSON().with_variant(JSONB(), "postgresql")),
+    Column("possible_causes", JSON().with_variant(JSONB(), "postgresql")),
+)
+_v4_health_history_diagnosis = Table(
+    "health_history_diagnosis",
+    _v4,
+    Column("history_id", Integer, ForeignKey("health_history.id", ondelete="CASCADE"), primary_key=True),
+    Column("name_key", String(200), primary_key=True),
+    Column("pet_id", Integer, nullable=False),
+    Index("ix_health_history_diagnosis_name_key_pet_id", "name_key", "pet_id"),
+)
+
+
+def _legacy_text_list(raw):
+    """A stored diagnosis / possible_causes value: a JSON list, or comma-separated text in old rows."""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except json.JSONDecodeError:
+            raw = raw.split(",")
+    return as_text_list(raw)
+
+
+def _health_history_findings_to_json(conn, batch_size=500):
+    """
+    diagnosis and possible_causes were Text holding JSON, or comma-separated
+    text in older rows. Rewrite every row as a JSON list, convert the columns
+    to JSONB on Postgres (SQLite stores JSON as text already), and rebuild
+    health_history_diagnosis.
+    """
+    index = _v4_health_history_diagnosis
+    index.create(conn, checkfirst=True)
+    columns = {col["name"]: col["type"] for col in inspect(conn).get_columns("health_history")}
+    already_json = isinstance(columns["diagnosis"], JSON)
+
+    # Read through plain Text so legacy values that are not JSON do not fail to decode.
+    raw = _v4_history_text
+    # Write JSON-typed values if the column already is JSON, JSON text into Text otherwise.
+    target = _v4_history_json if already_json else raw
+    encode = (lambda values: values) if already_json else json.dumps
+    write = target.update().where(target.c.id == bindparam("_id")).values(
+        diagnosis=bindparam("_diagnosis"), possible_causes=bindparam("_possible_causes"),
+    )
+
+    conn.execute(index.delete())
+    last_id, rows_done = 0, 0
+    while True:
+        rows = conn.execute(
+            select(raw.c.id, raw.c.pet_id, raw.c.diagnosis, raw.c.possible_causes)
+            .where(raw.c.id > last_id).order_by(raw.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        updates, index_rows = [], []
+        for row in rows:
+            diagnosis = _legacy_text_list(row.diagnosis)
+            updates.append({
+                "_id": row.id,
+                "_diagnosis": encode(diagnosis),
+                "_possible_causes": encode(_legacy_text_list(row.possible_causes)),
+            })
+            keys = dict.fromkeys(normalize_name(d)[:200] for d in diagnosis)
+            index_rows.extend({"history_id": row.id, "name_key": key, "pet_id": row.pet_id} for key in keys if key)
+        conn.execute(write, updates)
+        if index_rows:
+            conn.execute(index.insert(), index_rows)
+        last_id, rows_done = rows[-1].id, rows_done + len(rows)
+
+    if conn.dialect.name == "postgresql" and not already_json:
+        for column in ("diagnosis", "possible_causes"):
+            conn.execute(text(f"ALTER TABLE health_history ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb"))
+    logging.info(f"Rewrote diagnosis and possible_causes of {rows_done} health_history rows as JSON")
+
+
+# (version, name, apply(connection)); append only, never renumber.
+MIGRATIONS = [
+    (1, "pet_profile weight_kg and gender columns", _add_pet_profile_columns),
+    (2, "indexes for per-pet history, reminders, consultations and per-user pets", _create_indexes(
+        "CREATE INDEX IF NOT EXISTS ix_health_history_pet_id_date ON health_history (pet_id, date)",
+        "CREATE INDEX IF NOT EXISTS ix_reminder_pet_id_due_date_completed ON reminder (pet_id, due_date, completed)",
+        "CREATE INDEX IF NOT EXISTS ix_pet_profile_user_id ON pet_profile (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_consultation_pet_id_date ON consultation (pet_id, date)",
+    )),
+    (3, "image_analysis_cache table; drop ImageHash rows from health_history", _move_image_cache_out_of_history),
+    (4, "health_history diagnosis and possible_causes as JSON; health_history_diagnosis index", _health_history_findings_to_json),
+]
+
+
+def applied_versions(engine):
+    if not inspect(engine).has_table(schema_migrations.name):
+        return set()
+    with engine.connect() as conn:
+        return {row.version for row in conn.execute(select(schema_migrations.c.version))}
+
+
+def pending(engine):
+    done = applied_versions(engine)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def stamp(engine):
+    """
+    Record every migration as applied without running it, for a database
+    whose whole schema create_all() has just built from the current models.
+    """
+    schema_migrations.create(engine, checkfirst=True)
+    missing = pending(engine)
+    if not missing:
+        return []
+    try:
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.insert(), [
+                {"version": version, "name": name, "applied_at": time.time()} for version, name, _ in missing
+            ])
+    except IntegrityError:
+        return []  # another process stamped it first
+    return [version for version, _, _ in missing]
+
+
+def upgrade(engine, to_version=None):
+    """Apply pending migrations in order; returns the versions applied."""
+    schema_migrations.create(engine, checkfirst=True)
+    applied = []
+    for version, name, apply in pending(engine):
+        if to_version is not None and version > to_version:
+            break
+        started = time.monotonic()
+        with engine.begin() as conn:
+            if conn.dialect.name == "sqlite":
+                # pysqlite only opens a transaction before DML, so DDL would autocommit
+                conn.exec_driver_sql("BEGIN")
+            apply(conn)
+            conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=time.time()))
+        logging.info(f"Applied migration {version} ({name}) in {time.monotonic() - started:.2f}s")
+        applied.append(version)
+    return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply or inspect database schema migrations.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="list applied and pending migrations")
+    upgrade_cmd = sub.add_parser("upgrade", help="apply pending migrations")
+    upgrade_cmd.add_argument("--to", type=int, default=None, help="stop after this version")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("SYMPTOM_RF_TRAIN_FALLBACK", "off")  # importing app must not start RF training here
+    from app import app
+    from models import db
+
+    with app.app_context():
+        if args.command == "status":
+            done = applied_versions(db.engine)
+            for version, name, _ in MIGRATIONS:
+                print(f"{'✓' if version in done else '·'} {version:04d} {name}")
+            return
+        try:
+            applied = upgrade(db.engine, args.to)
+        except Exception as e:
+            print(f"✗ migration failed: {e}")
+            raise SystemExit(1)
+        print(f"✓ applied {applied}" if applied else "✓ already up to date")
+
+
+if __name__ == "__main__":
+    main()
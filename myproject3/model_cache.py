@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "instance", "gemini_model_cache.json")
+
+
+class ModelCache:
+    """
+    Resolved Gemini model plus the discovered model list, shared between
+    workers through a small JSON file. Entries carry their age and source
+    ("disk", "discovery", "default" or "runtime") and the models that failed
+    recently, so a fresh worker can start with a known-good model without
+    calling client.models.list() inside a request.
+    """
+
+    def __init__(self, path=None, ttl=6 * 3600, failure_ttl=300, retry_interval=60):
+        self.path = path or DEFAULT_CACHE_PATH
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.retry_interval = retry_interval
+
+        self.model = None
+        self.available = []
+        self.preferred = []
+        self.source = None
+        self.updated_at = 0.0
+
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._last_refresh_attempt = 0.0
+
+    @property
+    def age(self):
+        if not self.updated_at:
+            return None
+        return max(0.0, time.time() - self.updated_at)
+
+    def is_stale(self):
+        age = self.age
+        return age is None or age > self.ttl
+
+    def load(self, preferred=None):
+        """Adopt the on-disk entry if it exists and matches the preferred list."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logging.warning(f"Gemini model cache unreadable at {self.path}: {e}")
+            return False
+
+        if preferred is not None and data.get("preferred") != list(preferred):
+            # GEMINI_MODEL changed since the entry was written; rediscover.
+            return False
+        if not data.get("model"):
+            return False
+
+        now = time.time()
+        with self._lock:
+            if self.source != "default" and data.get("updated_at", 0.0) < self.updated_at:
+                return False
+            self.model = data["model"]
+            self.available = list(data.get("available") or [])
+            self.preferred = list(data.get("preferred") or [])
+            self.updated_at = float(data.get("updated_at") or 0.0)
+            self.source = "disk"
+            for name, failed_at in (data.get("failures") or {}).items():
+                if now - failed_at < self.failure_ttl:
+                    self._failures[name] = max(failed_at, self._failures.get(name, 0.0))
+        return True
+
+    def save(self):
+        with self._lock:
+            data = {
+                "model": self.model,
+                "available": self.available,
+                "preferred": self.preferred,
+                "updated_at": self.updated_at,
+                "failures": dict(self._failures),
+            }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.warning(f"Could not persist Gemini model cache to {self.path}: {e}")
+
+    def update(self, model, available=None, preferred=None, source="discovery", persist=True):
+        with self._lock:
+            self.model = model
+            if available is not None:
+                self.available = list(available)
+            if preferred is not None:
+                self.preferred = list(preferred)
+            self.source = source
+            self.updated_at = time.time()
+        if persist:
+            self.save()
+
+    def promote(self, model):
+        """Record that `model` just answered; persist only when the choice changed."""
+        self._failures.pop(model, None)
+        if model != self.model:
+            self.update(model, source="runtime")
+
+    def mark_failed(self, model):
+        self._failures[model] = time.time()
+
+    def recently_failed(self, model):
+        failed_at = self._failures.get(model)
+        if failed_at is None:
+            return False
+        if time.time() - failed_at >= self.failure_ttl:
+            self._failures.pop(model, None)
+            return False
+        return True
+
+    def failed_models(self):
+        return [name for name in list(self._failures) if self.recently_failed(name)]
+
+    def refresh_async(self, refresher):
+        """Run `refresher` on a daemon thread unless one is running or ran recently."""
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return False
+            now = time.time()
+            if now - self._last_refresh_attempt < self.retry_interval:
+                return False
+            self._last_refresh_attempt = now
+            self._refresh_thread = threading.Thread(
+                target=self._run_refresh, args=(refresher,), name="gemini-model-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+        return True
+
+    def _run_refresh(self, refresher):
+        try:
+            refresher()
+        except Exception as e:
+            logging.warning(f"Gemini model cache refresh failed: {e}")
+
+    def snapshot(self):
+        return {
+            "model": self.model,
+            "source": self.source,
+            "age_seconds": None if self.age is None else round(self.age, 1),
+            "stale": self.is_stale(),
+            "available": list(self.available),
+            "recently_failed": self.failed_models(),
+        }
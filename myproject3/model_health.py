@@ -0,0 +1,203 @@
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+
+class LatencyStats:
+    """Rolling window of successful call latencies (seconds) per model."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def record(self, model, seconds):
+        with self._lock:
+            self._samples[model].append(seconds)
+
+    def percentile(self, model, pct):
+        """Nearest-rank percentile, or None until `min_samples` have been seen."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+        return samples[rank - 1]
+
+    def summary(self):
+        with self._lock:
+            models = list(self._samples)
+        out = {}
+        for model in models:
+            out[model] = {
+                "samples": len(self._samples[model]),
+                "p50": self.percentile(model, 50),
+                "p95": self.percentile(model, 95),
+            }
+        return out
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Closed -> open when the error rate or slow-call rate over the last
+    `window` calls crosses its threshold. After `open_seconds` the breaker
+    goes half-open and lets `half_open_probes` calls through; one success
+    closes it again, one failure re-opens it.
+    """
+
+    def __init__(
+        self,
+        window=20,
+        min_calls=5,
+        error_rate=0.5,
+        slow_call_seconds=20.0,
+        slow_rate=0.8,
+        open_seconds=30.0,
+        half_open_probes=1,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._outcomes = deque(maxlen=window)  # (failed, slow)
+        self._lock = threading.Lock()
+        self.totals = {"successes": 0, "failures": 0, "rejected": 0, "trips": 0}
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def acquire(self):
+        """Reserve a call slot; False means the caller must skip this model."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self.totals["rejected"] += 1
+            return False
+
+    def release(self):
+        """Give back a slot that was acquired but never used."""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self, seconds):
+        with self._lock:
+            self.totals["successes"] += 1
+            slow = self.slow_call_seconds is not None and seconds > self.slow_call_seconds
+            if self._state == HALF_OPEN:
+                if slow:
+                    self._trip()
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append((False, slow))
+            self._evaluate()
+
+    def record_failure(self):
+        with self._lock:
+            self.totals["failures"] += 1
+            if self._state == HALF_OPEN:
+                self._trip()
+                return
+            self._outcomes.append((True, False))
+            self._evaluate()
+
+    def _evaluate(self):
+        calls = len(self._outcomes)
+        if self._state != CLOSED or calls < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._outcomes if failed)
+        slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+        if failures / calls >= self.error_rate or slow / calls >= self.slow_rate:
+            self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+        self._outcomes.clear()
+        self.totals["trips"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            failures = sum(1 for failed, _ in self._outcomes if failed)
+            retry_in = None
+            if state == OPEN:
+                retry_in = round(max(0.0, self.open_seconds - (time.monotonic() - self._opened_at)), 1)
+            return {
+                "state": state,
+                "window_calls": calls,
+                "window_error_rate": round(failures / calls, 3) if calls else 0.0,
+                "retry_in_seconds": retry_in,
+                **self.totals,
+            }
+
+
+class HealthBoard:
+    """One CircuitBreaker per model name, created on first use."""
+
+    def __init__(self, **breaker_options):
+        self.breaker_options = breaker_options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model):
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                breaker = self._breakers[model] = CircuitBreaker(**self.breaker_options)
+            return breaker
+
+    def state(self, model):
+        with self._lock:
+            breaker = self._breakers.get(model)
+        return breaker.state if breaker is not None else CLOSED
+
+    def is_open(self, model):
+        return self.state(model) == OPEN
+
+    def acquire(self, model):
+        return self.breaker(model).acquire()
+
+    def release(self, model):
+        self.breaker(model).release()
+
+    def record_success(self, model, seconds):
+        self.breaker(model).record_success(seconds)
+
+    def record_failure(self, model):
+        self.breaker(model).record_failure()
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._breakers.items())
+        return {model: breaker.snapshot() for model, breaker in items}
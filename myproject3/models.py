@@ -1,10 +1,54 @@
 
+import json
+import re
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+
+def normalize_name(name):
+    """Lowercase, strip punctuation and sort tokens so word order does not matter."""
+    tokens = re.sub(r"[^a-z0-9\s]", " ", (name or "").lower()).split()
+    return " ".join(sorted(dict.fromkeys(tokens)))
+
+
+def as_text_list(value):
+    """Normalize a diagnosis / possible_causes value to a list of non-empty strings; a string is one item."""
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)):
+        value = [value]
+    return [str(v).strip() for v in value if v is not None and str(v).strip()]
+
+
+class JSONList(TypeDecorator):
+    """
+    List of strings as JSON: JSON text on SQLite (queryable with JSON1), JSONB
+    on Postgres. Reads decode the raw value themselves so rows migration 4
+    has not rewritten yet (plain text, not JSON) come back as one item
+    instead of failing.
+    """
+    impl = db.JSON
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(JSONB() if dialect.name == 'postgresql' else db.JSON())
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except json.JSONDecodeError:
+                    pass  # legacy text
+            return as_text_list(value)
+        return process
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(100), nullable=False)
@@ -38,6 +82,9 @@ class PetProfile(db.Model):
     reminders = db.relationship('Reminder', backref='pet', lazy=True, cascade='all, delete-orphan')
     consultations = db.relationship('Consultation', back_populates='pet', lazy=True, cascade='all, delete-orphan')
 
+    # Indexes are added to existing databases by migrations.py; keep the names in sync.
+    __table_args__ = (db.Index('ix_pet_profile_user_id', 'user_id'),)
+
   
 class Consultation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -50,6 +97,8 @@ class Consultation(db.Model):
     pet = db.relationship('PetProfile', back_populates='consultations')
     user = db.relationship('User', backref='consultations')
 
+    __table_args__ = (db.Index('ix_consultation_pet_id_date', 'pet_id', 'date'),)
+
 
 
 class HealthHistory(db.Model):
@@ -57,10 +106,82 @@ class HealthHistory(db.Model):
     pet_id = db.Column(db.Integer, db.ForeignKey('pet_profile.id'), nullable=False)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     symptoms = db.Column(db.Text, nullable=False)
-    diagnosis = db.Column(db.Text)
+    diagnosis = db.Column(JSONList)  # list of strings, always written through set_findings()
     recommendation = db.Column(db.Text)
     urgency_level = db.Column(db.String(50))  # e.g., Low, Medium, High
-    possible_causes = db.Column(db.Text) 
+    possible_causes = db.Column(JSONList)  # list of strings
+
+    diagnosis_index = db.relationship('HealthHistoryDiagnosis', lazy=True, cascade='all, delete-orphan')
+
+    __table_args__ = (db.Index('ix_health_history_pet_id_date', 'pet_id', 'date'),)
+
+    def set_findings(self, diagnosis, possible_causes):
+        """Store both lists and keep diagnosis_index in step. Set pet_id first."""
+        self.diagnosis = as_text_list(diagnosis)
+        self.possible_causes = as_text_list(possible_causes)
+        keys = dict.fromkeys(normalize_name(d)[:200] for d in self.diagnosis)
+        self.diagnosis_index = [HealthHistoryDiagnosis(pet_id=self.pet_id, name_key=key) for key in keys if key]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'pet_id': self.pet_id,
+            'date': self.date.isoformat(),
+            'symptoms': self.symptoms,
+            'diagnosis': self.diagnosis or [],
+            'recommendation': self.recommendation,
+            'urgency_level': self.urgency_level,
+            'possible_causes': self.possible_causes or [],
+        }
+
+
+class HealthHistoryDiagnosis(db.Model):
+    """One row per distinct diagnosis of a HealthHistory entry, so "which pets had X" is an index lookup."""
+    __tablename__ = 'health_history_diagnosis'
+    history_id = db.Column(db.Integer, db.ForeignKey('health_history.id', ondelete='CASCADE'), primary_key=True)
+    name_key = db.Column(db.String(200), primary_key=True)  # normalize_name()
+    pet_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.Index('ix_health_history_diagnosis_name_key_pet_id', 'name_key', 'pet_id'),)
+
+
+class AIResponseCache(db.Model):
+    __tablename__ = 'ai_response_cache'
+    cache_key = db.Column(db.String(64), primary_key=True)  # sha256 prompt fingerprint
+    namespace = db.Column(db.String(50), nullable=False, default='')
+    payload = db.Column(db.Text, nullable=False)  # JSON response
+    created_at = db.Column(db.Float, nullable=False)  # unix timestamps
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+    last_accessed_at = db.Column(db.Float, nullable=False, index=True)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ImageAnalysisCache(db.Model):
+    __tablename__ = 'image_analysis_cache'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)  # sha256 of the uploaded bytes
+    context_key = db.Column(db.String(64), nullable=False)  # gemini.image_cache_context()
+    analysis = db.Column(db.Text, nullable=False)  # full JSON analysis
+    model_version = db.Column(db.String(100))
+    created_at = db.Column(db.Float, nullable=False)  # unix timestamps
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+    last_accessed_at = db.Column(db.Float, nullable=False, index=True)
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index('ux_image_analysis_cache_content', 'content_hash', 'context_key', unique=True),)
+
+
+class DiagnosisExplanation(db.Model):
+    __tablename__ = 'diagnosis_explanation'
+    id = db.Column(db.Integer, primary_key=True)
+    name_key = db.Column(db.String(200), nullable=False)  # normalized diagnosis name
+    catalog_version = db.Column(db.String(50), nullable=False)
+    display_name = db.Column(db.String(200), nullable=False)
+    explanation = db.Column(db.Text, nullable=False)  # JSON: description, causes, symptoms
+    source = db.Column(db.String(20), nullable=False)  # "build" or "runtime"
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('name_key', 'catalog_version'),)
 
 
 class Reminder(db.Model):
@@ -72,6 +193,8 @@ class Reminder(db.Model):
     completed_date = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_reminder_pet_id_due_date_completed', 'pet_id', 'due_date', 'completed'),)
+
 
 # Hardcoded Veterinary Clinics Data
 VETERINARY_CLINICS = [
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, func, select, update
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())).strip()
+
+
+def fingerprint(**parts):
+    """Stable SHA-256 key for a canonicalized prompt description."""
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL. Values are stored as JSON text."""
+
+    def __init__(self, maxsize=512, ttl=24 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expires_at, payload = entry
+            if expires_at <= time.time():
+                del self._data[key]
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return payload
+
+    def put(self, key, payload, ttl=None, expires_at=None):
+        """Store for `ttl` seconds (default self.ttl), but never past `expires_at` if given."""
+        deadline = time.time() + (ttl or self.ttl)
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._data[key] = (deadline, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqlResponseStore:
+    """
+    Shared cache tier on the app database (SQLite or Postgres) through a
+    SQLAlchemy engine and the `ai_response_cache` table from models.py.
+    Every call runs in its own short transaction so it never touches the
+    request's db.session.
+    """
+
+    def __init__(self, engine, table, max_rows=10000, trim_every=50):
+        self.engine = engine
+        self.table = table
+        self.max_rows = max_rows
+        self.trim_every = trim_every
+        self._puts = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key):
+        """(payload, expires_at) for a live row, else None."""
+        t = self.table
+        now = time.time()
+        try:
+            with self.engine.begin() as conn:
+                row = conn.execute(
+                    select(t.c.payload, t.c.expires_at).where(t.c.cache_key == key)
+                ).first()
+                if row is None or row.expires_at <= now:
+                    self.stats["misses"] += 1
+                    return None
+                conn.execute(
+                    update(t)
+                    .where(t.c.cache_key == key)
+                    .values(hit_count=t.c.hit_count + 1, last_accessed_at=now)
+                )
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Response cache read failed: {e}")
+            return None
+        self.stats["hits"] += 1
+        return row.payload, row.expires_at
+
+    def put(self, key, payload, ttl, namespace=""):
+        t = self.table
+        now = time.time()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(t).where(t.c.cache_key == key))
+                conn.execute(
+                    t.insert().values(
+                        cache_key=key,
+                        namespace=namespace,
+                        payload=payload,
+                        created_at=now,
+                        expires_at=now + ttl,
+                        last_accessed_at=now,
+                        hit_count=0,
+                    )
+                )
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Response cache write failed: {e}")
+            return
+        self._puts += 1
+        if self._puts % self.trim_every == 0:
+            self.trim()
+
+    def trim(self):
+        """Drop expired rows, then the least recently used rows above max_rows."""
+        try:
+            with self.engine.begin() as conn:
+                self.stats["evictions"] += _trim(conn, self.table, self.table.c.cache_key, self.max_rows)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Response cache trim failed: {e}")
+
+
+def _trim(conn, t, key_column, max_rows):
+    """Delete expired rows, then least recently used rows above max_rows; returns the number removed."""
+    expired = conn.execute(delete(t).where(t.c.expires_at <= time.time())).rowcount or 0
+    excess = conn.execute(select(func.count()).select_from(t)).scalar() - max_rows
+    if excess > 0:
+        oldest = select(key_column).order_by(t.c.last_accessed_at.asc()).limit(excess).scalar_subquery()
+        conn.execute(delete(t).where(key_column.in_(oldest)))
+    return expired + max(0, excess)
+
+
+class ImageAnalysisStore:
+    """
+    Image analyses in the `image_analysis_cache` table, one row per
+    (content hash, context key), with a TTL and LRU trimming to max_rows.
+    Like SqlResponseStore, every call is its own short transaction and
+    failures only cost a cache miss.
+    """
+
+    def __init__(self, engine, table, ttl=30 * 24 * 3600, max_rows=20000, trim_every=50):
+        self.engine = engine
+        self.table = table
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.trim_every = trim_every
+        self._puts = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0}
+
+    def get(self, content_hash, context_key):
+        t = self.table
+        match = (t.c.content_hash == content_hash) & (t.c.context_key == context_key)
+        now = time.time()
+        try:
+            with self.engine.begin() as conn:
+                row = conn.execute(select(t.c.analysis, t.c.expires_at).where(match)).first()
+                if row is None or row.expires_at <= now:
+                    self.stats["misses"] += 1
+                    return None
+                conn.execute(update(t).where(match).values(hit_count=t.c.hit_count + 1, last_accessed_at=now))
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Image analysis cache read failed: {e}")
+            return None
+        self.stats["hits"] += 1
+        return json.loads(row.analysis)
+
+    def put(self, content_hash, context_key, analysis, model_version=None):
+        t = self.table
+        now = time.time()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(t).where((t.c.content_hash == content_hash) & (t.c.context_key == context_key)))
+                conn.execute(
+                    t.insert().values(
+                        content_hash=content_hash,
+                        context_key=context_key,
+                        analysis=json.dumps(analysis),
+                        model_version=model_version,
+                        created_at=now,
+                        expires_at=now + self.ttl,
+                        last_accessed_at=now,
+                        hit_count=0,
+                    )
+                )
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Image analysis cache write failed: {e}")
+            return
+        self._puts += 1
+        if self._puts % self.trim_every == 0:
+            self.trim()
+
+    def trim(self):
+        try:
+            with self.engine.begin() as conn:
+                self.stats["evictions"] += _trim(conn, self.table, self.table.c.id, self.max_rows)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Image analysis cache trim failed: {e}")
+
+    def snapshot(self):
+        return {"ttl_seconds": self.ttl, "max_rows": self.max_rows, **self.stats}
+
+
+class TieredCache:
+    """In-process LRU in front of an optional shared store."""
+
+    def __init__(self, namespace, maxsize=512, ttl=24 * 3600, store=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.store = store
+
+    def get(self, key):
+        payload = self.local.get(key)
+        if payload is None and self.store is not None:
+            entry = self.store.get_entry(key)
+            if entry is not None:
+                # keep the shared row's remaining lifetime, not a fresh full TTL
+                payload, expires_at = entry
+                self.local.put(key, payload, expires_at=expires_at)
+        return None if payload is None else json.loads(payload)
+
+    def put(self, key, value):
+        payload = json.dumps(value)
+        self.local.put(key, payload)
+        if self.store is not None:
+            self.store.put(key, payload, self.ttl, namespace=self.namespace)
+
+    def stats(self):
+        return {
+            "namespace": self.namespace,
+            "ttl_seconds": self.ttl,
+            "local_size": len(self.local),
+            "local": dict(self.local.stats),
+            "shared": dict(self.store.stats) if self.store is not None else None,
+        }
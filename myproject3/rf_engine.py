@@ -0,0 +1,135 @@
+"""
+Array-backed inference for fitted scikit-learn RandomForestClassifiers.
+
+export_forest flattens every tree into shared contiguous arrays (split
+feature, threshold, children, leaf class probabilities). FlatForest walks
+all trees of the forest at once with NumPy and sums the leaf probabilities
+in estimator order, which reproduces predict_proba bit for bit. It needs
+no scikit-learn object graph at inference time, and its arrays can be
+memory-mapped and shared between workers.
+"""
+import numpy as np
+
+try:
+    from scipy import sparse
+except Exception:  # pragma: no cover
+    sparse = None
+
+
+_LEAF = -1  # scikit-learn's TREE_LEAF
+
+
+def export_forest(forest):
+    """Flatten a fitted RandomForestClassifier into a dict of NumPy arrays."""
+    n_classes = len(forest.classes_)
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == _LEAF
+        own = np.arange(tree.node_count, dtype=np.int32) + offset
+        # Leaves point at themselves, so every sample can take max_depth steps without masking.
+        lefts.append(np.where(is_leaf, own, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, own, tree.children_right + offset).astype(np.int32))
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+        values.append(np.ascontiguousarray(tree.value[:, 0, :n_classes], dtype=np.float64))
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+    return {
+        "feature": np.concatenate(features),
+        "threshold": np.concatenate(thresholds),
+        "left": np.concatenate(lefts),
+        "right": np.concatenate(rights),
+        "value": np.concatenate(values),
+        "roots": np.asarray(roots, dtype=np.int32),
+        "max_depth": np.int32(max_depth),
+        "classes": np.asarray(forest.classes_),
+        "n_features": np.int32(forest.n_features_in_),
+    }
+
+
+class FlatForest:
+    def __init__(self, arrays):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(arrays["max_depth"])
+        self.classes_ = arrays["classes"]
+        self.n_features = int(arrays["n_features"])
+        # children[node + n_nodes * went_left] is the next node, one gather per step.
+        self._children = np.concatenate([self.right, self.left])
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        return cls(export_forest(forest))
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right, self.value, self.roots))
+
+    def _dense(self, X):
+        # scikit-learn compares float32 feature values against float64 thresholds.
+        if sparse is not None and sparse.issparse(X):
+            X = X.toarray()
+        return np.asarray(X, dtype=np.float32).reshape(-1, self.n_features)
+
+    def leaves(self, X):
+        """(n_samples, n_trees) leaf node indexes."""
+        X = self._dense(X)
+        n_nodes = len(self.feature)
+        if X.shape[0] == 1:
+            # One sample: evaluate every split once up front, then each step is a single gather.
+            step_offset = (X[0, self.feature] <= self.threshold) * n_nodes
+            nodes = self.roots.astype(np.intp)
+            for _ in range(self.max_depth):
+                nodes = self._children[nodes + step_offset[nodes]]
+            return nodes[None, :]
+
+        flat_x = X.ravel()
+        row_base = (np.arange(X.shape[0], dtype=np.intp) * self.n_features)[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).astype(np.intp)
+        for step in range(self.max_depth):
+            went_left = flat_x[row_base + self.feature[nodes]] <= self.threshold[nodes]
+            next_nodes = self._children[nodes + went_left * n_nodes]
+            if step % 4 == 3 and np.array_equal(next_nodes, nodes):
+                break  # every sample has reached a leaf in every tree
+            nodes = next_nodes
+        return nodes
+
+    def predict_proba(self, X):
+        leaf_values = self.value[self.leaves(X)]  # (n_samples, n_trees, n_classes)
+        # Reducing over the tree axis adds trees one after another, the same
+        # order as RandomForestClassifier.predict_proba with n_jobs=1.
+        proba = leaf_values.sum(axis=1)
+        proba /= leaf_values.shape[1]
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+
+def check_parity(forest, engine, X):
+    """
+    Compare engine and forest on X. Returns the number of rows whose
+    probabilities are not bit-identical or whose predicted class differs.
+    The forest is evaluated single-threaded: with n_jobs > 1 scikit-learn
+    sums tree outputs in completion order, so its own output can differ in
+    the last bit from run to run.
+    """
+    n_jobs = forest.n_jobs
+    forest.n_jobs = 1
+    try:
+        expected = forest.predict_proba(X)
+        expected_classes = forest.predict(X)
+    finally:
+        forest.n_jobs = n_jobs
+    got = engine.predict_proba(X)
+    same_proba = (expected.view(np.uint64) == got.view(np.uint64)).all(axis=1)
+    same_class = expected_classes == engine.predict(X)
+    return int(np.count_nonzero(~(same_proba & same_class)))
@@ -0,0 +1,276 @@
+"""
+RandomForest inference sidecar.
+
+Instead of every web worker running the forests itself, one inference
+process owns the model and answers over a Unix socket. Requests that arrive
+within SYMPTOM_RF_BATCH_WINDOW_MS of each other (up to
+SYMPTOM_RF_MAX_BATCH) are scored in one vectorized predict call by a single
+dispatcher thread, so inference never uses more than one core however many
+workers are busy.
+
+    python rf_inference.py serve [--socket PATH]
+    python rf_inference.py stats [--socket PATH]
+
+Web workers use it when SYMPTOM_RF_SOCKET is set; otherwise the model runs
+in-process as before. Protocol: one JSON object per line each way.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+try:
+    from . import deadlines
+except ImportError:  # when run as a script
+    import deadlines
+
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "symptom_rf.sock")
+
+
+class _Pending:
+    __slots__ = ("item", "done", "result", "error", "abandoned")
+
+    def __init__(self, item):
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads and hands them to
+    `predict_many(items) -> results` in batches, from one dispatcher thread.
+    A batch closes `window` seconds after its first item or at `max_batch`.
+    """
+
+    def __init__(self, predict_many, window=0.002, max_batch=64):
+        self.predict_many = predict_many
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"batches": 0, "items": 0, "largest_batch": 0, "abandoned": 0, "errors": 0}
+
+    def submit(self, item, timeout=None):
+        """Result for `item`; raises TimeoutError after `timeout` seconds, or predict_many's exception."""
+        self._ensure_started()
+        pending = _Pending(item)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            pending.abandoned = True
+            raise TimeoutError(f"RandomForest inference timed out after {timeout:.3f}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="symptom-rf-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        closes_at = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            wait = closes_at - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            live = [p for p in batch if not p.abandoned]
+            self.stats["abandoned"] += len(batch) - len(live)
+            if not live:
+                continue
+            try:
+                results = self.predict_many([p.item for p in live])
+            except Exception as e:
+                self.stats["errors"] += 1
+                for p in live:
+                    p.error = e
+                    p.done.set()
+                continue
+            self.stats["batches"] += 1
+            self.stats["items"] += len(live)
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(live))
+            for p, result in zip(live, results):
+                if isinstance(result, Exception):
+                    p.error = result
+                else:
+                    p.result = result
+                p.done.set()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("op") == "stats":
+                    response = {"stats": self.server.batcher.stats}
+                else:
+                    diagnosis, urgency, confidence = self.server.batcher.submit(
+                        (request["kb"], request["text"]), timeout=self.server.request_timeout,
+                    )
+                    response = {"diagnosis": diagnosis, "urgency": urgency, "confidence": confidence}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256  # every web worker thread may connect at once
+
+    def __init__(self, path, batcher, request_timeout=5.0):
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a previous run
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.batcher = batcher
+        self.request_timeout = request_timeout
+        super().__init__(path, _Handler)
+
+
+class InferenceClient:
+    """Per-thread persistent connection to the sidecar."""
+
+    def __init__(self, path, timeout=2.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._down = False
+
+    @classmethod
+    def from_env(cls):
+        path = os.environ.get("SYMPTOM_RF_SOCKET")
+        if not path:
+            return None
+        return cls(path, timeout=float(os.environ.get("SYMPTOM_RF_CLIENT_TIMEOUT", 2.0)))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+        return conn
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def call(self, request):
+        remaining = deadlines.remaining()
+        timeout = self.timeout if remaining is None else min(self.timeout, remaining)
+        if timeout <= 0:
+            raise deadlines.DeadlineExceeded("No time left for RandomForest inference")
+        try:
+            sock, reader = self._connection()
+            sock.settimeout(timeout)
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            line = reader.readline()
+            if not line:
+                raise ConnectionError("sidecar closed the connection")
+        except OSError as e:
+            # A timed-out connection may still deliver the late answer; never reuse it.
+            self._close()
+            if not self._down:
+                self._down = True
+                logging.warning(f"RandomForest sidecar {self.path} unavailable: {e}")
+            raise
+        if self._down:
+            self._down = False
+            logging.info(f"RandomForest sidecar {self.path} reachable again")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"RandomForest sidecar: {response['error']}")
+        return response
+
+    def predict(self, text, kb_version):
+        """(diagnosis, urgency, confidence) for one cleaned input text."""
+        response = self.call({"kb": kb_version, "text": text})
+        return response["diagnosis"], response["urgency"], response["confidence"]
+
+
+def serve(path, window, max_batch):
+    try:
+        from .knowledge_base import KNOWLEDGE_BASE
+        from .symptom_rf_model import load_model, predict_texts
+    except ImportError:  # when run as a script
+        from knowledge_base import KNOWLEDGE_BASE
+        from symptom_rf_model import load_model, predict_texts
+
+    def predict_many(items):
+        index = KNOWLEDGE_BASE.current()
+        results = [None] * len(items)
+        wanted = [i for i, (kb, _) in enumerate(items) if kb == index.version]
+        for i, (kb, _) in enumerate(items):
+            if kb != index.version:
+                results[i] = RuntimeError(f"knowledge base {kb} requested, sidecar serves {index.version}")
+        if wanted:
+            for i, prediction in zip(wanted, predict_texts([items[i][1] for i in wanted], index)):
+                results[i] = prediction
+        return results
+
+    if load_model() is None:
+        logging.warning("RandomForest model not ready yet; requests fail until it is")
+    server = InferenceServer(path, MicroBatcher(predict_many, window=window, max_batch=max_batch))
+    print(f"✓ RandomForest sidecar listening on {path} (window {window * 1000:g} ms, max batch {max_batch})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run or query the RandomForest inference sidecar.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_cmd = sub.add_parser("serve", help="load the model and answer web workers")
+    serve_cmd.add_argument("--window-ms", type=float, default=float(os.environ.get("SYMPTOM_RF_BATCH_WINDOW_MS", 2)))
+    serve_cmd.add_argument("--max-batch", type=int, default=int(os.environ.get("SYMPTOM_RF_MAX_BATCH", 64)))
+    stats_cmd = sub.add_parser("stats", help="print the running sidecar's batching counters")
+    for cmd in (serve_cmd, stats_cmd):
+        cmd.add_argument("--socket", default=os.environ.get("SYMPTOM_RF_SOCKET") or DEFAULT_SOCKET_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        logging.basicConfig(level=logging.INFO)
+        serve(args.socket, args.window_ms / 1000.0, args.max_batch)
+        return
+
+    try:
+        print(json.dumps(InferenceClient(args.socket).call({"op": "stats"})["stats"], indent=2))
+    except OSError as e:
+        print(f"✗ {args.socket}: {e}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-worker coalescing is unavailable
+    fcntl = None
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one execution.
+
+    Threads in the same process wait on the leader's result (or exception).
+    With `lock_dir` set, leaders in different worker processes also
+    serialize on a per-key lock file, and the winner leaves its
+    JSON-serializable result next to the lock for `result_ttl` seconds so
+    the other workers reuse it instead of calling upstream again.
+    """
+
+    def __init__(self, lock_dir=None, lock_timeout=30.0, result_ttl=30.0, prune_every=200):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.prune_every = prune_every
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "coalesced": 0, "shared_hits": 0}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run `fn` once for all concurrent callers of `key`. With `timeout`,
+        a follower gives up waiting after that many seconds (TimeoutError)
+        and a leader waits at most that long for the cross-worker lock.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["leaders"] += 1
+            else:
+                call.waiters += 1
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out after {timeout:.2f}s waiting for in-flight call")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_leader(key, fn, timeout)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def _run_leader(self, key, fn, timeout=None):
+        if not self.lock_dir:
+            return fn()
+        if self.stats["leaders"] % self.prune_every == 0:
+            self.prune()
+
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        lock_path = os.path.join(self.lock_dir, f"{digest}.lock")
+        result_path = os.path.join(self.lock_dir, f"{digest}.json")
+        try:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            lock_file = open(lock_path, "a+")
+        except OSError as e:
+            logging.warning(f"Single-flight lock unavailable at {lock_path}: {e}")
+            return fn()
+
+        with lock_file:
+            locked = self._acquire_file_lock(lock_file, timeout)
+            try:
+                found, result = self._read_result(result_path)
+                if found:
+                    self.stats["shared_hits"] += 1
+                    return result
+                result = fn()
+                self._write_result(result_path, result)
+                return result
+            finally:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _acquire_file_lock(self, lock_file, timeout=None):
+        lock_timeout = self.lock_timeout if timeout is None else min(self.lock_timeout, timeout)
+        deadline = time.monotonic() + lock_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    # Give up on coalescing rather than stall the request.
+                    return False
+                time.sleep(0.05)
+
+    def _read_result(self, path):
+        try:
+            if time.time() - os.path.getmtime(path) > self.result_ttl:
+                return False, None
+            with open(path, "r", encoding="utf-8") as f:
+                return True, json.load(f)
+        except (OSError, ValueError):
+            return False, None
+
+    def _write_result(self, path, result):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.debug(f"Single-flight result not shared: {e}")
+
+    def prune(self, max_age=None):
+        """Delete lock and result files untouched for `max_age` seconds (default 10x result_ttl)."""
+        cutoff = time.time() - (max_age or self.result_ttl * 10)
+        try:
+            names = os.listdir(self.lock_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.lock_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -2,98 +2,42 @@ import math
 import re
 from collections import defaultdict
 
+try:
+    import numpy as np
+    from scipy import sparse
+except Exception:  # pragma: no cover
+    np = None
+    sparse = None
+
+try:
+    from .knowledge_base import KNOWLEDGE_BASE, SPECIES_MATCH_BOOST, SPECIES_MISMATCH_BOOST
+except ImportError:  # when run as a script
+    from knowledge_base import KNOWLEDGE_BASE, SPECIES_MATCH_BOOST, SPECIES_MISMATCH_BOOST
+
 
 def _normalize_text(text):
     return re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())
 
 
-def _tokens(text):
-    return [t for t in _normalize_text(text).split() if t]
-
-
-def _contains_phrase(text, phrase):
-    return phrase in _normalize_text(text)
-
-
-CONDITIONS = [
-    {
-        "name": "Gastrointestinal upset",
-        "species": ["dog", "cat"],
-        "keywords": {
-            "vomit": 2.0, "vomiting": 2.0, "diarrhea": 2.0, "loose stool": 1.6, "nausea": 1.4,
-            "no appetite": 1.8, "dehydration": 1.6, "abdominal pain": 1.5,
-        },
-        "causes": ["Dietary change", "Mild infection", "Food intolerance", "Parasitic irritation"],
-        "recommendation": "Offer fluids, bland diet, monitor stool/vomit frequency; seek vet care if persistent >24h.",
-    },
-    {
-        "name": "Respiratory irritation/infection",
-        "species": ["dog", "cat"],
-        "keywords": {
-            "cough": 2.0, "sneeze": 1.8, "sneezing": 1.8, "nasal discharge": 2.0, "wheeze": 1.8,
-            "breathing": 1.6, "panting": 1.2, "congestion": 1.5, "fever": 1.3,
-        },
-        "causes": ["Upper respiratory infection", "Allergic irritation", "Airway inflammation"],
-        "recommendation": "Keep environment calm and dust-free; monitor breathing effort; consult a vet if worsening.",
-    },
-    {
-        "name": "Dermatitis / skin allergy",
-        "species": ["dog", "cat"],
-        "keywords": {
-            "itch": 2.0, "itchy": 2.0, "scratch": 1.9, "rash": 1.8, "redness": 1.6,
-            "hair loss": 1.9, "skin": 1.4, "hot spot": 1.8, "licking paws": 1.7,
-        },
-        "causes": ["Environmental allergy", "Flea sensitivity", "Contact dermatitis", "Secondary skin infection"],
-        "recommendation": "Prevent self-trauma, check for fleas, and schedule dermatology-focused vet evaluation.",
-    },
-    {
-        "name": "Urinary tract irritation",
-        "species": ["dog", "cat"],
-        "keywords": {
-            "frequent urination": 2.0, "urinate": 1.8, "straining": 2.0, "blood urine": 2.0,
-            "accidents": 1.5, "pain urination": 2.0, "litter box": 1.4,
-        },
-        "causes": ["Urinary infection", "Crystals/stones", "Bladder inflammation"],
-        "recommendation": "Increase water access and seek prompt veterinary urinalysis.",
-    },
-    {
-        "name": "Musculoskeletal pain/injury",
-        "species": ["dog", "cat"],
-        "keywords": {
-            "limp": 2.0, "lameness": 2.0, "joint pain": 1.9, "stiff": 1.6, "not walking": 2.0,
-            "swelling": 1.5, "injury": 1.8, "fracture": 2.0, "sprain": 1.6,
-        },
-        "causes": ["Soft tissue strain", "Joint inflammation", "Trauma"],
-        "recommendation": "Restrict activity and arrange orthopedic exam, especially if non-weight-bearing.",
-    },
-]
-
-
-RED_FLAG_PHRASES = [
-    "not breathing", "breathing hard", "cannot stand", "seizure", "unconscious", "bloody stool",
-    "blood in vomit", "severe lethargy", "collapsed", "poison", "toxin", "severe pain",
-]
-
-
-def _score_condition(text, token_set, condition, species):
-    # Species prior: slight boost if condition supports the current pet species.
-    species_boost = 1.1 if species in condition["species"] else 0.95
-    score = 0.0
-
-    for phrase, weight in condition["keywords"].items():
-        p = phrase.lower()
-        if " " in p:
-            if _contains_phrase(text, p):
-                score += weight
+def _match_text(index, text):
+    """
+    One pass over normalized text. Returns ({condition index: raw keyword
+    score}, number of distinct red-flag phrases present).
+    """
+    hits = defaultdict(list)
+    red_flags = 0
+    for entry_id in index.matcher.find(text):
+        kind, ref, order, weight = index.matcher.entries[entry_id][2]
+        if kind == "red_flag":
+            red_flags += 1
         else:
-            if p in token_set:
-                score += weight
+            hits[ref].append((order, weight))
+    # Sum in keyword-table order so scores (and ties) are independent of text order.
+    scores = {cond: sum(weight for _, weight in sorted(matched)) for cond, matched in hits.items()}
+    return scores, red_flags
 
-    return score * species_boost
 
-
-def _urgency_from_text(text, top_score):
-    red_flags = sum(1 for p in RED_FLAG_PHRASES if _contains_phrase(text, p))
+def _urgency(red_flags, top_score):
     if red_flags >= 1 or top_score >= 6.5:
         return "High"
     if top_score >= 3.2:
@@ -101,25 +45,53 @@ def _urgency_from_text(text, top_score):
     return "Low"
 
 
-def analyze_pet_symptoms_ml(pet, symptoms, k=3):
-    """
-    Lightweight KNN-style prototype classifier.
-    It scores symptom text against condition prototypes and returns top-k matches.
-    """
+def _rank(pet, symptoms):
+    """All matching conditions as (score, condition), best first, plus the red-flag count."""
+    index = KNOWLEDGE_BASE.current()
     text = _normalize_text(symptoms)
-    toks = _tokens(text)
-    token_set = set(toks)
     species = (getattr(pet, "species", "") or "").lower()
+    raw_scores, red_flags = _match_text(index, text)
 
     scored = []
-    for c in CONDITIONS:
-        s = _score_condition(text, token_set, c, species)
+    for cond_index in sorted(raw_scores):
+        c = index.conditions[cond_index]
+        # Species prior: slight boost if condition supports the current pet species.
+        s = raw_scores[cond_index] * (SPECIES_MATCH_BOOST if species in c.species else SPECIES_MISMATCH_BOOST)
         if s > 0:
             scored.append((s, c))
 
     scored.sort(key=lambda x: x[0], reverse=True)
-    top = scored[:k]
+    return scored, red_flags
+
 
+def analyze_pet_symptoms_ml(pet, symptoms, k=3):
+    """
+    Lightweight KNN-style prototype classifier.
+    It scores symptom text against condition prototypes and returns top-k matches.
+    """
+    scored, red_flags = _rank(pet, symptoms)
+    return _build_result(scored[:k], red_flags)
+
+
+def analyze_with_signals(pet, symptoms, k=3):
+    """
+    analyze_pet_symptoms_ml plus the evidence behind it, for routing:
+    (result, {"top_score", "margin", "red_flags", "matches"}).
+    """
+    scored, red_flags = _rank(pet, symptoms)
+    top_score = scored[0][0] if scored else 0.0
+    runner_up = scored[1][0] if len(scored) > 1 else 0.0
+    signals = {
+        "top_score": round(top_score, 3),
+        "margin": round(top_score - runner_up, 3),
+        "red_flags": red_flags,
+        "matches": len(scored),
+    }
+    return _build_result(scored[:k], red_flags), signals
+
+
+def _build_result(top, red_flags):
+    """Response dict from the top (score, condition) pairs, best first."""
     if not top:
         return {
             "diagnosis": ["General non-specific symptoms"],
@@ -129,16 +101,16 @@ def analyze_pet_symptoms_ml(pet, symptoms, k=3):
             "model_used": "KNN-Symptom-Prototype-v1",
         }
 
-    diagnosis = [item[1]["name"] for item in top]
+    diagnosis = [item[1].name for item in top]
     cause_bucket = []
     for _, cond in top:
-        cause_bucket.extend(cond["causes"])
+        cause_bucket.extend(cond.causes)
     # preserve order + uniqueness
     possible_causes = list(dict.fromkeys(cause_bucket))[:6]
 
     top_score = top[0][0]
-    urgency = _urgency_from_text(text, top_score)
-    recommendation = top[0][1]["recommendation"]
+    urgency = _urgency(red_flags, top_score)
+    recommendation = top[0][1].recommendation
 
     return {
         "diagnosis": diagnosis,
@@ -147,3 +119,54 @@ def analyze_pet_symptoms_ml(pet, symptoms, k=3):
         "possible_causes": possible_causes,
         "model_used": "KNN-Symptom-Prototype-v1",
     }
+
+
+def analyze_batch(items, k=3, chunk_size=8192):
+    """
+    Score many (pet, symptoms) pairs at once; results match
+    analyze_pet_symptoms_ml item for item, in input order.
+
+    Each distinct normalized text is matched once. Hits form a sparse
+    document-by-pattern matrix that is multiplied by the precomputed
+    pattern-by-condition weights. Species boosts are applied as one vector
+    per species and the top-k are taken per row. The whole batch is scored
+    against a single knowledge-base version.
+    """
+    items = list(items)
+    index = KNOWLEDGE_BASE.current()
+    if np is None or index.weight_matrix is None:
+        return [analyze_pet_symptoms_ml(pet, symptoms, k) for pet, symptoms in items]
+
+    matcher = index.matcher
+    results = []
+    for offset in range(0, len(items), chunk_size):
+        chunk = items[offset:offset + chunk_size]
+        texts = [_normalize_text(symptoms) for _, symptoms in chunk]
+        species = [(getattr(pet, "species", "") or "").lower() for pet, _ in chunk]
+
+        # Sparse hit matrix, built from one automaton pass per distinct text.
+        distinct = {}
+        row_of = [distinct.setdefault(text, len(distinct)) for text in texts]
+        indptr, indices = [0], []
+        for text in distinct:
+            indices.extend(sorted(matcher.find(text)))
+            indptr.append(len(indices))
+        hits = sparse.csr_matrix(
+            (np.ones(len(indices)), indices, indptr),
+            shape=(len(distinct), len(matcher.entries)),
+        )
+        raw = (hits @ index.weight_matrix).toarray()[row_of]
+        red_flags = (hits @ index.red_flag_vector)[row_of]
+        scores = raw * np.stack([index.species_boost(name) for name in species])
+
+        # Stable sort keeps ties in condition-table order, as in the single-text path.
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        top_scores = np.take_along_axis(scores, order, axis=1)
+        for row in range(len(chunk)):
+            top = [
+                (float(score), index.conditions[cond_index])
+                for score, cond_index in zip(top_scores[row], order[row])
+                if score > 0
+            ]
+            results.append(_build_result(top, int(red_flags[row])))
+    return results
@@ -1,75 +1,84 @@
+"""
+RandomForest symptom classifier trained on synthetic rows generated from the
+knowledge base's condition profiles.
+
+Training is an offline step that writes a versioned artifact (joblib file
+plus a JSON sidecar with checksum and metadata):
+
+    python symptom_rf_model.py build [--out PATH]
+    python symptom_rf_model.py info [PATH]
+    python symptom_rf_model.py verify [--synthetic]
+
+The forests are stored flattened into NumPy arrays and served by
+rf_engine.FlatForest, which matches scikit-learn's predictions bit for bit
+(checked on every build, and on demand with `verify`; `verify --synthetic`
+checks a tiny random forest in a second or two).
+
+Workers load it at startup (load_model) and refuse an artifact built for
+another format, knowledge-base version or scikit-learn version, or one whose
+checksum does not match; a refused artifact is tried again once the file
+changes. Without a usable artifact the model is trained in a background
+thread (SYMPTOM_RF_TRAIN_FALLBACK=background, the default) or left
+unavailable (=off); requests never wait for training. A failed training run
+is retried after SYMPTOM_RF_TRAIN_RETRY_SECONDS (60), doubling per failure
+up to an hour.
+
+With SYMPTOM_RF_SOCKET set, web workers do not load the model at all and
+send their texts to the inference sidecar instead (see rf_inference.py).
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
 import random
 import re
+import threading
+import time
 from collections import Counter
 
 try:
+    import joblib
+    import sklearn
     from sklearn.ensemble import RandomForestClassifier
     from sklearn.feature_extraction.text import TfidfVectorizer
 except Exception:  # pragma: no cover
+    joblib = None
+    sklearn = None
     RandomForestClassifier = None
     TfidfVectorizer = None
 
 
+try:
+    from .knowledge_base import KNOWLEDGE_BASE
+    from .rf_engine import FlatForest, check_parity, export_forest
+    from .rf_inference import InferenceClient
+except ImportError:  # when run as a script
+    from knowledge_base import KNOWLEDGE_BASE
+    from rf_engine import FlatForest, check_parity, export_forest
+    from rf_inference import InferenceClient
+
+
 _RANDOM_SEED = 42
 _MODEL_BUNDLE = None
+_TRAIN_LOCK = threading.Lock()
+_TRAINING = set()  # knowledge-base versions being trained in the background
+_TRAIN_FAILURES = {}  # knowledge-base version -> (failed runs, monotonic time of the next attempt)
+_REFUSED = {}  # knowledge-base version -> (mtime_ns, sha256) of the artifact that failed to load
+_MAX_TRAIN_RETRY_SECONDS = 3600
+
+ARTIFACT_FORMAT = "symptom-rf/2"
+DEFAULT_ARTIFACT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "symptom_rf.joblib")
+TRAINING_PARAMS = {"n_rows": 1400, "seed": _RANDOM_SEED, "diag_trees": 260, "urg_trees": 180, "max_features": 3500}
 
 
-CONDITION_PROFILES = {
-    "Gastrointestinal upset": {
-        "symptoms": [
-            "vomiting", "diarrhea", "loose stool", "nausea", "no appetite",
-            "abdominal pain", "dehydration", "lethargy",
-        ],
-        "urgency": "Medium",
-        "causes": ["Dietary indiscretion", "Food intolerance", "Mild infection", "Parasites"],
-        "recommendation": "Offer water, bland food, monitor stool/vomit. Visit vet if symptoms persist over 24 hours.",
-    },
-    "Respiratory irritation/infection": {
-        "symptoms": [
-            "cough", "sneezing", "nasal discharge", "wheezing", "fever",
-            "rapid breathing", "congestion", "tired",
-        ],
-        "urgency": "Medium",
-        "causes": ["Upper respiratory infection", "Allergy", "Airway inflammation"],
-        "recommendation": "Keep pet warm and hydrated. Seek veterinary exam if breathing effort increases.",
-    },
-    "Dermatitis / skin allergy": {
-        "symptoms": [
-            "itchy skin", "scratching", "rash", "red patches", "hair loss",
-            "licking paws", "hot spot", "skin irritation",
-        ],
-        "urgency": "Low",
-        "causes": ["Flea allergy", "Food allergy", "Environmental allergy", "Skin infection"],
-        "recommendation": "Prevent scratching, check for fleas, and schedule a skin-focused veterinary check.",
-    },
-    "Urinary tract irritation": {
-        "symptoms": [
-            "frequent urination", "straining to urinate", "blood in urine", "painful urination",
-            "accidents indoors", "licking genitals", "small urine amounts",
-        ],
-        "urgency": "High",
-        "causes": ["Urinary tract infection", "Bladder inflammation", "Urinary crystals"],
-        "recommendation": "Increase water intake and consult a vet quickly for urinalysis.",
-    },
-    "Musculoskeletal pain/injury": {
-        "symptoms": [
-            "limping", "lameness", "joint pain", "stiffness", "difficulty walking",
-            "swelling", "pain when touched", "reduced activity",
-        ],
-        "urgency": "Medium",
-        "causes": ["Soft tissue strain", "Joint inflammation", "Trauma"],
-        "recommendation": "Restrict movement and arrange orthopedic evaluation.",
-    },
-    "Fever / systemic infection risk": {
-        "symptoms": [
-            "high fever", "extreme lethargy", "not eating", "shivering", "weakness",
-            "dehydration", "rapid heartbeat", "dull behavior",
-        ],
-        "urgency": "High",
-        "causes": ["Systemic infection", "Inflammatory condition", "Vector-borne disease"],
-        "recommendation": "High priority veterinary assessment is recommended as soon as possible.",
-    },
-}
+# Set in web workers that delegate inference to the sidecar process.
+SIDECAR = InferenceClient.from_env()
+
+
+class ArtifactMismatch(ValueError):
+    pass
+
 
 NOISE_TERMS = [
     "since morning", "for two days", "after meal", "at night", "mild", "severe",
@@ -83,98 +92,355 @@ def _clean_text(text):
     return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9\s]", " ", (text or "").lower())).strip()
 
 
-def _generate_synthetic_dataset(n_rows=1400):
-    random.seed(_RANDOM_SEED)
-    rows = []
-    labels_diag = []
-    labels_urg = []
-
-    condition_names = list(CONDITION_PROFILES.keys())
+def iter_synthetic_rows(profiles, n_rows, rng):
+    """Yield (text, diagnosis, urgency) rows drawn from the condition profiles with `rng` (a random.Random)."""
+    condition_names = list(profiles.keys())
     for _ in range(n_rows):
-        diagnosis = random.choice(condition_names)
-        profile = CONDITION_PROFILES[diagnosis]
-        base = random.sample(profile["symptoms"], k=min(4, len(profile["symptoms"])))
-        extras = random.sample(NOISE_TERMS, k=random.randint(1, 3))
+        diagnosis = rng.choice(condition_names)
+        profile = profiles[diagnosis]
+        base = rng.sample(profile["symptoms"], k=min(4, len(profile["symptoms"])))
+        extras = rng.sample(NOISE_TERMS, k=rng.randint(1, 3))
 
         # Inject mild cross-condition noise so the model learns separation.
-        if random.random() < 0.2:
-            other = random.choice([c for c in condition_names if c != diagnosis])
-            base.append(random.choice(CONDITION_PROFILES[other]["symptoms"]))
+        if rng.random() < 0.2:
+            other = rng.choice([c for c in condition_names if c != diagnosis])
+            base.append(rng.choice(profiles[other]["symptoms"]))
 
-        species = random.choice(SPECIES_OPTIONS)
-        age = random.randint(1, 14)
+        species = rng.choice(SPECIES_OPTIONS)
+        age = rng.randint(1, 14)
         sentence = f"{species} age {age} has " + ", ".join(base + extras)
-        rows.append(_clean_text(sentence))
-        labels_diag.append(diagnosis)
-        labels_urg.append(profile["urgency"])
+        yield _clean_text(sentence), diagnosis, profile["urgency"]
 
+
+def _generate_synthetic_dataset(profiles, n_rows=1400):
+    rows, labels_diag, labels_urg = [], [], []
+    for text, diagnosis, urgency in iter_synthetic_rows(profiles, n_rows, random.Random(_RANDOM_SEED)):
+        rows.append(text)
+        labels_diag.append(diagnosis)
+        labels_urg.append(urgency)
     return rows, labels_diag, labels_urg
 
 
-def _train_once():
-    global _MODEL_BUNDLE
-    if _MODEL_BUNDLE is not None:
-        return _MODEL_BUNDLE
+def artifact_path():
+    return os.environ.get("SYMPTOM_RF_ARTIFACT") or DEFAULT_ARTIFACT_PATH
+
+
+def _metadata_path(path):
+    return path + ".json"
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parity_texts(index, n_rows=2000):
+    """Synthetic training-style rows plus random word salad, for engine parity checks."""
+    rows, _, _ = _generate_synthetic_dataset(index.profiles, n_rows)
+    rng = random.Random(_RANDOM_SEED + 1)
+    words = " ".join(rows).split()
+    rows += [" ".join(rng.choice(words) for _ in range(rng.randint(0, 15))) for _ in range(n_rows)]
+    return rows
+
+
+def verify_parity(bundle, texts):
+    """Rows (per forest) where the flattened engines differ from scikit-learn; all zeros when in parity."""
+    x = bundle["vectorizer"].transform(texts)
+    mismatches = {}
+    for name in ("diag", "urg"):
+        engine = FlatForest(export_forest(bundle[f"{name}_model"]))
+        mismatches[name] = check_parity(bundle[f"{name}_model"], engine, x)
+        # Single-row inference takes a separate path in the engine.
+        mismatches[name] += sum(check_parity(bundle[f"{name}_model"], engine, x[i:i + 1]) for i in range(0, x.shape[0], 40))
+    return mismatches
+
+
+def synthetic_parity(seed=_RANDOM_SEED):
+    """verify_parity's counts for small forests fitted on random dense and sparse data."""
+    import numpy as np
+    from scipy import sparse
+
+    rng = np.random.default_rng(seed)
+    X = rng.random((300, 24))
+    X[X < 0.6] = 0.0  # TF-IDF-like: mostly zeros
+    y = rng.integers(0, 4, size=300)
+    mismatches = {}
+    for name, data in (("dense", X), ("sparse", sparse.csr_matrix(X))):
+        forest = RandomForestClassifier(n_estimators=12, max_depth=8, random_state=seed).fit(data, y)
+        engine = FlatForest(export_forest(forest))
+        mismatches[name] = check_parity(forest, engine, data)
+        mismatches[name] += sum(check_parity(forest, engine, data[i:i + 1]) for i in range(0, data.shape[0], 25))
+    return mismatches
+
+
+def _compile(bundle, index):
+    """Serving bundle: vectorizer plus flattened forests, no scikit-learn estimators."""
+    return {
+        "version": index.version,
+        "profiles": index.profiles,
+        "vectorizer": bundle["vectorizer"],
+        "diag_engine": FlatForest(export_forest(bundle["diag_model"])),
+        "urg_engine": FlatForest(export_forest(bundle["urg_model"])),
+    }
+
+
+def build_artifact(index, path, n_jobs=-1):
+    """Train for knowledge-base `index` and write the artifact atomically; returns its metadata."""
+    if joblib is None:
+        raise RuntimeError("scikit-learn is not available for RandomForest symptom analysis")
+    started = time.monotonic()
+    bundle = _train(index, n_jobs=n_jobs)
+    parity_texts = _parity_texts(index)
+    mismatches = verify_parity(bundle, parity_texts)
+    if any(mismatches.values()):
+        raise RuntimeError(f"Flattened forests disagree with scikit-learn: {mismatches}")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump({
+        "vectorizer": bundle["vectorizer"],
+        "diag_arrays": export_forest(bundle["diag_model"]),
+        "urg_arrays": export_forest(bundle["urg_model"]),
+    }, tmp_path)
+    metadata = {
+        "format": ARTIFACT_FORMAT,
+        "knowledge_base_version": index.version,
+        "sklearn_version": sklearn.__version__,
+        "training": TRAINING_PARAMS,
+        "classes": [str(c) for c in bundle["diag_model"].classes_],
+        "sha256": _sha256(tmp_path),
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "train_seconds": round(time.monotonic() - started, 2),
+        "parity_checked_rows": len(parity_texts),
+    }
+    with open(_metadata_path(tmp_path), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+    os.replace(_metadata_path(tmp_path), _metadata_path(path))
+    return metadata
 
+
+def read_metadata(path):
+    try:
+        with open(_metadata_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        raise ArtifactMismatch(f"no readable metadata for {path}: {e}")
+
+
+def load_artifact(path, index):
+    """Load and verify the artifact for `index`; raises ArtifactMismatch if it does not fit."""
+    if joblib is None:
+        raise ArtifactMismatch("scikit-learn is not installed")
+    metadata = read_metadata(path)
+    expected = {
+        "format": ARTIFACT_FORMAT,
+        "knowledge_base_version": index.version,
+        "sklearn_version": sklearn.__version__,
+    }
+    for key, value in expected.items():
+        if metadata.get(key) != value:
+            raise ArtifactMismatch(f"{key} is {metadata.get(key)!r}, expected {value!r}")
+    if _sha256(path) != metadata.get("sha256"):
+        raise ArtifactMismatch(f"checksum mismatch for {path}")
+    # mmap_mode shares the tree arrays between workers through the page cache.
+    stored = joblib.load(path, mmap_mode="r")
+    return {
+        "version": index.version,
+        "profiles": index.profiles,
+        "metadata": metadata,
+        "vectorizer": stored["vectorizer"],
+        "diag_engine": FlatForest(stored["diag_arrays"]),
+        "urg_engine": FlatForest(stored["urg_arrays"]),
+    }
+
+
+def _artifact_signature(path, with_hash=True):
+    """(mtime_ns, sha256) of the artifact file, (None, None) if it is missing."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        return mtime, (_sha256(path) if with_hash else None)
+    except OSError:
+        return None, None
+
+
+def _artifact_changed(version, path):
+    """True if the artifact refused for `version` has been replaced since. Hashes only when the mtime moved."""
+    refused_mtime, refused_sha = _REFUSED[version]
+    mtime, _ = _artifact_signature(path, with_hash=False)
+    if mtime == refused_mtime:
+        return False
+    mtime, sha = _artifact_signature(path)
+    if sha == refused_sha:
+        _REFUSED[version] = (mtime, sha)  # touched, same content
+        return False
+    return True
+
+
+def _train_in_background(index):
+    def run():
+        global _MODEL_BUNDLE
+        try:
+            # One core only: this runs inside a web worker.
+            bundle = _compile(_train(index, n_jobs=1), index)
+            bundle["metadata"] = {"format": ARTIFACT_FORMAT, "knowledge_base_version": index.version, "source": "in-process"}
+            with _TRAIN_LOCK:
+                _MODEL_BUNDLE = bundle
+                _TRAIN_FAILURES.pop(index.version, None)
+            logging.info(f"RandomForest model trained in-process for knowledge base {index.version}")
+        except Exception as e:
+            with _TRAIN_LOCK:
+                failures = _TRAIN_FAILURES.get(index.version, (0, 0.0))[0] + 1
+                delay = min(float(os.environ.get("SYMPTOM_RF_TRAIN_RETRY_SECONDS", 60)) * 2 ** (failures - 1),
+                            _MAX_TRAIN_RETRY_SECONDS)
+                _TRAIN_FAILURES[index.version] = (failures, time.monotonic() + delay)
+            logging.warning(f"RandomForest background training failed ({failures}x), retrying in {delay:.0f}s: {e}")
+        finally:
+            with _TRAIN_LOCK:
+                _TRAINING.discard(index.version)
+
+    with _TRAIN_LOCK:
+        if index.version in _TRAINING:
+            return
+        failed = _TRAIN_FAILURES.get(index.version)
+        if failed is not None and time.monotonic() < failed[1]:
+            return
+        _TRAINING.add(index.version)
+    threading.Thread(target=run, name="symptom-rf-train", daemon=True).start()
+
+
+def load_model(index=None):
+    """
+    Make the model for `index` (default: the live knowledge base) available:
+    from the artifact if it matches, else per SYMPTOM_RF_TRAIN_FALLBACK.
+    Returns the bundle, or None while it is not ready.
+    """
+    global _MODEL_BUNDLE
+    index = index or KNOWLEDGE_BASE.current()
+    bundle = _MODEL_BUNDLE
+    if bundle is not None and bundle["version"] == index.version:
+        return bundle
     if RandomForestClassifier is None or TfidfVectorizer is None:
-        _MODEL_BUNDLE = None
         return None
 
-    x_text, y_diag, y_urg = _generate_synthetic_dataset()
-    vectorizer = TfidfVectorizer(ngram_range=(1, 2), max_features=3500)
+    with _TRAIN_LOCK:
+        if _MODEL_BUNDLE is not None and _MODEL_BUNDLE["version"] == index.version:
+            return _MODEL_BUNDLE
+        path = artifact_path()
+        if index.version not in _REFUSED or _artifact_changed(index.version, path):
+            try:
+                _MODEL_BUNDLE = load_artifact(path, index)
+                _REFUSED.pop(index.version, None)
+                logging.info(f"RandomForest artifact loaded from {path} (knowledge base {index.version})")
+                return _MODEL_BUNDLE
+            except (ArtifactMismatch, OSError) as e:
+                _REFUSED[index.version] = _artifact_signature(path)
+                logging.warning(f"Refusing RandomForest artifact {path}: {e}")
+
+    if os.environ.get("SYMPTOM_RF_TRAIN_FALLBACK", "background").lower() == "background":
+        _train_in_background(index)
+    return None
+
+
+def wait_for_model(index=None, timeout=None):
+    """
+    load_model(), then wait up to `timeout` seconds for background training
+    to finish. For boot-time warm-up only; requests must never wait.
+    """
+    index = index or KNOWLEDGE_BASE.current()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    bundle = load_model(index)
+    while bundle is None and index.version in _TRAINING:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        time.sleep(0.1)
+        current = _MODEL_BUNDLE
+        if current is not None and current["version"] == index.version:
+            bundle = current
+    return bundle
+
+
+def reset_after_fork():
+    """
+    Per-worker reset for forking servers. A training thread running in the
+    parent at fork time does not exist in the child, but its entry in
+    _TRAINING does, and it may have held _TRAIN_LOCK; either would keep this
+    worker without a model for good. Start from a fresh lock and load again.
+    """
+    global _TRAIN_LOCK
+    _TRAIN_LOCK = threading.Lock()
+    _TRAINING.clear()
+    if SIDECAR is None:
+        load_model()
+
+
+def _train(index, n_jobs=1):
+    x_text, y_diag, y_urg = _generate_synthetic_dataset(index.profiles, TRAINING_PARAMS["n_rows"])
+    vectorizer = TfidfVectorizer(ngram_range=(1, 2), max_features=TRAINING_PARAMS["max_features"])
     x = vectorizer.fit_transform(x_text)
 
     diag_model = RandomForestClassifier(
-        n_estimators=260,
+        n_estimators=TRAINING_PARAMS["diag_trees"],
         random_state=_RANDOM_SEED,
         class_weight="balanced_subsample",
-        n_jobs=-1,
+        n_jobs=n_jobs,
     )
     diag_model.fit(x, y_diag)
 
     urg_model = RandomForestClassifier(
-        n_estimators=180,
+        n_estimators=TRAINING_PARAMS["urg_trees"],
         random_state=_RANDOM_SEED,
         class_weight="balanced_subsample",
-        n_jobs=-1,
+        n_jobs=n_jobs,
     )
     urg_model.fit(x, y_urg)
 
-    _MODEL_BUNDLE = {
+    return {
+        "version": index.version,
+        "profiles": index.profiles,
         "vectorizer": vectorizer,
         "diag_model": diag_model,
         "urg_model": urg_model,
     }
-    return _MODEL_BUNDLE
 
 
-def analyze_pet_symptoms_rf(pet, symptoms):
-    bundle = _train_once()
+def predict_texts(texts, index=None):
+    """(diagnosis, urgency, confidence) for each cleaned input text, scored in one vectorized pass."""
+    bundle = load_model(index)
     if bundle is None:
-        raise RuntimeError("scikit-learn is not available for RandomForest symptom analysis")
+        raise RuntimeError("RandomForest symptom model is not loaded")
+    x = bundle["vectorizer"].transform(texts)
+    diag_engine = bundle["diag_engine"]
+    probs = diag_engine.predict_proba(x)
+    diagnoses = diag_engine.classes_.take(probs.argmax(axis=1), axis=0)
+    urgencies = bundle["urg_engine"].predict(x)
+    return [
+        (str(diagnosis), str(urgency), round(float(confidence), 3))
+        for diagnosis, urgency, confidence in zip(diagnoses, urgencies, probs.max(axis=1))
+    ]
+
 
+def analyze_pet_symptoms_rf(pet, symptoms):
+    index = KNOWLEDGE_BASE.current()
     species = (getattr(pet, "species", "") or "").lower()
     age = getattr(pet, "age", "")
     input_text = _clean_text(f"{species} age {age} {symptoms}")
 
-    x = bundle["vectorizer"].transform([input_text])
-    diagnosis = bundle["diag_model"].predict(x)[0]
-    urgency = bundle["urg_model"].predict(x)[0]
+    if SIDECAR is not None:
+        diagnosis, urgency, confidence = SIDECAR.predict(input_text, index.version)
+    else:
+        diagnosis, urgency, confidence = predict_texts([input_text], index)[0]
 
     # Top causes/reco from condition profile.
-    profile = CONDITION_PROFILES.get(diagnosis, {})
-    possible_causes = profile.get("causes", ["Unknown"])
+    profile = index.profiles.get(diagnosis, {})
+    possible_causes = list(profile.get("causes", ["Unknown"]))
     recommendation = profile.get(
         "recommendation",
         "Please consult a veterinarian for a full clinical examination.",
     )
 
-    # Optional confidence proxy from class probabilities.
-    confidence = None
-    if hasattr(bundle["diag_model"], "predict_proba"):
-        probs = bundle["diag_model"].predict_proba(x)[0]
-        confidence = float(max(probs))
-
     result = {
         "diagnosis": [diagnosis],
         "urgency_level": urgency,
@@ -183,5 +449,54 @@ def analyze_pet_symptoms_rf(pet, symptoms):
         "model_used": "RandomForest-Synthetic-v1",
     }
     if confidence is not None:
-        result["confidence"] = round(confidence, 3)
+        result["confidence"] = confidence  # class probability, as a confidence proxy
     return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect the RandomForest symptom model artifact.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="train on the current knowledge base and write the artifact")
+    build_cmd.add_argument("--out", default=None, help="artifact path (default: SYMPTOM_RF_ARTIFACT or instance/symptom_rf.joblib)")
+    build_cmd.add_argument("--jobs", type=int, default=-1, help="training processes (default: all cores)")
+    info_cmd = sub.add_parser("info", help="print artifact metadata and whether this process would load it")
+    info_cmd.add_argument("path", nargs="?", default=None)
+    verify_cmd = sub.add_parser("verify", help="train in-process and check the flattened engines against scikit-learn")
+    verify_cmd.add_argument("--synthetic", action="store_true", help="check tiny random forests instead of the real model")
+    args = parser.parse_args(argv)
+
+    if args.command == "verify" and args.synthetic:
+        mismatches = synthetic_parity()
+        ok = not any(mismatches.values())
+        print(f"{'✓' if ok else '✗'} synthetic forests, mismatching rows: {mismatches}")
+        raise SystemExit(0 if ok else 1)
+
+    index = KNOWLEDGE_BASE.current()
+    if args.command == "verify":
+        texts = _parity_texts(index)
+        mismatches = verify_parity(_train(index, n_jobs=-1), texts)
+        ok = not any(mismatches.values())
+        print(f"{'✓' if ok else '✗'} {len(texts)} texts, mismatching rows: {mismatches}")
+        raise SystemExit(0 if ok else 1)
+
+    if args.command == "build":
+        path = args.out or artifact_path()
+        metadata = build_artifact(index, path, n_jobs=args.jobs)
+        print(f"✓ {path} (knowledge base {index.version}, {metadata['train_seconds']}s, sha256 {metadata['sha256'][:12]})")
+        return
+
+    path = args.path or artifact_path()
+    try:
+        load_artifact(path, index)
+        status = "✓ loadable"
+    except (ArtifactMismatch, OSError) as e:
+        status = f"✗ refused: {e}"
+    try:
+        print(json.dumps(read_metadata(path), indent=2))
+    except ArtifactMismatch:
+        pass
+    print(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+Out-of-core training for the symptom classifiers.
+
+Labeled rows are streamed in chunks, either from HealthHistory (keyset
+pagination, so memory stays flat however many rows there are) or from the
+synthetic profile generator. Each chunk is featurized with a stateless
+HashingVectorizer in a process pool and fed to incremental learners through
+partial_fit. Every chunk is scored before the model learns from it
+(progressive validation), which gives an accuracy estimate without keeping
+a held-out copy of the data.
+
+    python symptom_training.py train [--source history|synthetic] [--rows N]
+        [--chunk-size N] [--workers N] [--learner sgd|nb] [--out PATH]
+    python symptom_training.py info [PATH]
+
+The artifact is a joblib file with a JSON sidecar, like the RandomForest
+one. Serving still uses the RandomForest artifact (symptom_rf_model.py).
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+try:
+    import joblib
+    import numpy as np
+    import sklearn
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.naive_bayes import ComplementNB
+except Exception:  # pragma: no cover
+    joblib = None
+    np = None
+    sklearn = None
+    HashingVectorizer = None
+    SGDClassifier = None
+    ComplementNB = None
+
+try:
+    from .knowledge_base import KNOWLEDGE_BASE
+    from .models import as_text_list, normalize_name
+    from .symptom_rf_model import _RANDOM_SEED, _clean_text, _metadata_path, _sha256, iter_synthetic_rows
+except ImportError:  # when run as a script
+    from knowledge_base import KNOWLEDGE_BASE
+    from models import as_text_list, normalize_name
+    from symptom_rf_model import _RANDOM_SEED, _clean_text, _metadata_path, _sha256, iter_synthetic_rows
+
+
+ARTIFACT_FORMAT = "symptom-stream/1"
+DEFAULT_ARTIFACT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "symptom_stream.joblib")
+HASH_FEATURES = 2 ** 20
+URGENCY_LEVELS = ("High", "Low", "Medium")
+
+
+def make_vectorizer():
+    # Stateless: every worker process builds the same features without a fitted vocabulary.
+    return HashingVectorizer(ngram_range=(1, 2), n_features=HASH_FEATURES, alternate_sign=False, norm="l2")
+
+
+_VECTORIZER = None
+
+
+def _featurize(texts):
+    global _VECTORIZER
+    if _VECTORIZER is None:
+        _VECTORIZER = make_vectorizer()
+    return _VECTORIZER.transform(texts)
+
+
+class Chunk:
+    __slots__ = ("texts", "diagnoses", "urgencies")
+
+    def __init__(self):
+        self.texts = []
+        self.diagnoses = []
+        self.urgencies = []  # None where the row has no usable urgency label
+
+    def __len__(self):
+        return len(self.texts)
+
+
+def synthetic_chunks(profiles, n_rows, chunk_size, seed=_RANDOM_SEED):
+    """Synthetic rows from the condition profiles, `chunk_size` at a time."""
+    rng = random.Random(seed)
+    chunk = Chunk()
+    for text, diagnosis, urgency in iter_synthetic_rows(profiles, n_rows, rng):
+        chunk.texts.append(text)
+        chunk.diagnoses.append(diagnosis)
+        chunk.urgencies.append(urgency)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = Chunk()
+    if len(chunk):
+        yield chunk
+
+
+def _label(raw_diagnosis, classes_by_key):
+    """First stored diagnosis that names a known condition, or None."""
+    for value in as_text_list(raw_diagnosis):
+        name = classes_by_key.get(normalize_name(value))
+        if name is not None:
+            return name
+    return None
+
+
+def history_chunks(engine, history_table, pet_table, classes, chunk_size, max_rows=None, counts=None):
+    """
+    Labeled HealthHistory rows, `chunk_size` at a time, read by primary-key
+    ranges so no query holds more than one chunk. Rows whose diagnosis is not
+    one of `classes`, and image-analysis rows, are skipped and counted in
+    `counts`.
+    """
+    from sqlalchemy import select
+
+    h, p = history_table, pet_table
+    classes_by_key = {normalize_name(name): name for name in classes}
+    counts = counts if counts is not None else Counter()
+    last_id, seen = 0, 0
+    while max_rows is None or seen < max_rows:
+        query = (
+            select(h.c.id, h.c.symptoms, h.c.diagnosis, h.c.urgency_level, p.c.species, p.c.age)
+            .join(p, p.c.id == h.c.pet_id)
+            .where(h.c.id > last_id)
+            .order_by(h.c.id)
+            .limit(chunk_size if max_rows is None else min(chunk_size, max_rows - seen))
+        )
+        with engine.connect() as conn:
+            rows = conn.execute(query).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        seen += len(rows)
+        chunk = Chunk()
+        for row in rows:
+            symptoms = row.symptoms or ""
+            if symptoms.startswith(("ImageHash:", "Image analysis")):
+                counts["skipped_image_rows"] += 1
+                continue
+            diagnosis = _label(row.diagnosis, classes_by_key)
+            if diagnosis is None:
+                counts["skipped_unknown_diagnosis"] += 1
+                continue
+            urgency = (row.urgency_level or "").strip().capitalize()
+            chunk.texts.append(_clean_text(f"{(row.species or '').lower()} age {row.age} {symptoms}"))
+            chunk.diagnoses.append(diagnosis)
+            chunk.urgencies.append(urgency if urgency in URGENCY_LEVELS else None)
+        if len(chunk):
+            yield chunk
+
+
+def _featurized(chunks, workers):
+    """(chunk, features) in order, featurizing up to 2 * workers chunks ahead in a process pool."""
+    if workers <= 1:
+        for chunk in chunks:
+            yield chunk, _featurize(chunk.texts)
+        return
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(_featurize, chunk.texts)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+def make_learner(kind):
+    if kind == "nb":
+        return ComplementNB(alpha=0.1)
+    return SGDClassifier(loss="log_loss", alpha=1e-5, random_state=_RANDOM_SEED)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KiB on Linux
+
+
+def train_stream(chunks, diag_classes, learner="sgd", workers=1, log_every=10):
+    """
+    Fit diagnosis and urgency learners over `chunks` in one pass. Returns
+    (diag_model, urg_model, stats); urg_model is None if no row had a
+    usable urgency label.
+    """
+    diag_classes = np.asarray(sorted(set(diag_classes)))
+    urg_classes = np.asarray(URGENCY_LEVELS)
+    diag_model, urg_model = make_learner(learner), make_learner(learner)
+    urg_fitted = False  # history chunks can have no urgency labels at all
+    stats = Counter()
+    fit_seconds = wait_seconds = 0.0
+    started = time.monotonic()
+
+    features = _featurized(chunks, workers)
+    while True:
+        waited = time.monotonic()
+        try:
+            chunk, x = next(features)
+        except StopIteration:
+            break
+        wait_seconds += time.monotonic() - waited
+
+        fit_started = time.monotonic()
+        y_diag = np.asarray(chunk.diagnoses)
+        urg_mask = np.asarray([u is not None for u in chunk.urgencies])
+        y_urg = np.asarray([u for u in chunk.urgencies if u is not None])
+        if stats["chunks"]:
+            # Progressive validation: score on data the model has not seen yet.
+            stats["diag_correct"] += int((diag_model.predict(x) == y_diag).sum())
+            if y_urg.size and urg_fitted:
+                stats["urg_correct"] += int((urg_model.predict(x[urg_mask]) == y_urg).sum())
+                stats["urg_scored"] += y_urg.size
+            stats["diag_scored"] += len(y_diag)
+        diag_model.partial_fit(x, y_diag, classes=diag_classes)
+        if y_urg.size:
+            urg_model.partial_fit(x[urg_mask], y_urg, classes=urg_classes)
+            urg_fitted = True
+        fit_seconds += time.monotonic() - fit_started
+
+        stats["chunks"] += 1
+        stats["rows"] += len(chunk)
+        if log_every and stats["chunks"] % log_every == 0:
+            elapsed = time.monotonic() - started
+            logging.info(f"{stats['rows']} rows in {elapsed:.1f}s ({stats['rows'] / elapsed:.0f} rows/s)")
+
+    elapsed = time.monotonic() - started
+    summary = {
+        "rows": stats["rows"],
+        "chunks": stats["chunks"],
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(stats["rows"] / elapsed) if elapsed else None,
+        "fit_seconds": round(fit_seconds, 2),
+        "featurize_wait_seconds": round(wait_seconds, 2),  # time the learner sat idle waiting for features
+        "workers": workers,
+        "peak_rss_mb": _peak_rss_mb(),
+        "progressive_diag_accuracy": round(stats["diag_correct"] / stats["diag_scored"], 4) if stats["diag_scored"] else None,
+        "progressive_urgency_accuracy": round(stats["urg_correct"] / stats["urg_scored"], 4) if stats["urg_scored"] else None,
+    }
+    if not urg_fitted:
+        logging.warning("No urgency labels in the training data; the artifact has no urgency model")
+    return diag_model, (urg_model if urg_fitted else None), summary
+
+
+def write_artifact(path, diag_model, urg_model, metadata):
+    """Write the models with a checksummed JSON sidecar, atomically; returns the metadata."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump({"vectorizer": make_vectorizer(), "diag_model": diag_model, "urg_model": urg_model}, tmp_path)
+    metadata = dict(
+        metadata,
+        format=ARTIFACT_FORMAT,
+        sklearn_version=sklearn.__version__,
+        sha256=_sha256(tmp_path),
+        built_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    )
+    with open(_metadata_path(tmp_path), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+    os.replace(_metadata_path(tmp_path), _metadata_path(path))
+    return metadata
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream-train the symptom classifiers.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train_cmd = sub.add_parser("train", help="train incrementally and write the artifact")
+    train_cmd.add_argument("--source", choices=("history", "synthetic"), default="history")
+    train_cmd.add_argument("--rows", type=int, default=None, help="stop after N source rows (synthetic default: 100000)")
+    train_cmd.add_argument("--chunk-size", type=int, default=5000)
+    train_cmd.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="featurization processes")
+    train_cmd.add_argument("--learner", choices=("sgd", "nb"), default="sgd")
+    train_cmd.add_argument("--out", default=None, help="artifact path (default: instance/symptom_stream.joblib)")
+    info_cmd = sub.add_parser("info", help="print artifact metadata")
+    info_cmd.add_argument("path", nargs="?", default=DEFAULT_ARTIFACT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        try:
+            with open(_metadata_path(args.path), "r", encoding="utf-8") as f:
+                print(json.dumps(json.load(f), indent=2))
+        except (OSError, ValueError) as e:
+            print(f"✗ {e}")
+            raise SystemExit(1)
+        return
+
+    if joblib is None:
+        print("✗ scikit-learn is not installed")
+        raise SystemExit(1)
+    logging.basicConfig(level=logging.INFO)
+    index = KNOWLEDGE_BASE.current()
+    classes = index.condition_names()
+    counts = Counter()
+
+    if args.source == "synthetic":
+        chunks = synthetic_chunks(index.profiles, args.rows or 100_000, args.chunk_size)
+        classes = list(index.profiles)
+        diag_model, urg_model, stats = train_stream(chunks, classes, args.learner, args.workers)
+    else:
+        os.environ.setdefault("SYMPTOM_RF_TRAIN_FALLBACK", "off")  # importing app must not start RF training here
+        from app import app
+        from models import HealthHistory, PetProfile, db
+
+        with app.app_context():
+            chunks = history_chunks(
+                db.engine, HealthHistory.__table__, PetProfile.__table__, classes,
+                args.chunk_size, max_rows=args.rows, counts=counts,
+            )
+            diag_model, urg_model, stats = train_stream(chunks, classes, args.learner, args.workers)
+    stats.update(counts)
+    if not stats["rows"]:
+        print(f"✗ no labeled rows ({dict(counts)})")
+        raise SystemExit(1)
+
+    path = args.out or DEFAULT_ARTIFACT_PATH
+    write_artifact(path, diag_model, urg_model, {
+        "knowledge_base_version": index.version,
+        "source": args.source,
+        "learner": args.learner,
+        "hash_features": HASH_FEATURES,
+        "classes": [str(c) for c in diag_model.classes_],
+        "stats": stats,
+    })
+    print(f"✓ {path}: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Local-first symptom triage.
+
+The keyword model (and the RandomForest model when scikit-learn is
+installed) answer first. The case is escalated to Gemini only when the
+policy finds it ambiguous, weak, urgent or red-flagged. Every routed
+request is counted by the tier that answered it and the reason it was
+escalated; see TriageRouter.snapshot().
+
+Policy knobs (environment):
+    TRIAGE_MODE               local-first (default) | gemini-only
+    TRIAGE_MIN_SCORE          keyword score the top condition needs (3.0)
+    TRIAGE_MIN_MARGIN         lead over the runner-up condition (1.0)
+    TRIAGE_MIN_CONFIDENCE     RandomForest class probability (0.6)
+    TRIAGE_REQUIRE_RF         escalate when the RandomForest model is unavailable (false)
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+try:
+    from .gemini import analyze_pet_symptoms
+    from .gemini_metrics import RollingHistogram
+    from .symptom_model import analyze_with_signals
+    from .symptom_rf_model import analyze_pet_symptoms_rf
+except ImportError:  # when run as a script
+    from gemini import analyze_pet_symptoms
+    from gemini_metrics import RollingHistogram
+    from symptom_model import analyze_with_signals
+    from symptom_rf_model import analyze_pet_symptoms_rf
+
+
+LOCAL = "local"
+GEMINI = "gemini"
+LOCAL_FALLBACK = "local_fallback"  # escalated, but Gemini could not answer
+URGENT_REASONS = frozenset({"red_flag", "high_urgency"})
+URGENT_RECOMMENDATION = (
+    "These signs can indicate an emergency. Take your pet to a veterinarian or "
+    "emergency clinic now; do not wait to see if they improve."
+)
+
+
+def fallback_analysis(pet, symptoms, reason):
+    """
+    Local answer for a case escalated for `reason` that Gemini could not
+    answer. A case escalated as urgent stays High with a see-a-vet-now
+    recommendation, whatever the local model concluded.
+    """
+    analysis = analyze_with_signals(pet, symptoms)[0]
+    if reason in URGENT_REASONS:
+        analysis["urgency_level"] = "High"
+        analysis["recommendation"] = URGENT_RECOMMENDATION
+    return analysis
+
+
+class TriagePolicy:
+    def __init__(self, mode="local-first", min_score=3.0, min_margin=1.0, min_confidence=0.6, require_rf=False):
+        self.mode = mode
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.min_confidence = min_confidence
+        self.require_rf = require_rf
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=os.environ.get("TRIAGE_MODE", "local-first").lower(),
+            min_score=float(os.environ.get("TRIAGE_MIN_SCORE", 3.0)),
+            min_margin=float(os.environ.get("TRIAGE_MIN_MARGIN", 1.0)),
+            min_confidence=float(os.environ.get("TRIAGE_MIN_CONFIDENCE", 0.6)),
+            require_rf=os.environ.get("TRIAGE_REQUIRE_RF", "").lower() in ("1", "true", "yes"),
+        )
+
+    def escalation_reason(self, local, signals, rf):
+        """Why the case must go to Gemini, or None if the local answer stands."""
+        if self.mode == "gemini-only":
+            return "policy"
+        if signals["red_flags"]:
+            return "red_flag"
+        if not signals["matches"]:
+            return "no_local_match"
+        if local.get("urgency_level") == "High":
+            return "high_urgency"
+        if signals["top_score"] < self.min_score:
+            return "weak_match"
+        if signals["margin"] < self.min_margin:
+            return "ambiguous"
+        if rf is None:
+            return "rf_unavailable" if self.require_rf else None
+        if rf.get("urgency_level") == "High":
+            return "high_urgency"
+        if (rf.get("confidence") or 0.0) < self.min_confidence:
+            return "low_confidence"
+        if rf["diagnosis"][0] != local["diagnosis"][0]:
+            return "models_disagree"
+        return None
+
+
+class TriageRouter:
+    def __init__(self, policy, window_seconds=900):
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._tiers = Counter()
+        self._reasons = Counter()
+        self._latency = {}
+        self.window_seconds = window_seconds
+
+    def try_local(self, pet, symptoms):
+        """
+        (local analysis, escalation reason). The reason is None when the local
+        answer may be returned as is; otherwise the analysis is only a preview.
+        """
+        local, signals = analyze_with_signals(pet, symptoms)
+        rf = None
+        if self.policy.mode != "gemini-only":
+            try:
+                rf = analyze_pet_symptoms_rf(pet, symptoms)
+            except Exception as e:
+                logging.debug(f"RandomForest triage unavailable: {e}")
+        reason = self.policy.escalation_reason(local, signals, rf)
+        if reason is None and rf is not None:
+            local["confidence"] = rf.get("confidence")
+        return local, reason
+
+    def route(self, pet, symptoms):
+        """Answer one symptom check; returns (analysis, {"tier", "reason"})."""
+        started = time.monotonic()
+        analysis, reason = self.try_local(pet, symptoms)
+        tier = LOCAL
+        if reason is not None:
+            failed = []
+
+            def local_fallback(pet, symptoms):
+                failed.append(True)
+                return fallback_analysis(pet, symptoms, reason)
+
+            analysis = analyze_pet_symptoms(pet, symptoms, fallback=local_fallback)
+            tier = LOCAL_FALLBACK if failed else GEMINI
+        decision = {"tier": tier, "reason": reason}
+        self.record(decision, time.monotonic() - started)
+        return analysis, decision
+
+    def record(self, decision, seconds):
+        with self._lock:
+            self._tiers[decision["tier"]] += 1
+            if decision.get("reason"):
+                self._reasons[decision["reason"]] += 1
+            histogram = self._latency.get(decision["tier"])
+            if histogram is None:
+                histogram = self._latency[decision["tier"]] = RollingHistogram(self.window_seconds)
+            histogram.add(round(seconds * 1000, 1))
+
+    def snapshot(self):
+        with self._lock:
+            total = sum(self._tiers.values())
+            return {
+                "mode": self.policy.mode,
+                "requests": total,
+                "tiers": dict(self._tiers),
+                "local_share": round(self._tiers[LOCAL] / total, 3) if total else None,
+                "escalation_reasons": dict(self._reasons),
+                "latency_ms": {tier: h.summary() for tier, h in self._latency.items()},
+            }
+
+
+TRIAGE_ROUTER = TriageRouter(
+    TriagePolicy.from_env(),
+    window_seconds=float(os.environ.get("GEMINI_METRICS_WINDOW", 900)),
+)
@@ -0,0 +1,91 @@
+"""
+Boot-time warm-up for forking servers.
+
+With preload_app (see gunicorn.conf.py) the master imports the app once and
+calls warmup(). That compiles the knowledge base, loads the RandomForest
+bundle (waiting for training if there is no artifact), loads the
+explanation catalog and resolves the Gemini model. It then freezes
+everything allocated so far out of the garbage collector's reach, so the
+collector in a worker never writes to those objects and the pages stay
+shared copy-on-write. Each worker calls after_fork() to drop the
+connections it must not share with its siblings.
+
+    python warmup.py   # run the warm-up once and print the timings
+"""
+import gc
+import json
+import logging
+import os
+import time
+
+try:
+    from . import gemini
+    from .app import EXPLANATION_CATALOG, app
+    from .knowledge_base import KNOWLEDGE_BASE
+    from .models import db
+    from .symptom_model import analyze_pet_symptoms_ml
+    from .symptom_rf_model import SIDECAR, predict_texts, reset_after_fork as reset_rf_after_fork, wait_for_model
+except ImportError:  # when run as a script
+    import gemini
+    from app import EXPLANATION_CATALOG, app
+    from knowledge_base import KNOWLEDGE_BASE
+    from models import db
+    from symptom_model import analyze_pet_symptoms_ml
+    from symptom_rf_model import SIDECAR, predict_texts, reset_after_fork as reset_rf_after_fork, wait_for_model
+
+
+class _Pet:
+    species = "dog"
+    breed = "Mixed"
+    age = 3
+    name = "Warmup"
+    medical_notes = ""
+
+
+def _timed(timings, step, fn):
+    started = time.monotonic()
+    try:
+        result = fn()
+    except Exception as e:
+        logging.warning(f"Warm-up step {step} failed: {e}")
+        result = None
+    timings[step] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+def warmup(rf_timeout=None):
+    """Build everything a request needs, then gc.freeze(); returns {step: milliseconds}."""
+    timings = {}
+    index = _timed(timings, "knowledge_base", KNOWLEDGE_BASE.current)
+    _timed(timings, "keyword_model", lambda: analyze_pet_symptoms_ml(_Pet(), "vomiting and lethargy"))
+    if SIDECAR is None:
+        rf_timeout = float(os.environ.get("WARMUP_RF_TIMEOUT", 300)) if rf_timeout is None else rf_timeout
+        bundle = _timed(timings, "rf_model", lambda: wait_for_model(index, timeout=rf_timeout))
+        if bundle is not None:
+            # Touch the vectorizer and every tree array so their pages are resident before the fork.
+            _timed(timings, "rf_predict", lambda: predict_texts(["dog age 3 vomiting and lethargy"], index))
+    with app.app_context():
+        _timed(timings, "explanation_catalog", EXPLANATION_CATALOG.load)
+    _timed(timings, "gemini_model", gemini.warm_up)
+
+    started = time.monotonic()
+    gc.collect()
+    gc.freeze()
+    timings["gc_freeze"] = round((time.monotonic() - started) * 1000, 1)
+    logging.info(f"Warm-up done, {gc.get_freeze_count()} objects frozen: {timings}")
+    return timings
+
+
+def after_fork():
+    """Per-worker reset: connections and pools opened in the master must not be shared."""
+    with app.app_context():
+        # close=False: leave the parent's sockets alone, just stop using them here.
+        db.engine.dispose(close=False)
+    gemini.reset_after_fork()
+    # Training the master had not finished before the fork is restarted here.
+    reset_rf_after_fork()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(warmup(), indent=2))